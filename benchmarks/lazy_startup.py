@@ -0,0 +1,106 @@
+"""Startup-time benchmark comparing eager and lazy code generation on a
+large generated MyPL program where a run only touches a few functions.
+
+Usage: python benchmarks/lazy_startup.py [--functions N] [--repeat R]
+
+NAME: David Giacobbi
+DATE: Spring 2024
+CLASS: CPSC 326
+
+"""
+
+import argparse
+import io
+import os
+import statistics
+import sys
+import time
+
+# the mypl modules live in the parent directory
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from mypl_iowrapper import FileWrapper
+from mypl_lexer import Lexer
+from mypl_ast_parser import ASTParser
+from mypl_semantic_checker import SemanticChecker
+from mypl_code_gen import CodeGenerator
+from mypl_vm import VM
+
+
+def generate_program(num_functions, depth):
+    """Returns a program with a chain of num_functions functions where
+    main only calls down the first depth + 1 of them.
+
+    Args:
+        num_functions -- The number of functions to generate.
+        depth -- The number of chained calls made by main.
+
+    """
+    lines = []
+    for i in range(num_functions):
+        lines.append(f'int f{i}(int n) {{')
+        lines.append('  int total = 0;')
+        lines.append('  for (int j = 0; j < n; j = j + 1) {')
+        lines.append(f'    total = total + (j * {i}) / 2;')
+        lines.append('  }')
+        if i + 1 < num_functions:
+            lines.append(f'  if (n > 0) {{ return f{i + 1}(n - 1) + total; }}')
+        lines.append('  return total;')
+        lines.append('}')
+    lines.append('void main() {')
+    lines.append(f'  print(itos(f0({depth})));')
+    lines.append('}')
+    return '\n'.join(lines)
+
+
+def startup(program, lazy):
+    """Returns the (front end, codegen) times in seconds to take the
+    program from source text to a VM ready to run.
+
+    Args:
+        program -- The MyPL program text.
+        lazy -- Whether to use lazy code generation.
+
+    """
+    start = time.perf_counter()
+    ast = ASTParser(Lexer(FileWrapper(io.StringIO(program)))).parse()
+    ast.accept(SemanticChecker())
+    middle = time.perf_counter()
+    vm = VM()
+    ast.accept(CodeGenerator(vm, lazy=lazy))
+    end = time.perf_counter()
+    return middle - start, end - middle, vm
+
+
+def main():
+    argparser = argparse.ArgumentParser(description='eager vs. lazy codegen')
+    argparser.add_argument('--functions', type=int, default=2000)
+    argparser.add_argument('--depth', type=int, default=5)
+    argparser.add_argument('--repeat', type=int, default=5)
+    args = argparser.parse_args()
+    program = generate_program(args.functions, args.depth)
+    print(f'{args.functions} functions, main touches {args.depth + 1}')
+    for lazy in [False, True]:
+        front_times, codegen_times, run_times = [], [], []
+        for _ in range(args.repeat):
+            front, codegen, vm = startup(program, lazy)
+            start = time.perf_counter()
+            # the program output is not part of the benchmark
+            stdout, sys.stdout = sys.stdout, io.StringIO()
+            try:
+                vm.run()
+            finally:
+                sys.stdout = stdout
+            run_times.append(time.perf_counter() - start)
+            front_times.append(front)
+            codegen_times.append(codegen)
+        front = statistics.median(front_times) * 1000
+        codegen = statistics.median(codegen_times) * 1000
+        run = statistics.median(run_times) * 1000
+        mode = 'lazy ' if lazy else 'eager'
+        print(f'{mode}: front end {front:8.2f} ms, codegen {codegen:8.2f} ms, '
+              f'startup {front + codegen:8.2f} ms, run {run:8.2f} ms')
+
+
+if __name__ == '__main__':
+    main()
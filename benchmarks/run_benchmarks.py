@@ -0,0 +1,201 @@
+"""Benchmark suite of representative MyPL workloads.
+
+Runs each program in benchmarks/programs through the full pipeline
+several times, timing each compile stage (lex, parse, check, codegen)
+and the VM run, and reports the median and standard deviation of each.
+Results can be saved as JSON and compared against a stored baseline,
+exiting with status 1 if any stage slowed down by more than the
+threshold and by more than its run to run noise:
+
+    python benchmarks/run_benchmarks.py --output baseline.json
+    python benchmarks/run_benchmarks.py --baseline baseline.json
+
+Usage: python benchmarks/run_benchmarks.py [programs ...] [--repeat R]
+           [--output FILE] [--baseline FILE] [--threshold T]
+
+NAME: David Giacobbi
+DATE: Spring 2024
+CLASS: CPSC 326
+
+"""
+
+import argparse
+import io
+import json
+import math
+import os
+import platform
+import statistics
+import sys
+
+# the mypl modules live in the parent directory
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from mypl_timings import StageTimer, timed_compile
+from mypl_vm import VM
+
+
+PROGRAM_DIR = os.path.join(os.path.dirname(__file__), 'programs')
+STAGES = ['lex', 'parse', 'check', 'codegen', 'run']
+
+
+def load_programs(names=None):
+    """Returns a dictionary of benchmark name to program text.
+
+    Args:
+        names -- The benchmarks to load (all of them if None).
+
+    """
+    if not names:
+        names = sorted(f[:-5] for f in os.listdir(PROGRAM_DIR)
+                       if f.endswith('.mypl'))
+    programs = {}
+    for name in names:
+        with open(os.path.join(PROGRAM_DIR, name + '.mypl')) as f:
+            programs[name] = f.read()
+    return programs
+
+
+def run_once(source):
+    """Returns a dictionary of stage name to seconds for one compile and
+    run of the program, and the program's output.
+
+    Args:
+        source -- The MyPL program text.
+
+    """
+    timer = StageTimer(memory=False)
+    program = timed_compile(source, timer)
+    # the program output is not part of the benchmark
+    out = io.StringIO()
+    with timer.stage('run', 'run'):
+        VM(program, stdout=out).run()
+    times = {record['name']: record['duration'] for record in timer.stages
+             if record['depth'] == 0}
+    return times, out.getvalue()
+
+
+def run_benchmark(source, repeat=5, warmup=1):
+    """Returns the median, standard deviation, and samples of each stage
+    over repeated runs of the program.
+
+    Args:
+        source -- The MyPL program text.
+        repeat -- The number of timed runs.
+        warmup -- The number of untimed runs first.
+
+    """
+    for _ in range(warmup):
+        run_once(source)
+    samples = {stage: [] for stage in STAGES}
+    for _ in range(repeat):
+        times, _ = run_once(source)
+        for stage in STAGES:
+            samples[stage].append(times[stage])
+    result = {}
+    for stage, times in samples.items():
+        result[stage] = {'median': statistics.median(times),
+                         'stdev': statistics.stdev(times) if len(times) > 1
+                                  else 0.0,
+                         'samples': times}
+    return result
+
+
+def run_suite(programs, repeat=5, warmup=1, out=sys.stdout):
+    """Runs each benchmark, printing a row per benchmark, and returns the
+    results as a JSON-compatible dictionary.
+
+    Args:
+        programs -- A dictionary of benchmark name to program text.
+        repeat -- The number of timed runs of each benchmark.
+        warmup -- The number of untimed runs of each benchmark first.
+        out -- The stream to print to (None for no output).
+
+    """
+    if out:
+        header = ' '.join(f'{stage + " ms":>16}' for stage in STAGES)
+        print(f"{'benchmark':14} {header}", file=out)
+    benchmarks = {}
+    for name, source in programs.items():
+        result = run_benchmark(source, repeat, warmup)
+        benchmarks[name] = result
+        if out:
+            cells = ' '.join(f"{row['median'] * 1000:8.2f} ±{row['stdev'] * 1000:6.2f}"
+                             for row in result.values())
+            print(f'{name:14} {cells}', file=out)
+    return {'python': platform.python_version(), 'repeat': repeat,
+            'benchmarks': benchmarks}
+
+
+def compare(results, baseline, threshold=0.10, noise=2.0):
+    """Compares results to a baseline and returns the regressions and the
+    skipped stages. A stage regresses if its median time grew by more than
+    the threshold and by more than noise times the combined standard
+    deviation of the two runs, so fast stages are still checked but run
+    to run jitter is not flagged. Regressions are (benchmark, stage,
+    baseline seconds, seconds) tuples, and skipped stages are (benchmark,
+    stage, reason) tuples for stages that could not be compared.
+
+    Args:
+        results -- The results of run_suite.
+        baseline -- Earlier results of run_suite.
+        threshold -- The allowed fractional slowdown (0.10 is 10%).
+        noise -- The standard deviations a slowdown must also exceed.
+
+    """
+    regressions = []
+    skipped = []
+    for name, result in results['benchmarks'].items():
+        base_result = baseline['benchmarks'].get(name)
+        if base_result is None:
+            skipped += [(name, stage, 'not in baseline') for stage in result]
+            continue
+        for stage, row in result.items():
+            if stage not in base_result:
+                skipped.append((name, stage, 'not in baseline'))
+                continue
+            base = base_result[stage]['median']
+            if base <= 0:
+                skipped.append((name, stage, 'no baseline time'))
+                continue
+            spread = math.hypot(base_result[stage].get('stdev', 0.0),
+                                row.get('stdev', 0.0))
+            slowdown = row['median'] - base
+            if slowdown > base * threshold and slowdown > noise * spread:
+                regressions.append((name, stage, base, row['median']))
+    return regressions, skipped
+
+
+def main():
+    argparser = argparse.ArgumentParser(description='MyPL benchmark suite')
+    argparser.add_argument('programs', nargs='*',
+                           help='benchmarks to run (all if none given)')
+    argparser.add_argument('--repeat', type=int, default=5)
+    argparser.add_argument('--warmup', type=int, default=1)
+    argparser.add_argument('--output', metavar='FILE',
+                           help='writes the results to a JSON file')
+    argparser.add_argument('--baseline', metavar='FILE',
+                           help='compares the results to an earlier --output')
+    argparser.add_argument('--threshold', type=float, default=0.10,
+                           help='allowed slowdown over the baseline')
+    args = argparser.parse_args()
+    results = run_suite(load_programs(args.programs), args.repeat, args.warmup)
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        regressions, skipped = compare(results, baseline, args.threshold)
+        for name, stage, reason in skipped:
+            print(f'skipped {name} {stage}: {reason}')
+        for name, stage, base, now in regressions:
+            print(f'REGRESSION {name} {stage}: {base * 1000:.2f} ms -> '
+                  f'{now * 1000:.2f} ms (+{100 * (now / base - 1):.1f}%)')
+        if regressions:
+            sys.exit(1)
+        print(f'no regressions over {args.threshold:.0%}')
+
+
+if __name__ == '__main__':
+    main()
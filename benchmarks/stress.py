@@ -0,0 +1,266 @@
+"""Compiler scalability stress test.
+
+Generates synthetic MyPL programs of growing size along one dimension
+(function count, statements per function, nesting depth, expression
+length, or struct count), times each compile stage (lex, parse, check,
+codegen) and the IR listing for each size, and fits each stage's time
+against program size (in tokens). Stages growing faster than n log n are
+flagged:
+
+    python benchmarks/stress.py --vary statements --sizes 50 100 200 400
+
+A stage that fails at some size (e.g., by running out of Python
+recursion) is reported as failing there and the sweep stops.
+
+NAME: David Giacobbi
+DATE: Spring 2024
+CLASS: CPSC 326
+
+"""
+
+import argparse
+import gc
+import io
+import math
+import os
+import statistics
+import sys
+
+# the mypl modules live in the parent directory
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from mypl_error import MyPLError
+from mypl_iowrapper import FileWrapper
+from mypl_token import TokenType
+from mypl_lexer import Lexer
+from mypl_timings import StageTimer, timed_compile
+
+
+STAGES = ['lex', 'parse', 'check', 'codegen', 'ir']
+DEFAULTS = {'functions': 10, 'statements': 20, 'depth': 2, 'expr_length': 4,
+            'structs': 2}
+
+
+def generate_expr(length, names):
+    """Returns an int expression of the given number of terms, cycling
+    through the given variable names and small constants.
+
+    Args:
+        length -- The number of terms.
+        names -- The int variables in scope.
+
+    """
+    terms = []
+    for i in range(length):
+        terms.append(names[i % len(names)] if i % 2 == 0 else str(i % 7 + 1))
+    ops = ['+', '-', '*']
+    s = terms[0]
+    for i, term in enumerate(terms[1:]):
+        s += f' {ops[i % len(ops)]} {term}'
+    return s
+
+
+def generate_program(functions=10, statements=20, depth=2, expr_length=4,
+                     structs=2):
+    """Returns the text of a well-typed synthetic MyPL program.
+
+    Args:
+        functions -- The number of functions besides main.
+        statements -- The number of statements per function body.
+        depth -- The if/while nesting depth of each function body.
+        expr_length -- The number of terms per expression.
+        structs -- The number of struct types (each used by every
+                   function).
+
+    """
+    lines = []
+    for i in range(structs):
+        lines.append(f'struct S{i} {{')
+        lines.append('  int a;')
+        lines.append('  int b;')
+        lines.append(f'  S{i} next;')
+        lines.append('}')
+        lines.append('')
+    for f in range(functions):
+        lines.append(f'int f{f}(int n) {{')
+        names = ['n']
+        indent = '  '
+        # open the nested blocks, declaring a variable in each (the
+        # indent is capped so whitespace grows with the token count)
+        for d in range(depth):
+            lines.append(f'{indent}int d{d} = {generate_expr(expr_length, names)};')
+            names.append(f'd{d}')
+            keyword = 'while' if d % 2 else 'if'
+            lines.append(f'{indent}{keyword} (d{d} > {d}) {{')
+            indent = '  ' * min(d + 2, 8)
+        for k in range(statements):
+            expr = generate_expr(expr_length, names)
+            if structs and k % 4 == 3:
+                s = k % structs
+                lines.append(f'{indent}S{s} s{k} = new S{s}({expr}, {k}, null);')
+                lines.append(f'{indent}v{k - 2} = s{k}.a + s{k}.b;')
+                continue
+            if k % 4 == 2:
+                lines.append(f'{indent}v{k - 1} = {expr};')
+                continue
+            lines.append(f'{indent}int v{k} = {expr};')
+            names.append(f'v{k}')
+        # close the blocks (each while loop is made to exit)
+        for d in reversed(range(depth)):
+            if d % 2:
+                lines.append(f'{indent}d{d} = 0;')
+            indent = '  ' * min(d + 1, 8)
+            lines.append(f'{indent}}}')
+        if f + 1 < functions:
+            lines.append(f'  return f{f + 1}(n - 1);')
+        else:
+            lines.append('  return n;')
+        lines.append('}')
+        lines.append('')
+    lines.append('void main() {')
+    if functions:
+        lines.append('  print(itos(f0(3)));')
+    lines.append('}')
+    return '\n'.join(lines) + '\n'
+
+
+def measure(source):
+    """Returns a dictionary of stage name to seconds to compile the
+    program and list its IR. As with timeit, the garbage collector is
+    off while timing, since its full collections grow with the number of
+    live objects and would hide how the stages themselves scale.
+
+    Args:
+        source -- The MyPL program text.
+
+    """
+    timer = StageTimer(memory=False)
+    gc.collect()
+    gc.disable()
+    try:
+        program = timed_compile(source, timer)
+        with timer.stage('ir', 'compile'):
+            repr(program)
+    finally:
+        gc.enable()
+    times = {record['name']: record['duration'] for record in timer.stages
+             if record['depth'] == 0}
+    return times
+
+
+def count_tokens(source):
+    """Returns the number of tokens in the program."""
+    lexer = Lexer(FileWrapper(io.StringIO(source)))
+    count = 1
+    while lexer.next_token().token_type != TokenType.EOS:
+        count += 1
+    return count
+
+
+def fit_exponent(sizes, times):
+    """Returns the exponent b of the least squares fit of times = a * n^b
+    (the slope of the log-log line).
+
+    Args:
+        sizes -- The problem sizes.
+        times -- The time for each size.
+
+    """
+    xs = [math.log(n) for n in sizes]
+    ys = [math.log(max(t, 1e-9)) for t in times]
+    mean_x, mean_y = statistics.mean(xs), statistics.mean(ys)
+    num = sum((x - mean_x) * (y - mean_y) for x, y in zip(xs, ys))
+    den = sum((x - mean_x) ** 2 for x in xs)
+    return num / den if den else 0.0
+
+
+def nlogn_exponent(sizes):
+    """Returns the log-log slope of n log n over the sizes, the largest
+    exponent a stage can have without being flagged."""
+    return fit_exponent(sizes, [n * math.log(n) for n in sizes])
+
+
+def analyze(sizes, stage_times, tolerance=0.15):
+    """Returns a dictionary of stage name to (fitted exponent, flagged),
+    flagging stages growing faster than n log n by more than the
+    tolerance.
+
+    Args:
+        sizes -- The program sizes (in tokens).
+        stage_times -- A dictionary of stage name to time per size.
+        tolerance -- The allowed exponent above n log n's (timing noise).
+
+    """
+    limit = nlogn_exponent(sizes) + tolerance
+    results = {}
+    for stage, times in stage_times.items():
+        exponent = fit_exponent(sizes, times)
+        results[stage] = (exponent, exponent > limit)
+    return results
+
+
+def sweep(vary, sizes, repeat=3, params=None, out=sys.stdout):
+    """Measures each stage over programs growing along one dimension.
+    Returns the program sizes (in tokens) and a dictionary of stage name
+    to the fastest time per size, stopping at the first size that fails.
+
+    Args:
+        vary -- The generate_program parameter to vary.
+        sizes -- The values of that parameter.
+        repeat -- The number of timed compiles per size.
+        params -- The other generate_program parameters.
+        out -- The stream to print to (None for no output).
+
+    """
+    params = dict(DEFAULTS, **(params or {}))
+    tokens = []
+    stage_times = {stage: [] for stage in STAGES}
+    if out:
+        header = ' '.join(f'{stage + " ms":>10}' for stage in STAGES)
+        print(f"{vary:>12} {'tokens':>10} {header}", file=out)
+    for size in sizes:
+        params[vary] = size
+        source = generate_program(**params)
+        try:
+            runs = [measure(source) for _ in range(repeat)]
+        except (RecursionError, MyPLError) as e:
+            if out:
+                print(f'{size:12} failed: {type(e).__name__}: {e}', file=out)
+            break
+        tokens.append(count_tokens(source))
+        for stage in STAGES:
+            stage_times[stage].append(
+                min(run[stage] for run in runs))
+        if out:
+            cells = ' '.join(f'{stage_times[stage][-1] * 1000:10.2f}'
+                             for stage in STAGES)
+            print(f'{size:12} {tokens[-1]:10} {cells}', file=out)
+    return tokens, stage_times
+
+
+def main():
+    argparser = argparse.ArgumentParser(description='compiler scaling test')
+    argparser.add_argument('--vary', choices=list(DEFAULTS),
+                           default='statements')
+    argparser.add_argument('--sizes', type=int, nargs='+',
+                           default=[50, 100, 200, 400, 800])
+    argparser.add_argument('--repeat', type=int, default=3)
+    argparser.add_argument('--tolerance', type=float, default=0.15)
+    args = argparser.parse_args()
+    tokens, stage_times = sweep(args.vary, args.sizes, args.repeat)
+    if len(tokens) < 2:
+        print('too few sizes to fit')
+        sys.exit(1)
+    print(f'\nn log n exponent over these sizes: {nlogn_exponent(tokens):.2f}')
+    flagged = False
+    for stage, (exponent, slow) in analyze(tokens, stage_times,
+                                           args.tolerance).items():
+        print(f"{stage:10} time ~ n^{exponent:.2f}"
+              f"{'  SUPERLINEAR (faster than n log n)' if slow else ''}")
+        flagged = flagged or slow
+    if flagged:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -7,8 +7,10 @@ CLASS: CPSC 326
 """
 
 import argparse
+import os
 import sys
 import io
+from contextlib import nullcontext
 
 from mypl_iowrapper import FileWrapper, StdInWrapper
 from mypl_error import MyPLError
@@ -19,6 +21,16 @@ from mypl_printer import PrintVisitor
 from mypl_semantic_checker import SemanticChecker
 from mypl_code_gen import CodeGenerator
 from mypl_vm import VM
+from mypl_compiler import compile_source
+from mypl_bytecode import read_bytecode, write_bytecode
+from mypl_cache import CompileCache, cache_options
+from mypl_code_image import map_image, write_image
+from mypl_profiler import Profiler
+from mypl_sampler import SamplingProfiler
+from mypl_timings import StageTimer, timed_compile
+from mypl_heap_profiler import HeapProfiler
+from mypl_heap_snapshot import run_snapshotted
+from mypl_checkpoint import read_checkpoint, restore_state, run_checkpointed
 
 
 def run_lex_mode(in_stream):
@@ -73,7 +85,7 @@ def run_print_mode(in_stream):
         lexer = Lexer(in_stream)
         parser = ASTParser(lexer)
         ast = parser.parse()
-        visitor = PrintVisitor()
+        visitor = PrintVisitor(sys.stdout)
         ast.accept(visitor)
     except MyPLError as ex:
         print(ex)
@@ -103,13 +115,14 @@ def run_check_mode(in_stream):
 
 
     
-def run_ir_mode(in_stream):
+def run_ir_mode(in_stream, function=None):
     """Generates the intermediate representation (VM instructions) for the
     given mypl program and prints to standard output the resulting
     instructions.
 
     Args: 
         in_stream -- A wrapped input stream containing a mypl program.
+        function -- The name of the only function to list (all if None).
 
     """
     try: 
@@ -121,33 +134,249 @@ def run_ir_mode(in_stream):
         vm = VM()
         codegen = CodeGenerator(vm)
         ast.accept(codegen)
-        print(vm)
+        vm.program.write_listing(sys.stdout, function)
+        print()
     except MyPLError as ex:
         print(ex)
         exit(1)
 
     
-def run_normal_mode(in_stream):
+def run_compile_mode(in_stream, out_path, check_unreachable=True,
+                     clear_dead=False, scalar_replace=False, regions=False):
+    """Compiles the given mypl program and writes the resulting VM
+    instructions to a .myplc file (or a .myplimg code image) without
+    running them.
+
+    Args: 
+        in_stream -- A wrapped input stream containing a mypl program.
+        out_path -- The compiled file to write.
+        check_unreachable -- If false, skip checking unreachable functions.
+        clear_dead -- If true, set reference locals to null where they die.
+        scalar_replace -- If true, keep the fields of struct locals that
+                          never escape their function in local slots.
+        regions -- If true, free objects that cannot outlive their frame
+                   when it returns.
+
+    """
+    try: 
+        vm = compile_source(in_stream.read_all(), check_unreachable,
+                            clear_dead=clear_dead,
+                            scalar_replace=scalar_replace, regions=regions)
+        if out_path.endswith('.myplimg'):
+            write_image(vm, out_path)
+        else:
+            write_bytecode(vm, out_path)
+    except MyPLError as ex:
+        print(ex)
+        exit(1)
+    except OSError:
+        print(f"ERROR: Could not write file '{out_path}'")
+        exit(1)
+
+
+def run_checkpoint_mode(vm, path, every_steps=None, every_seconds=None,
+                        program_path=None):
+    """Runs a started (or restored) VM to completion, checkpointing it
+    to the given file as it goes, and removes the checkpoint once the run
+    finishes.
+
+    Args:
+        vm -- The VM to run.
+        path -- The checkpoint file path.
+        every_steps -- The instructions between checkpoints (optional).
+        every_seconds -- The seconds between checkpoints (every 60 if
+                         neither interval is given).
+        program_path -- The compiled program file the VM was loaded
+                        from (the bytecode is embedded if None).
+
+    """
+    if every_steps is None and every_seconds is None:
+        every_seconds = 60
+    run_checkpointed(vm, path, every_steps, every_seconds, program_path)
+    if os.path.exists(path):
+        os.remove(path)
+
+
+def run_resume_mode(path, every_steps=None, every_seconds=None):
+    """Resumes a run from a checkpoint file written by --checkpoint,
+    continuing to checkpoint to the same file. Standard input must give
+    the run's input from its start, as the lines it had already read are
+    skipped.
+
+    Args:
+        path -- The checkpoint file path.
+        every_steps -- The instructions between checkpoints (optional).
+        every_seconds -- The seconds between checkpoints (optional).
+
+    """
+    try:
+        state = read_checkpoint(path)
+        vm = restore_state(state)
+        run_checkpoint_mode(vm, path, every_steps, every_seconds,
+                            state['program'].get('path'))
+    except MyPLError as ex:
+        print(ex)
+        exit(1)
+    except (OSError, ValueError, KeyError):
+        print(f"ERROR: Could not read checkpoint '{path}'")
+        exit(1)
+
+
+def run_bytecode_mode(path, checkpoint=None, every_steps=None,
+                      every_seconds=None):
+    """Executes a compiled .myplc program, or a .myplimg code image
+    mapped in place. Any output produced by the program is printed to
+    standard output.
+
+    Args: 
+        path -- The compiled program file.
+        checkpoint -- A file to checkpoint the run to (optional).
+        every_steps -- The instructions between checkpoints (optional).
+        every_seconds -- The seconds between checkpoints (optional).
+
+    """
+    try: 
+        if path.endswith('.myplimg'):
+            vm = map_image(path)
+        else:
+            vm = read_bytecode(path)
+    except MyPLError as ex:
+        print(ex)
+        exit(1)
+    except OSError:
+        print(f"ERROR: Could not open file '{path}'")
+        exit(1)
+    try:
+        if checkpoint:
+            vm.start()
+            run_checkpoint_mode(vm, checkpoint, every_steps, every_seconds,
+                                path)
+        else:
+            vm.run()
+    except MyPLError as ex:
+        print(ex)
+        exit(1)
+
+
+def run_normal_mode(in_stream, check_unreachable=True, lazy=False,
+                    use_cache=True, profile=False, profile_json=None,
+                    flamegraph=None, timings=False, trace=None,
+                    heap_profile=False, heap_snapshot=None, checkpoint=None,
+                    every_steps=None, every_seconds=None, clear_dead=False,
+                    scalar_replace=False, regions=False, snapshot_steps=None,
+                    snapshot_seconds=None):
     """Executes the given mypl program. Any output produced by the program
-    is printed to standard output. 
+    is printed to standard output. Only functions reachable from main are
+    compiled, and compiled programs are reused from the compile cache.
 
     Args: 
         in_stream -- A wrapped input stream containing a mypl program.
+        check_unreachable -- If false, skip checking unreachable functions.
+        lazy -- If true, generate each function's code on its first call
+                (lazy programs are never cached).
+        use_cache -- If false, bypass the compile cache.
+        profile -- If true, print an execution profile to standard error.
+        profile_json -- A file to write the execution profile to as JSON.
+        flamegraph -- A file to write sampled call stacks to, in collapsed
+                      stack format.
+        timings -- If true, print each compile stage's and the run's time
+                   and peak memory to standard error (bypasses the cache).
+        trace -- A file to write the stage timings to as a Chrome trace.
+        heap_profile -- If true, print the live heap by allocation site
+                        to standard error at exit.
+        heap_snapshot -- A file to number and write heap snapshots to
+                         during the run (heap.json.gz gives
+                         heap.1.json.gz, heap.2.json.gz, ...).
+        checkpoint -- A file to checkpoint the run to (the program is then
+                      compiled eagerly, as checkpoints embed its code).
+        every_steps -- The instructions between checkpoints (optional).
+        every_seconds -- The seconds between checkpoints (optional).
+        clear_dead -- If true, set reference locals to null where they die
+                      (so heap objects they held can be reclaimed early).
+        scalar_replace -- If true, keep the fields of struct locals that
+                          never escape their function in local slots.
+        regions -- If true, free objects that cannot outlive their frame
+                   when it returns.
+        snapshot_steps -- The instructions between heap snapshots
+                          (optional).
+        snapshot_seconds -- The seconds between heap snapshots (every
+                            second if neither interval is given).
 
     """
+    if checkpoint:
+        lazy = False
+    profiler = Profiler() if profile or profile_json else None
+    heap_profiler = HeapProfiler() if heap_profile else None
+    timer = StageTimer() if timings or trace else None
     try: 
-        lexer = Lexer(in_stream)
-        parser = ASTParser(lexer)
-        ast = parser.parse()
-        visitor = SemanticChecker()
-        ast.accept(visitor)
-        vm = VM()
-        codegen = CodeGenerator(vm)
-        ast.accept(codegen)
-        vm.run()
+        source = in_stream.read_all()
+        cache = None
+        if use_cache and not lazy and not timer:
+            try:
+                cache = CompileCache()
+            except OSError:
+                cache = None
+        options = cache_options(check_unreachable, clear_dead,
+                                scalar_replace, regions)
+        vm = cache.get(source, options) if cache else None
+        if timer:
+            vm = VM(timed_compile(source, timer, check_unreachable, lazy,
+                                  clear_dead, scalar_replace, regions))
+        elif vm is None:
+            vm = compile_source(source, check_unreachable, lazy, clear_dead,
+                                scalar_replace, regions)
+            if cache:
+                cache.put(source, vm, options)
+        if profiler:
+            vm.add_hook(profiler)
+        if heap_profiler:
+            vm.add_hook(heap_profiler)
+        sampler = SamplingProfiler(vm) if flamegraph else None
+        if timer:
+            timer.close()
+        try:
+            with timer.stage('run', 'run') if timer else nullcontext() as record:
+                if sampler:
+                    sampler.run()
+                elif checkpoint:
+                    vm.start()
+                    run_checkpoint_mode(vm, checkpoint, every_steps,
+                                        every_seconds)
+                elif heap_snapshot:
+                    if snapshot_steps is None and snapshot_seconds is None:
+                        snapshot_seconds = 1
+                    vm.start()
+                    paths = run_snapshotted(vm, heap_snapshot, snapshot_steps,
+                                            snapshot_seconds, heap_profiler)
+                    if not paths:
+                        print('no heap snapshots taken (the run ended before '
+                              'the first interval)', file=sys.stderr)
+                else:
+                    vm.run()
+        finally:
+            if timer:
+                # the run is too slow to trace, so use the VM's heap peak
+                record['peak_bytes'] = vm.peak_heap_bytes
+            if sampler:
+                sampler.write(flamegraph)
+            if profiler:
+                profiler.stop()
+                if profile:
+                    profiler.report(sys.stderr)
+                if profile_json:
+                    profiler.dump(profile_json)
+            if heap_profiler:
+                heap_profiler.report(vm, sys.stderr)
     except MyPLError as ex:
         print(ex)
         exit(1)
+    finally:
+        if timer:
+            timer.close()
+            if timings:
+                timer.report(sys.stderr)
+            if trace:
+                timer.write_trace(trace)
 
 
     
@@ -169,9 +398,95 @@ if __name__ == '__main__':
     group.add_argument('--check', action='store_true', help=help_msg)
     help_msg = 'displays intermediate code'
     group.add_argument('--ir', action='store_true', help=help_msg)
-    help_msg = 'mypl program file (optional)'
+    help_msg = 'only lists the named function for --ir'
+    argparser.add_argument('--function', metavar='NAME', help=help_msg)
+    help_msg = 'compiles program to a .myplc file without running it'
+    group.add_argument('--compile', action='store_true', help=help_msg)
+    help_msg = 'only checks functions reachable from main when running'
+    argparser.add_argument('--reachable-only', action='store_true', help=help_msg)
+    help_msg = 'generates function code on first call when running'
+    argparser.add_argument('--lazy', action='store_true', help=help_msg)
+    help_msg = 'sets struct, array, and list locals to null where they die'
+    argparser.add_argument('--clear-dead', action='store_true', help=help_msg)
+    help_msg = 'keeps fields of structs that never leave their function in locals'
+    argparser.add_argument('--scalar-replace', action='store_true', help=help_msg)
+    help_msg = 'frees objects that cannot outlive their function when it returns'
+    argparser.add_argument('--regions', action='store_true', help=help_msg)
+    help_msg = 'does not read or write the compile cache'
+    argparser.add_argument('--no-cache', action='store_true', help=help_msg)
+    help_msg = 'prints an execution profile to standard error'
+    argparser.add_argument('--profile', action='store_true', help=help_msg)
+    help_msg = 'writes the execution profile to a JSON file'
+    argparser.add_argument('--profile-json', metavar='FILE', help=help_msg)
+    help_msg = 'prints the live heap by allocation site to standard error'
+    argparser.add_argument('--heap-profile', action='store_true', help=help_msg)
+    help_msg = ('writes numbered heap snapshots to a file (.gz to '
+                'compress) during the run')
+    argparser.add_argument('--heap-snapshot', metavar='FILE', help=help_msg)
+    help_msg = 'instructions between heap snapshots'
+    argparser.add_argument('--snapshot-steps', type=int, metavar='N',
+                           help=help_msg)
+    help_msg = 'seconds between heap snapshots (default 1)'
+    argparser.add_argument('--snapshot-seconds', type=float, metavar='S',
+                           help=help_msg)
+    help_msg = 'writes sampled call stacks to a flamegraph (.folded) file'
+    argparser.add_argument('--flamegraph', metavar='FILE', help=help_msg)
+    help_msg = 'prints the time and peak memory of each compile stage'
+    argparser.add_argument('--timings', action='store_true', help=help_msg)
+    help_msg = 'writes the stage timings to a Chrome trace-event file'
+    argparser.add_argument('--trace', metavar='FILE', help=help_msg)
+    help_msg = 'checkpoints the run to a file (.gz to compress)'
+    argparser.add_argument('--checkpoint', metavar='FILE', help=help_msg)
+    help_msg = 'instructions between checkpoints'
+    argparser.add_argument('--checkpoint-steps', type=int, metavar='N',
+                           help=help_msg)
+    help_msg = 'seconds between checkpoints (default 60)'
+    argparser.add_argument('--checkpoint-seconds', type=float, metavar='S',
+                           help=help_msg)
+    help_msg = ('resumes a run from a --checkpoint file (give it the run\'s '
+                'same input again)')
+    argparser.add_argument('--resume', metavar='FILE', help=help_msg)
+    help_msg = 'compiled output file for --compile'
+    argparser.add_argument('-o', '--output', help=help_msg)
+    help_msg = 'mypl program, .myplc, or .myplimg file (optional)'
     argparser.add_argument('filename', nargs='?', help=help_msg)
     args = argparser.parse_args()
+    # reject flags that would otherwise be silently ignored
+    mode = (args.lex or args.parse or args.print or args.check or args.ir
+            or args.compile)
+    if args.checkpoint and args.resume:
+        argparser.error('--checkpoint cannot be used with --resume')
+    if args.resume and (args.filename or mode):
+        argparser.error('--resume takes no program file or mode')
+    if args.checkpoint and mode:
+        argparser.error('--checkpoint only applies when running a program')
+    if args.checkpoint and args.flamegraph:
+        argparser.error('--flamegraph cannot be used with --checkpoint')
+    if args.checkpoint and args.lazy:
+        argparser.error('--lazy cannot be used with --checkpoint '
+                        '(checkpoints embed the compiled program)')
+    if args.heap_snapshot and (args.checkpoint or args.flamegraph):
+        argparser.error('--heap-snapshot cannot be used with --checkpoint '
+                        'or --flamegraph')
+    if ((args.snapshot_steps is not None or args.snapshot_seconds is not None)
+            and not args.heap_snapshot):
+        argparser.error('--snapshot-steps and --snapshot-seconds need '
+                        '--heap-snapshot')
+    intervals = (args.checkpoint_steps is not None
+                 or args.checkpoint_seconds is not None)
+    if intervals and not (args.checkpoint or args.resume):
+        argparser.error('--checkpoint-steps and --checkpoint-seconds need '
+                        '--checkpoint or --resume')
+    # checkpointed runs resume without their program text
+    if args.resume:
+        run_resume_mode(args.resume, args.checkpoint_steps,
+                        args.checkpoint_seconds)
+        exit(0)
+    # compiled programs skip straight to the VM
+    if args.filename and args.filename.endswith(('.myplc', '.myplimg')):
+        run_bytecode_mode(args.filename, args.checkpoint, args.checkpoint_steps,
+                          args.checkpoint_seconds)
+        exit(0)
     # get the input (file or standard in)
     in_stream = StdInWrapper(sys.stdin)
     if args.filename:
@@ -190,9 +505,22 @@ if __name__ == '__main__':
     elif args.check:
         run_check_mode(in_stream)
     elif args.ir:
-        run_ir_mode(in_stream)
+        run_ir_mode(in_stream, args.function)
+    elif args.compile:
+        out_path = args.output
+        if not out_path:
+            base = args.filename if args.filename else 'out'
+            out_path = os.path.splitext(base)[0] + '.myplc'
+        run_compile_mode(in_stream, out_path, not args.reachable_only,
+                         args.clear_dead, args.scalar_replace, args.regions)
     else:
-        run_normal_mode(in_stream)
+        run_normal_mode(in_stream, not args.reachable_only, args.lazy,
+                        not args.no_cache, args.profile, args.profile_json,
+                        args.flamegraph, args.timings, args.trace,
+                        args.heap_profile, args.heap_snapshot, args.checkpoint,
+                        args.checkpoint_steps, args.checkpoint_seconds,
+                        args.clear_dead, args.scalar_replace, args.regions,
+                        args.snapshot_steps, args.snapshot_seconds)
     # close the (wrapped) input stream
     in_stream.close()
 
@@ -0,0 +1,254 @@
+"""Batch runner for compiling and executing many MyPL programs across a
+pool of worker processes.
+
+Usage: python mypl_batch.py [options] PATH [PATH ...]
+
+Each PATH is a .mypl file or a directory of them. A program reads its
+standard input from a sibling file with the same name and a .in
+extension (e.g., prog.in for prog.mypl), if one exists. Each program
+runs under its own time and instruction limits, and a program that hits
+one is reported as failed without holding up the rest of the batch.
+
+NAME: David Giacobbi
+DATE: Spring 2024
+CLASS: CPSC 326
+
+"""
+
+import argparse
+import io
+import json
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from mypl_error import MyPLError
+from mypl_compiler import compile_program
+from mypl_cache import CompileCache, cache_options
+from mypl_vm import VM
+
+
+DEFAULT_TIME_LIMIT = 10.0
+DEFAULT_MAX_STEPS = 100_000_000
+
+
+def find_programs(paths):
+    """Returns the .mypl files named by the given files and directories,
+    each listed once.
+
+    Args:
+        paths -- A list of file and directory paths.
+
+    """
+    programs = []
+    seen = set()
+    for path in paths:
+        if os.path.isdir(path):
+            names = [os.path.join(path, name)
+                     for name in sorted(os.listdir(path))
+                     if name.endswith('.mypl')]
+        else:
+            names = [path]
+        for name in names:
+            if os.path.abspath(name) not in seen:
+                seen.add(os.path.abspath(name))
+                programs.append(name)
+    return programs
+
+
+def stdin_path(path):
+    """Returns the stdin file for a program, or None if it has none."""
+    in_path = os.path.splitext(path)[0] + '.in'
+    return in_path if os.path.exists(in_path) else None
+
+
+def run_program(path, use_cache=True, time_limit=DEFAULT_TIME_LIMIT,
+                max_steps=DEFAULT_MAX_STEPS):
+    """Compiles and runs one program, returning a result dictionary with
+    its output, any error message, and compile, run, and wall times in
+    seconds. Runs in a worker process.
+
+    Args:
+        path -- The .mypl file to run.
+        use_cache -- If false, bypass the compile cache.
+        time_limit -- Most seconds the program may run (None for no limit).
+        max_steps -- Most instructions the program may run (None for no
+                     limit).
+
+    """
+    start = time.perf_counter()
+    result = {'path': path, 'output': '', 'error': None,
+              'compile_time': 0.0, 'run_time': 0.0}
+    out = io.StringIO()
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            source = f.read()
+        in_path = stdin_path(path)
+        stdin_text = ''
+        if in_path:
+            with open(in_path, 'r', encoding='utf-8') as f:
+                stdin_text = f.read()
+        vm = None
+        cache = None
+        if use_cache:
+            try:
+                cache = CompileCache()
+            except OSError:
+                cache = None
+        # same options as a normal mypl.py run so cache entries are shared
+        options = cache_options()
+        if cache:
+            vm = cache.get(source, options)
+        if vm is None:
+            vm = VM(compile_program(source))
+            if cache:
+                cache.put(source, vm, options)
+        compiled = time.perf_counter()
+        result['compile_time'] = compiled - start
+        vm.stdin = io.StringIO(stdin_text)
+        vm.stdout = out
+        try:
+            vm.run(max_steps=max_steps, time_limit=time_limit)
+        finally:
+            result['run_time'] = time.perf_counter() - compiled
+    except MyPLError as ex:
+        result['error'] = str(ex)
+    except OSError as ex:
+        result['error'] = f'ERROR: {ex}'
+    except Exception as ex:
+        # a VM bug should not take down the rest of the batch
+        result['error'] = f'Internal Error: {type(ex).__name__}: {ex}'
+    result['output'] = out.getvalue()
+    result['wall_time'] = time.perf_counter() - start
+    return result
+
+
+def run_batch(programs, workers=None, use_cache=True,
+              time_limit=DEFAULT_TIME_LIMIT, max_steps=DEFAULT_MAX_STEPS):
+    """Runs the programs across a process pool, returning their results
+    in the same order.
+
+    Args:
+        programs -- The list of .mypl files to run.
+        workers -- The number of worker processes (cores if None).
+        use_cache -- If false, bypass the compile cache.
+        time_limit -- Most seconds each program may run (None for no limit).
+        max_steps -- Most instructions each program may run (None for no
+                     limit).
+
+    """
+    workers = workers if workers else os.cpu_count()
+    # hand out programs in chunks to cut per-task overhead on big batches
+    chunksize = max(1, len(programs) // (workers * 4))
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        return list(pool.map(run_program, programs,
+                             [use_cache] * len(programs),
+                             [time_limit] * len(programs),
+                             [max_steps] * len(programs),
+                             chunksize=chunksize))
+
+
+def output_names(paths):
+    """Returns a distinct output name for each program path: its path
+    relative to the directory all of the programs share, without the
+    .mypl extension (e.g., a/test.mypl and b/test.mypl give a/test and
+    b/test).
+
+    Args:
+        paths -- The list of program paths.
+
+    """
+    paths = [os.path.abspath(path) for path in paths]
+    if not paths:
+        return []
+    root = os.path.commonpath([os.path.dirname(path) for path in paths])
+    names = [os.path.splitext(os.path.relpath(path, root))[0]
+             for path in paths]
+    if len(set(names)) != len(names):
+        raise ValueError('programs listed more than once')
+    return names
+
+
+def write_outputs(results, out_dir):
+    """Writes each program's output to NAME.out and any error to NAME.err
+    in the output directory, where NAME is the program's path relative to
+    the directory all of the programs share.
+
+    Args:
+        results -- The list of result dictionaries.
+        out_dir -- The directory to write to.
+
+    """
+    names = output_names([result['path'] for result in results])
+    for result, name in zip(results, names):
+        name = os.path.join(out_dir, name)
+        os.makedirs(os.path.dirname(name), exist_ok=True)
+        with open(name + '.out', 'w') as f:
+            f.write(result['output'])
+        if result['error'] != None:
+            with open(name + '.err', 'w') as f:
+                f.write(result['error'] + '\n')
+
+
+def print_summary(results, total_time, out=sys.stdout):
+    """Prints a table of per-program status and wall time.
+
+    Args:
+        results -- The list of result dictionaries.
+        total_time -- The wall time of the whole batch in seconds.
+        out -- The stream to print to.
+
+    """
+    failed = 0
+    for result in results:
+        status = 'ok'
+        if result['error'] != None:
+            status = 'FAILED'
+            failed += 1
+        print(f"{result['wall_time'] * 1000:10.2f} ms  {status:6}  "
+              f"{result['path']}", file=out)
+        if result['error'] != None:
+            print(f"{'':22}{result['error']}", file=out)
+    print(f'{len(results)} programs, {failed} failed, '
+          f'{total_time:.2f} s total', file=out)
+
+
+def main():
+    about = 'Compile and run many mypl programs in parallel.'
+    argparser = argparse.ArgumentParser(prog='mypl_batch', description=about)
+    help_msg = 'mypl program files or directories of them'
+    argparser.add_argument('paths', nargs='+', help=help_msg)
+    help_msg = 'number of worker processes (default: number of cores)'
+    argparser.add_argument('-j', '--workers', type=int, help=help_msg)
+    help_msg = 'directory to write each program\'s .out and .err files'
+    argparser.add_argument('--output-dir', help=help_msg)
+    help_msg = 'file to write the JSON summary of all results'
+    argparser.add_argument('--summary', help=help_msg)
+    help_msg = 'does not read or write the compile cache'
+    argparser.add_argument('--no-cache', action='store_true', help=help_msg)
+    help_msg = 'most seconds each program may run'
+    argparser.add_argument('--time-limit', type=float,
+                           default=DEFAULT_TIME_LIMIT, help=help_msg)
+    help_msg = 'most instructions each program may run'
+    argparser.add_argument('--max-steps', type=int, default=DEFAULT_MAX_STEPS,
+                           help=help_msg)
+    args = argparser.parse_args()
+    programs = find_programs(args.paths)
+    start = time.perf_counter()
+    results = run_batch(programs, args.workers, not args.no_cache,
+                        args.time_limit, args.max_steps)
+    total_time = time.perf_counter() - start
+    if args.output_dir:
+        write_outputs(results, args.output_dir)
+    if args.summary:
+        with open(args.summary, 'w') as f:
+            json.dump({'total_time': total_time, 'results': results}, f,
+                      indent=2)
+    print_summary(results, total_time)
+    if any(result['error'] != None for result in results):
+        exit(1)
+
+
+if __name__ == '__main__':
+    main()
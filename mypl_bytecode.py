@@ -0,0 +1,237 @@
+"""Binary serialization of compiled MyPL programs (.myplc files).
+
+A file holds a header (magic, format version, compiler version), the
+struct layouts, and each frame template's opcodes, tagged operands, and
+(pc, line, column) line table.
+All integers are little endian.
+
+NAME: David Giacobbi
+DATE: Spring 2024
+CLASS: CPSC 326
+
+"""
+
+import struct
+
+from mypl_error import *
+from mypl_opcode import OpCode
+from mypl_frame import VMFrameTemplate, VMInstr
+from mypl_program import VMProgram
+from mypl_vm import VM
+
+
+MAGIC = b'MYPLC'
+FORMAT_VERSION = 2
+# bump whenever code generation changes the instructions it emits
+COMPILER_VERSION = '1.2'
+
+# operand tags
+TAG_NONE = 0
+TAG_INT = 1
+TAG_DOUBLE = 2
+TAG_STRING = 3
+TAG_TRUE = 4
+TAG_FALSE = 5
+TAG_BIG_INT = 6     # ints outside 64 bits, stored as decimal strings
+
+U8 = struct.Struct('<B')
+U16 = struct.Struct('<H')
+U32 = struct.Struct('<I')
+I64 = struct.Struct('<q')
+F64 = struct.Struct('<d')
+
+
+class BytecodeWriter:
+    """Builds the binary encoding of a compiled program."""
+
+    def __init__(self):
+        self.out = bytearray()
+
+    def u8(self, value):
+        self.out += U8.pack(value)
+
+    def u32(self, value):
+        self.out += U32.pack(value)
+
+    def string(self, value):
+        data = value.encode('utf-8')
+        self.u32(len(data))
+        self.out += data
+
+    def operand(self, value):
+        """Writes a tagged instruction operand."""
+        if value is None:
+            self.u8(TAG_NONE)
+        elif value is True:
+            self.u8(TAG_TRUE)
+        elif value is False:
+            self.u8(TAG_FALSE)
+        elif type(value) == int:
+            if -2**63 <= value < 2**63:
+                self.u8(TAG_INT)
+                self.out += I64.pack(value)
+            else:
+                self.u8(TAG_BIG_INT)
+                self.string(str(value))
+        elif type(value) == float:
+            self.u8(TAG_DOUBLE)
+            self.out += F64.pack(value)
+        elif type(value) == str:
+            self.u8(TAG_STRING)
+            self.string(value)
+        else:
+            raise BytecodeError(f'cannot serialize operand {value!r}')
+
+
+class BytecodeReader:
+    """Decodes the binary encoding of a compiled program."""
+
+    def __init__(self, data):
+        self.data = memoryview(data)
+        self.pos = 0
+
+    def unpack(self, fmt):
+        if self.pos + fmt.size > len(self.data):
+            raise BytecodeError('unexpected end of file')
+        value = fmt.unpack_from(self.data, self.pos)[0]
+        self.pos += fmt.size
+        return value
+
+    def u8(self):
+        return self.unpack(U8)
+
+    def u32(self):
+        return self.unpack(U32)
+
+    def string(self):
+        n = self.u32()
+        if self.pos + n > len(self.data):
+            raise BytecodeError('unexpected end of file')
+        value = bytes(self.data[self.pos:self.pos + n]).decode('utf-8')
+        self.pos += n
+        return value
+
+    def operand(self):
+        """Reads a tagged instruction operand."""
+        tag = self.u8()
+        if tag == TAG_NONE:
+            return None
+        elif tag == TAG_TRUE:
+            return True
+        elif tag == TAG_FALSE:
+            return False
+        elif tag == TAG_INT:
+            return self.unpack(I64)
+        elif tag == TAG_BIG_INT:
+            return int(self.string())
+        elif tag == TAG_DOUBLE:
+            return self.unpack(F64)
+        elif tag == TAG_STRING:
+            return self.string()
+        raise BytecodeError(f'invalid operand tag {tag}')
+
+
+def dumps(vm):
+    """Returns the bytes of the compiled program loaded in the VM.
+
+    Args:
+        vm -- The VM (or VMProgram) whose frame templates and struct
+              layouts to write.
+
+    """
+    w = BytecodeWriter()
+    w.out += MAGIC
+    w.out += U16.pack(FORMAT_VERSION)
+    w.string(COMPILER_VERSION)
+    # struct layouts
+    w.u32(len(vm.struct_layouts))
+    for name, fields in vm.struct_layouts.items():
+        w.string(name)
+        w.u32(len(fields))
+        for field_name in fields:
+            w.string(field_name)
+    # frame templates
+    w.u32(len(vm.frame_templates))
+    for name, template in vm.frame_templates.items():
+        if template.instructions is None:
+            raise BytecodeError(f'cannot serialize lazy stub for {name}')
+        w.string(name)
+        w.u32(template.arg_count)
+        w.u32(len(template.instructions))
+        for instr in template.instructions:
+            w.u8(instr.opcode.value)
+            w.operand(instr.operand)
+            w.string(instr.comment)
+        w.u32(len(template.line_table))
+        for entry in template.line_table:
+            for value in entry:
+                w.u32(value)
+    return bytes(w.out)
+
+
+def loads(data):
+    """Returns a new VM for the (frozen) compiled program in the bytes.
+
+    Args:
+        data -- The bytes produced by dumps.
+
+    """
+    r = BytecodeReader(data)
+    if bytes(r.data[:len(MAGIC)]) != MAGIC:
+        raise BytecodeError('not a compiled MyPL file')
+    r.pos = len(MAGIC)
+    version = r.unpack(U16)
+    if version != FORMAT_VERSION:
+        raise BytecodeError(f'unsupported format version {version}')
+    compiler_version = r.string()
+    if compiler_version != COMPILER_VERSION:
+        raise BytecodeError(f'compiled by incompatible compiler '
+                            f'{compiler_version}')
+    program = VMProgram()
+    # struct layouts
+    for _ in range(r.u32()):
+        name = r.string()
+        program.struct_layouts[name] = [r.string() for _ in range(r.u32())]
+    # frame templates
+    for _ in range(r.u32()):
+        name = r.string()
+        arg_count = r.u32()
+        instructions = []
+        for _ in range(r.u32()):
+            opcode_value = r.u8()
+            try:
+                opcode = OpCode(opcode_value)
+            except ValueError:
+                raise BytecodeError(f'invalid opcode {opcode_value}')
+            operand = r.operand()
+            comment = r.string()
+            instructions.append(VMInstr(opcode, operand, comment))
+        line_table = [(r.u32(), r.u32(), r.u32()) for _ in range(r.u32())]
+        program.add_frame_template(VMFrameTemplate(name, arg_count,
+                                                   instructions, line_table))
+    if r.pos != len(r.data):
+        raise BytecodeError('trailing data after program')
+    return VM(program.freeze())
+
+
+def write_bytecode(vm, path):
+    """Writes the compiled program loaded in the VM to a .myplc file.
+
+    Args:
+        vm -- The VM whose program to write.
+        path -- The output file path.
+
+    """
+    with open(path, 'wb') as f:
+        f.write(dumps(vm))
+
+
+def read_bytecode(path):
+    """Returns a new VM for the compiled program in a .myplc file.
+
+    Args:
+        path -- The input file path.
+
+    """
+    with open(path, 'rb') as f:
+        return loads(f.read())
@@ -0,0 +1,156 @@
+"""On-disk cache of compiled MyPL programs keyed by source hash.
+
+Each entry is a .myplc file named by the SHA-256 of the compiler
+version, the compile options, and the program source. Entries are
+evicted least recently used first (by modification time, refreshed on
+each hit) once the cache grows past its size cap.
+
+NAME: David Giacobbi
+DATE: Spring 2024
+CLASS: CPSC 326
+
+"""
+
+import hashlib
+import os
+import tempfile
+
+from mypl_error import MyPLError
+from mypl_bytecode import COMPILER_VERSION, FORMAT_VERSION, dumps, loads
+
+
+DEFAULT_MAX_BYTES = 64 * 1024 * 1024
+
+
+def default_cache_dir():
+    """Returns the cache directory from $MYPL_CACHE_DIR, or ~/.cache/mypl
+    if it is not set."""
+    if os.environ.get('MYPL_CACHE_DIR'):
+        return os.environ['MYPL_CACHE_DIR']
+    return os.path.join(os.path.expanduser('~'), '.cache', 'mypl')
+
+
+def cache_options(check_unreachable=True, clear_dead=False,
+                  scalar_replace=False, regions=False):
+    """Returns the options string a compiled program is cached under, so
+    every caller that compiles with the same options shares entries.
+
+    Args:
+        check_unreachable -- If true, functions not reachable from main
+                             were checked too.
+        clear_dead -- If true, dead reference locals are cleared.
+        scalar_replace -- If true, non-escaping struct locals are
+                          replaced by their fields.
+        regions -- If true, frame-local allocations are freed on return.
+
+    """
+    options = f'check_unreachable={check_unreachable}'
+    if clear_dead:
+        options += ',clear_dead=True'
+    if scalar_replace:
+        options += ',scalar_replace=True'
+    if regions:
+        options += ',regions=True'
+    return options
+
+
+class CompileCache:
+    """A size-capped LRU directory of compiled programs."""
+
+    def __init__(self, directory=None, max_bytes=DEFAULT_MAX_BYTES):
+        """Create a cache over the given directory (created if needed).
+
+        Args:
+            directory -- The cache directory (default_cache_dir() if None).
+            max_bytes -- The total size of entries to keep.
+
+        """
+        self.directory = directory if directory else default_cache_dir()
+        self.max_bytes = max_bytes
+        os.makedirs(self.directory, exist_ok=True)
+
+
+    def key(self, source, options=''):
+        """Returns the cache key for a program source.
+
+        Args:
+            source -- The MyPL program text.
+            options -- A string of compile options affecting the output.
+
+        """
+        h = hashlib.sha256()
+        h.update(f'{FORMAT_VERSION}:{COMPILER_VERSION}:{options}\0'.encode())
+        h.update(source.encode('utf-8'))
+        return h.hexdigest()
+
+
+    def path(self, key):
+        """Returns the file path of the entry for the key."""
+        return os.path.join(self.directory, key + '.myplc')
+
+
+    def get(self, source, options=''):
+        """Returns a VM loaded with the cached program, or None on a miss.
+
+        Args:
+            source -- The MyPL program text.
+            options -- A string of compile options affecting the output.
+
+        """
+        path = self.path(self.key(source, options))
+        try:
+            with open(path, 'rb') as f:
+                data = f.read()
+            vm = loads(data)
+        except (OSError, MyPLError):
+            return None
+        # mark as recently used
+        try:
+            os.utime(path)
+        except OSError:
+            pass
+        return vm
+
+
+    def put(self, source, vm, options=''):
+        """Stores the compiled program loaded in the VM, then evicts old
+        entries if over the size cap.
+
+        Args:
+            source -- The MyPL program text.
+            vm -- The VM holding the compiled program.
+            options -- A string of compile options affecting the output.
+
+        """
+        data = dumps(vm)
+        # write to a temp file and rename so readers never see partial files
+        fd, tmp_path = tempfile.mkstemp(dir=self.directory, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                f.write(data)
+            os.replace(tmp_path, self.path(self.key(source, options)))
+        except OSError:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            return
+        self.evict()
+
+
+    def evict(self):
+        """Removes least recently used entries until under the size cap."""
+        entries = []
+        total = 0
+        for entry in os.scandir(self.directory):
+            if entry.name.endswith('.myplc'):
+                stat = entry.stat()
+                entries.append((stat.st_mtime, stat.st_size, entry.path))
+                total += stat.st_size
+        entries.sort()
+        for _, size, path in entries:
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(path)
+                total -= size
+            except OSError:
+                pass
@@ -0,0 +1,165 @@
+"""Call Graph Visitor for finding the functions reachable from main in
+a MyPL program.
+
+NAME: David Giacobbi
+DATE: Spring 2024
+CLASS: CPSC 326
+
+"""
+
+from mypl_ast import *
+
+
+class CallGraphBuilder(Visitor):
+    """Visitor implementation to record the user-defined functions each
+    function definition calls."""
+
+    def __init__(self):
+        # function name -> set of called function names
+        self.calls = {}
+        # the call set of the function currently being visited
+        self.curr_calls = None
+
+
+    # Helper Functions
+
+    def visit_path(self, path):
+        """Visits the array expressions of a variable reference path.
+
+        Args:
+            path -- The list of VarRef objects to visit.
+
+        """
+        for var_ref in path:
+            if var_ref.array_expr != None:
+                var_ref.array_expr.accept(self)
+
+
+    def reachable(self, root='main'):
+        """Returns the set of function names reachable from the root
+        function by following recorded calls.
+
+        Args:
+            root -- The name of the function to start from.
+
+        """
+        seen = set()
+        work = [root]
+        while work:
+            fun_name = work.pop()
+            if fun_name in seen or fun_name not in self.calls:
+                continue
+            seen.add(fun_name)
+            work.extend(self.calls[fun_name])
+        return seen
+
+
+    # Visitor Functions
+
+    def visit_program(self, program):
+        for fun_def in program.fun_defs:
+            fun_def.accept(self)
+
+
+    def visit_fun_def(self, fun_def):
+        self.curr_calls = set()
+        for stmt in fun_def.stmts:
+            stmt.accept(self)
+        self.calls[fun_def.fun_name.lexeme] = self.curr_calls
+
+
+    def visit_return_stmt(self, return_stmt):
+        return_stmt.expr.accept(self)
+
+
+    def visit_var_decl(self, var_decl):
+        if var_decl.expr != None:
+            var_decl.expr.accept(self)
+
+
+    def visit_assign_stmt(self, assign_stmt):
+        self.visit_path(assign_stmt.lvalue)
+        assign_stmt.expr.accept(self)
+
+
+    def visit_while_stmt(self, while_stmt):
+        while_stmt.condition.accept(self)
+        for stmt in while_stmt.stmts:
+            stmt.accept(self)
+
+
+    def visit_for_stmt(self, for_stmt):
+        for_stmt.var_decl.accept(self)
+        for_stmt.condition.accept(self)
+        for_stmt.assign_stmt.accept(self)
+        for stmt in for_stmt.stmts:
+            stmt.accept(self)
+
+
+    def visit_if_stmt(self, if_stmt):
+        for basic_if in [if_stmt.if_part] + if_stmt.else_ifs:
+            basic_if.condition.accept(self)
+            for stmt in basic_if.stmts:
+                stmt.accept(self)
+        if if_stmt.else_stmts != None:
+            for stmt in if_stmt.else_stmts:
+                stmt.accept(self)
+
+
+    def visit_list_fun_stmt(self, list_fun_stmt):
+        self.visit_path(list_fun_stmt.list_path)
+        if list_fun_stmt.append_item != None:
+            list_fun_stmt.append_item.accept(self)
+
+
+    def visit_call_expr(self, call_expr):
+        # built-ins are recorded too, but reachable() skips them since
+        # they have no FunDef
+        self.curr_calls.add(call_expr.fun_name.lexeme)
+        for arg in call_expr.args:
+            arg.accept(self)
+
+
+    def visit_expr(self, expr):
+        expr.first.accept(self)
+        if expr.op != None:
+            expr.rest.accept(self)
+
+
+    def visit_simple_term(self, simple_term):
+        simple_term.rvalue.accept(self)
+
+
+    def visit_complex_term(self, complex_term):
+        complex_term.expr.accept(self)
+
+
+    def visit_new_rvalue(self, new_rvalue):
+        if new_rvalue.struct_params != None:
+            for param in new_rvalue.struct_params:
+                param.accept(self)
+        else:
+            new_rvalue.array_expr.accept(self)
+
+
+    def visit_list_rvalue(self, list_rvalue):
+        self.visit_path(list_rvalue.list_path)
+
+
+    def visit_var_rvalue(self, var_rvalue):
+        self.visit_path(var_rvalue.path)
+
+
+
+def reachable_functions(program, root='main'):
+    """Returns the set of function names reachable from the root function
+    of the given program.
+
+    Args:
+        program -- The Program AST node.
+        root -- The name of the function to start from.
+
+    """
+    builder = CallGraphBuilder()
+    program.accept(builder)
+    return builder.reachable(root)
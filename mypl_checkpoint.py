@@ -0,0 +1,227 @@
+"""Checkpoint and resume of MyPL VM runs.
+
+A checkpoint is the complete execution state of a VM paused at a safe
+point (between resume() calls): its struct and array heaps, next object
+id, heap accounting, and every call stack frame's function, pc,
+variables, operand stack, and region. It refers to the compiled program by the
+path and hash of a .myplc or .myplimg file, or embeds the program's
+bytecode when there is no file:
+
+    vm.start()
+    run_checkpointed(vm, 'job.ckpt', every_seconds=60)
+    ...
+    vm = load_checkpoint('job.ckpt')      # after a crash
+    run_checkpointed(vm, 'job.ckpt', every_seconds=60)
+
+Checkpoints are written to a temporary file and renamed into place, so
+a crash while writing leaves the previous checkpoint intact. Output the
+program wrote after the last checkpoint is written again on resume.
+A checkpoint also records how many input lines the program has read,
+and a resumed run must be given the same input again: that many lines
+are skipped before the run continues.
+
+NAME: David Giacobbi
+DATE: Spring 2024
+CLASS: CPSC 326
+
+"""
+
+import base64
+import gzip
+import hashlib
+import json
+import os
+import sys
+import time
+
+from mypl_error import *
+from mypl_frame import VMFrame
+from mypl_vm import VM, VMStatus
+from mypl_bytecode import dumps, loads
+from mypl_code_image import load_program
+
+
+CHECKPOINT_VERSION = 3
+
+# instructions run between checks of a time-based checkpoint interval
+CHECK_STEPS = 100_000
+
+
+def file_hash(path):
+    """Returns the SHA-256 hex digest of the file's contents."""
+    with open(path, 'rb') as f:
+        return hashlib.sha256(f.read()).hexdigest()
+
+
+def checkpoint_state(vm, program_path=None):
+    """Returns the VM's execution state as a JSON-compatible dictionary.
+    The VM must be paused between runs (e.g., after resume() yields).
+
+    Args:
+        vm -- The VM to checkpoint.
+        program_path -- The .myplc or .myplimg file the VM's program was
+                        loaded from (the bytecode is embedded if None).
+
+    """
+    if program_path is not None:
+        program = {'path': os.path.abspath(program_path),
+                   'sha256': file_hash(program_path)}
+    else:
+        program = {'bytecode': base64.b64encode(dumps(vm.program)).decode()}
+    # copied, so the state is unaffected by the VM running on
+    frames = [{'function': frame.template.function_name, 'pc': frame.pc,
+               'variables': list(frame.variables),
+               'stack': list(frame.operand_stack),
+               'region': list(frame.region)}
+              for frame in vm.call_stack]
+    return {'version': CHECKPOINT_VERSION, 'program': program,
+            'struct_heap': [(oid, dict(obj))
+                            for oid, obj in vm.struct_heap.items()],
+            'array_heap': [(oid, list(values))
+                           for oid, values in vm.array_heap.items()],
+            'next_obj_id': vm.next_obj_id, 'heap_id': vm.heap_id,
+            'steps': vm.steps, 'lines_read': vm.lines_read,
+            'heap_objects': vm.heap_objects, 'heap_bytes': vm.heap_bytes,
+            'peak_heap_objects': vm.peak_heap_objects,
+            'peak_heap_bytes': vm.peak_heap_bytes,
+            'frames': frames}
+
+
+def save_checkpoint(vm, path, program_path=None):
+    """Writes the VM's execution state to a checkpoint file (gzipped if
+    the path ends in .gz), replacing any earlier checkpoint atomically.
+
+    Args:
+        vm -- The VM to checkpoint.
+        path -- The checkpoint file path.
+        program_path -- The compiled program file (see checkpoint_state).
+
+    """
+    state = checkpoint_state(vm, program_path)
+    # output up to the checkpoint must not be lost with it
+    (vm.stdout or sys.stdout).flush()
+    tmp_path = path + '.tmp'
+    opener = gzip.open if path.endswith('.gz') else open
+    with opener(tmp_path, 'wt') as f:
+        json.dump(state, f, separators=(',', ':'))
+    os.replace(tmp_path, path)
+
+
+def skip_input(stdin, count):
+    """Reads and discards the input lines a checkpointed run already
+    read, raising a VMError if the input is shorter.
+
+    Args:
+        stdin -- The input stream (console if None).
+        count -- The number of lines to skip.
+
+    """
+    stream = stdin if stdin is not None else sys.stdin
+    for i in range(count):
+        if not stream.readline():
+            raise VMError(f'checkpointed run read {count} input lines but '
+                          f'the input has only {i}')
+
+
+def restore_state(state, stdin=None, stdout=None):
+    """Returns a VM in the execution state from checkpoint_state, ready
+    to resume(). The input lines the run had read are skipped, so stdin
+    must give the run's input from its start.
+
+    Args:
+        state -- The checkpoint dictionary.
+        stdin -- The VM's input stream (console if None).
+        stdout -- The VM's output stream (sys.stdout if None).
+
+    """
+    if state.get('version') != CHECKPOINT_VERSION:
+        raise VMError('unsupported checkpoint version')
+    source = state['program']
+    if 'bytecode' in source:
+        program = loads(base64.b64decode(source['bytecode'])).program
+    else:
+        path = source['path']
+        if file_hash(path) != source['sha256']:
+            raise VMError(f'compiled program {path} changed since checkpoint')
+        with open(path, 'rb') as f:
+            data = f.read()
+        if path.endswith('.myplimg'):
+            program = load_program(data)
+        else:
+            program = loads(data).program
+    vm = VM(program, stdin, stdout)
+    # JSON object keys are strings, so the heaps are stored as pairs
+    vm.struct_heap = {oid: obj for oid, obj in state['struct_heap']}
+    vm.array_heap = {oid: values for oid, values in state['array_heap']}
+    vm.next_obj_id = state['next_obj_id']
+    vm.heap_id = state['heap_id']
+    vm.steps = state['steps']
+    vm.lines_read = state['lines_read']
+    vm.heap_objects = state['heap_objects']
+    vm.heap_bytes = state['heap_bytes']
+    vm.peak_heap_objects = state['peak_heap_objects']
+    vm.peak_heap_bytes = state['peak_heap_bytes']
+    vm.call_stack = [VMFrame(vm.get_frame_template(frame['function']),
+                             frame['pc'], frame['variables'], frame['stack'],
+                             frame['region'])
+                     for frame in state['frames']]
+    vm.finished = not vm.call_stack
+    skip_input(stdin, vm.lines_read)
+    return vm
+
+
+def read_checkpoint(path):
+    """Returns the checkpoint dictionary stored in the file.
+
+    Args:
+        path -- The checkpoint file path.
+
+    """
+    opener = gzip.open if path.endswith('.gz') else open
+    with opener(path, 'rt') as f:
+        return json.load(f)
+
+
+def load_checkpoint(path, stdin=None, stdout=None):
+    """Returns a VM restored from a checkpoint file, ready to resume().
+
+    Args:
+        path -- The checkpoint file path.
+        stdin -- The VM's input stream (console if None).
+        stdout -- The VM's output stream (sys.stdout if None).
+
+    """
+    return restore_state(read_checkpoint(path), stdin, stdout)
+
+
+def run_checkpointed(vm, path, every_steps=None, every_seconds=None,
+                     program_path=None):
+    """Resumes a started (or restored) VM to completion, checkpointing it
+    every given number of instructions or seconds, whichever comes
+    first. Checkpoints are taken at the VM's yield points, so intervals
+    may run a little over.
+
+    Args:
+        vm -- The VM, after start() or load_checkpoint().
+        path -- The checkpoint file path.
+        every_steps -- The instructions between checkpoints (optional).
+        every_seconds -- The seconds between checkpoints (optional).
+        program_path -- The compiled program file (see checkpoint_state).
+
+    """
+    chunk = every_steps if every_steps is not None else CHECK_STEPS
+    last_steps = vm.steps
+    last_time = time.monotonic()
+    while True:
+        status = vm.resume(chunk)
+        if status == VMStatus.DONE:
+            return
+        if status == VMStatus.BLOCKED:
+            vm.error('no more input to read')
+        now = time.monotonic()
+        if ((every_steps is not None and vm.steps - last_steps >= every_steps)
+                or (every_seconds is not None and
+                    now - last_time >= every_seconds)):
+            save_checkpoint(vm, path, program_path)
+            last_steps = vm.steps
+            last_time = now
@@ -12,15 +12,30 @@ from mypl_var_table import *
 from mypl_frame import *
 from mypl_opcode import *
 from mypl_vm import *
+from mypl_call_graph import reachable_functions
+from mypl_liveness import clear_dead_slots
+from mypl_escape import non_escaping_structs, frame_local_allocations
 
 
 class CodeGenerator (Visitor):
 
-    def __init__(self, vm):
+    def __init__(self, vm, prune=False, lazy=False, clear_dead=False,
+                 scalar_replace=False, regions=False):
         """Creates a new Code Generator given a VM. 
         
         Args:
-            vm -- The target vm.
+            vm -- The target vm (or VMProgram).
+            prune -- If true, only generate functions reachable from main.
+            lazy -- If true, add stub templates that the VM generates on
+                    their first call.
+            clear_dead -- If true, set struct, array, and list locals to
+                          null where they die (see mypl_liveness).
+            scalar_replace -- If true, keep the fields of struct locals
+                              that do not escape (see mypl_escape) in
+                              local slots instead of allocating them.
+            regions -- If true, add the objects of allocations that cannot
+                       outlive their frame (see mypl_escape) to the
+                       frame's region, freed when it returns.
         """
         # the vm to add frames to
         self.vm = vm
@@ -30,34 +45,129 @@ class CodeGenerator (Visitor):
         self.var_table = VarTable()
         # struct name -> StructDef for struct field info
         self.struct_defs = {}
+        # whether to skip functions main can never call
+        self.prune = prune
+        # whether to defer generating function bodies until called
+        self.lazy = lazy
+        # function name -> FunDef for stubs not yet generated
+        self.lazy_fun_defs = {}
+        # (line, column) of the token the next instructions come from
+        self.pos = None
+        # whether to clear reference locals where they die
+        self.clear_dead = clear_dead
+        # slots of the current function that hold heap references
+        self.ref_slots = set()
+        # whether to replace non-escaping struct locals by their fields
+        self.scalar_replace = scalar_replace
+        # struct locals of the current function held as field slots
+        self.scalar_vars = set()
+        # whether to free frame-local allocations on return
+        self.regions = regions
+        # ids of the current function's frame-local allocation nodes
+        self.region_sites = set()
 
     
-    def add_instr(self, instr):
-        """Helper function to add an instruction to the current template."""
-        self.curr_template.instructions.append(instr)
+    def add_instr(self, instr, token=None):
+        """Helper function to add an instruction to the current template,
+        recording its source position (the token's, if given) in the line
+        table."""
+        if token:
+            self.set_pos(token)
+        instructions = self.curr_template.instructions
+        line_table = self.curr_template.line_table
+        if self.pos and (not line_table or line_table[-1][1:] != self.pos):
+            line_table.append((len(instructions),) + self.pos)
+        instructions.append(instr)
+
+
+    def add_var(self, var_def, var_name=None):
+        """Helper function to add a variable to the current environment
+        (under the given name, if not the var def's), noting its slot if
+        it holds a heap reference."""
+        data_type = var_def.data_type
+        if (data_type.is_array or data_type.is_list or
+                data_type.type_name.token_type == TokenType.ID):
+            self.ref_slots.add(self.var_table.total_vars)
+        self.var_table.add(var_name or var_def.var_name.lexeme)
+
+
+    def path_start(self, path):
+        """Helper function to return the slot of the variable a path
+        starts from and the rest of the path. The path to a field of a
+        scalar replaced struct local starts from the field's slot."""
+        var_name = path[0].var_name.lexeme
+        if var_name in self.scalar_vars:
+            field_name = path[1].var_name.lexeme
+            return self.var_table.get(f'{var_name}.{field_name}'), path[1:]
+        return self.var_table.get(var_name), path
+
+
+    def set_pos(self, token):
+        """Helper function to set the source position of the instructions
+        added next to the token's."""
+        self.pos = (token.line, token.column)
+
+
+    def compile_function(self, fun_name):
+        """Generates the instructions for a stub frame template. Called by
+        the VM on the first call to the function in lazy mode.
+
+        Args:
+            fun_name -- The name of the function to generate.
+
+        """
+        fun_def = self.lazy_fun_defs.pop(fun_name)
+        fun_def.accept(self)
+        return self.vm.frame_templates[fun_name]
 
         
     def visit_program(self, program):
         for struct_def in program.struct_defs:
             struct_def.accept(self)
+        # Only keep functions in main's call graph when pruning
+        reachable = None
+        if self.prune:
+            reachable = reachable_functions(program)
         for fun_def in program.fun_defs:
-            fun_def.accept(self)
+            fun_name = fun_def.fun_name.lexeme
+            if reachable is not None and fun_name not in reachable:
+                continue
+            if self.lazy:
+                # Add a stub (no instructions) to generate on first call
+                self.lazy_fun_defs[fun_name] = fun_def
+                stub = VMFrameTemplate(fun_name, len(fun_def.params), None)
+                self.vm.add_frame_template(stub)
+            else:
+                fun_def.accept(self)
+        if self.lazy:
+            self.vm.lazy_codegen = self
 
     
     def visit_struct_def(self, struct_def):
         # remember the struct def for later
         self.struct_defs[struct_def.struct_name.lexeme] = struct_def
+        # record the field layout in the VM for compiled programs
+        fields = [var_def.var_name.lexeme for var_def in struct_def.fields]
+        self.vm.struct_layouts[struct_def.struct_name.lexeme] = fields
 
         
     def visit_fun_def(self, fun_def):
         # Create a new frame
         self.curr_template = VMFrameTemplate(fun_def.fun_name.lexeme, len(fun_def.params), []) 
+        self.set_pos(fun_def.fun_name)
         # Push new variable environment
         self.var_table.push_environment()
+        self.ref_slots = set()
+        self.scalar_vars = set()
+        if self.scalar_replace:
+            self.scalar_vars = non_escaping_structs(fun_def)
+        self.region_sites = set()
+        if self.regions:
+            self.region_sites = frame_local_allocations(fun_def, self.struct_defs)
         # Store each argument provided on operand stack
         for param in fun_def.params:
             self.add_instr(STORE(self.var_table.total_vars))
-            self.var_table.add(param.var_name.lexeme)
+            self.add_var(param)
         # Visit each statement node
         for stmt in fun_def.stmts:
             stmt.accept(self)
@@ -67,6 +177,8 @@ class CodeGenerator (Visitor):
             self.add_instr(RET())
         # Pop the variable environment
         self.var_table.pop_environment()
+        if self.clear_dead:
+            clear_dead_slots(self.curr_template, self.ref_slots)
         # Add the frame to the VM
         self.vm.add_frame_template(self.curr_template)   
 
@@ -79,9 +191,24 @@ class CodeGenerator (Visitor):
 
         
     def visit_var_decl(self, var_decl):
+        self.set_pos(var_decl.var_def.var_name)
+        var_name = var_decl.var_def.var_name.lexeme
+        if var_name in self.scalar_vars:
+            # Store each field in its own slot (named var.field) instead
+            # of allocating the struct
+            new_rvalue = var_decl.expr.first.rvalue
+            new_struct = self.struct_defs[new_rvalue.type_name.lexeme]
+            for field, param in zip(new_struct.fields, new_rvalue.struct_params):
+                param.accept(self)
+                self.add_instr(STORE(self.var_table.total_vars),
+                               new_rvalue.type_name)
+                self.add_var(field, f'{var_name}.{field.var_name.lexeme}')
+            return
         # Check if list variable declaration
         if var_decl.var_def.data_type.is_list:
             self.add_instr(ALLOCL())
+            if id(var_decl) in self.region_sites:
+                self.add_instr(REGION())
         else:
             # Check if expression value exists
             if var_decl.expr == None:
@@ -89,29 +216,30 @@ class CodeGenerator (Visitor):
             else:
                 var_decl.expr.accept(self)
         # Store expression value in memory
-        self.add_instr(STORE(self.var_table.total_vars))
+        self.add_instr(STORE(self.var_table.total_vars), var_decl.var_def.var_name)
         # Add variable name to current environment
-        self.var_table.add(var_decl.var_def.var_name.lexeme)
+        self.add_var(var_decl.var_def)
     
 
     def visit_list_fun_stmt(self, list_fun_stmt):
         # Take care of the list path to the list to find the max or min of
         # Load the first variable value
-        var_val = self.var_table.get(list_fun_stmt.list_path[0].var_name.lexeme)
+        self.set_pos(list_fun_stmt.list_path[0].var_name)
+        var_val, list_path = self.path_start(list_fun_stmt.list_path)
         self.add_instr(LOAD(var_val))
         # Check array expression
-        if list_fun_stmt.list_path[0].array_expr != None:
-            list_fun_stmt.list_path[0].array_expr.accept(self)
+        if list_path[0].array_expr != None:
+            list_path[0].array_expr.accept(self)
             self.add_instr(GETI())
         # Check if path is greater than 1 and proceed with remaining path
-        if len(list_fun_stmt.list_path) > 0:
+        if len(list_path) > 0:
             # Follow the rest of the path
-            for i in range(1, len(list_fun_stmt.list_path)):
-                var_val = list_fun_stmt.list_path[i].var_name.lexeme
-                self.add_instr(GETF(var_val))
+            for i in range(1, len(list_path)):
+                var_val = list_path[i].var_name.lexeme
+                self.add_instr(GETF(var_val), list_path[i].var_name)
                 # Check array expression
-                if list_fun_stmt.list_path[i].array_expr != None:
-                    list_fun_stmt.list_path[i].array_expr.accept(self)
+                if list_path[i].array_expr != None:
+                    list_path[i].array_expr.accept(self)
                     self.add_instr(GETI()) 
 
         # Use list function class to check which function
@@ -119,62 +247,65 @@ class CodeGenerator (Visitor):
             # Convert to append value with visitor
             list_fun_stmt.append_item.accept(self)
             # Append value to the list
-            self.add_instr(APP())
+            self.add_instr(APP(), list_fun_stmt.function)
         elif list_fun_stmt.function.token_type == TokenType.CLEAR:
-            self.add_instr(CLEAR())
+            self.add_instr(CLEAR(), list_fun_stmt.function)
         else:
-            self.add_instr(POPL())
+            self.add_instr(POPL(), list_fun_stmt.function)
 
     
     def visit_assign_stmt(self, assign_stmt):
         # Load the first variable value
-        var_val = self.var_table.get(assign_stmt.lvalue[0].var_name.lexeme)
+        self.set_pos(assign_stmt.lvalue[0].var_name)
+        var_val, lvalue = self.path_start(assign_stmt.lvalue)
         # Check if path is greater than 1 and proceed with remaining path
-        if len(assign_stmt.lvalue) > 1:
+        if len(lvalue) > 1:
             # Load the first var_val
             self.add_instr(LOAD(var_val))
             # Check array expression
-            if assign_stmt.lvalue[0].array_expr != None:
-                assign_stmt.lvalue[0].array_expr.accept(self)
+            if lvalue[0].array_expr != None:
+                lvalue[0].array_expr.accept(self)
                 self.add_instr(GETI())
             # Follow the rest of the path
-            for i in range(1, len(assign_stmt.lvalue)):
-                if i == len(assign_stmt.lvalue)-1:
+            for i in range(1, len(lvalue)):
+                self.set_pos(lvalue[i].var_name)
+                if i == len(lvalue)-1:
                     # Check array expression
-                    if assign_stmt.lvalue[i].array_expr != None:
+                    if lvalue[i].array_expr != None:
                         # Get the oid
-                        self.add_instr(GETF(assign_stmt.lvalue[i].var_name.lexeme))
+                        self.add_instr(GETF(lvalue[i].var_name.lexeme))
                         # Push the index
-                        assign_stmt.lvalue[i].array_expr.accept(self)
+                        lvalue[i].array_expr.accept(self)
                         # Visit the expression
                         assign_stmt.expr.accept(self)
                         # Set the index
-                        self.add_instr(SETI())
+                        self.add_instr(SETI(), lvalue[i].var_name)
                     else:
                         # Visit the expression
                         assign_stmt.expr.accept(self)
-                        self.add_instr(SETF(assign_stmt.lvalue[i].var_name.lexeme)) 
+                        self.add_instr(SETF(lvalue[i].var_name.lexeme),
+                                       lvalue[i].var_name)
                 else:
-                    var_val = assign_stmt.lvalue[i].var_name.lexeme
+                    var_val = lvalue[i].var_name.lexeme
                     self.add_instr(GETF(var_val))
                     # Check array expression
-                    if assign_stmt.lvalue[i].array_expr != None:
-                        assign_stmt.lvalue[i].array_expr.accept(self)
+                    if lvalue[i].array_expr != None:
+                        lvalue[i].array_expr.accept(self)
                         self.add_instr(GETI()) 
         else: 
             # Check to set array or update value
-            if assign_stmt.lvalue[0].array_expr != None:
+            if lvalue[0].array_expr != None:
                 # Load the oid
                 self.add_instr(LOAD(var_val))
                 # Push the index
-                assign_stmt.lvalue[0].array_expr.accept(self) 
+                lvalue[0].array_expr.accept(self) 
                 # Visit the expression
                 assign_stmt.expr.accept(self)
-                self.add_instr(SETI())
+                self.add_instr(SETI(), lvalue[0].var_name)
             else:
                 # Visit the expression
                 assign_stmt.expr.accept(self)
-                self.add_instr(STORE(var_val))
+                self.add_instr(STORE(var_val), lvalue[0].var_name)
 
     
     def visit_while_stmt(self, while_stmt):
@@ -292,50 +423,50 @@ class CodeGenerator (Visitor):
         if call_expr.fun_name.lexeme == 'print':
             if len(call_expr.args) > 0:
                 call_expr.args[0].accept(self)
-            self.add_instr(WRITE())
+            self.add_instr(WRITE(), call_expr.fun_name)
         # Input Built-In
         elif call_expr.fun_name.lexeme == 'input':
-            self.add_instr(READ())
+            self.add_instr(READ(), call_expr.fun_name)
         # ITOS Built-In
         elif call_expr.fun_name.lexeme == "itos":
             call_expr.args[0].accept(self)
-            self.add_instr(TOSTR())
+            self.add_instr(TOSTR(), call_expr.fun_name)
         # ITOD Built-In
         elif call_expr.fun_name.lexeme == "itod":
             call_expr.args[0].accept(self)
-            self.add_instr(TODBL())
+            self.add_instr(TODBL(), call_expr.fun_name)
         # DTOS Built-In
         elif call_expr.fun_name.lexeme == "dtos":
             call_expr.args[0].accept(self)
-            self.add_instr(TOSTR())
+            self.add_instr(TOSTR(), call_expr.fun_name)
         # DTOI Built-In
         elif call_expr.fun_name.lexeme == "dtoi":
             call_expr.args[0].accept(self)
-            self.add_instr(TOINT())
+            self.add_instr(TOINT(), call_expr.fun_name)
         # STOI Built-In
         elif call_expr.fun_name.lexeme == "stoi":
             call_expr.args[0].accept(self)
-            self.add_instr(TOINT())
+            self.add_instr(TOINT(), call_expr.fun_name)
         # STOD Built-In
         elif call_expr.fun_name.lexeme == "stod":
             call_expr.args[0].accept(self)
-            self.add_instr(TODBL())
+            self.add_instr(TODBL(), call_expr.fun_name)
         # Length Built-In
         elif call_expr.fun_name.lexeme == "length":
             call_expr.args[0].accept(self)
-            self.add_instr(LEN())
+            self.add_instr(LEN(), call_expr.fun_name)
         # Get Built-In
         elif call_expr.fun_name.lexeme == "get":
             call_expr.args[0].accept(self)
             call_expr.args[1].accept(self)
-            self.add_instr(GETC())
+            self.add_instr(GETC(), call_expr.fun_name)
         # Create function call for specified name
         else:
             # Push arguments onto stack
             for arg in call_expr.args:
                 arg.accept(self)
             # Create function call
-            self.add_instr(CALL(call_expr.fun_name.lexeme))
+            self.add_instr(CALL(call_expr.fun_name.lexeme), call_expr.fun_name)
 
         
     def visit_expr(self, expr):
@@ -345,6 +476,7 @@ class CodeGenerator (Visitor):
         if expr.op != None:
             # Push the rest of the expression
             expr.rest.accept(self)
+            self.set_pos(expr.op)
             # Add the proper instruction for the op
             if expr.op.token_type == TokenType.PLUS:
                 self.add_instr(ADD())
@@ -396,6 +528,7 @@ class CodeGenerator (Visitor):
 
         
     def visit_simple_rvalue(self, simple_rvalue):
+        self.set_pos(simple_rvalue.value)
         val = simple_rvalue.value.lexeme
         if simple_rvalue.value.token_type == TokenType.INT_VAL:
             self.add_instr(PUSH(int(val)))
@@ -417,65 +550,70 @@ class CodeGenerator (Visitor):
         # Check if type a struct
         if new_rvalue.struct_params != None:
             # Allocate instruction
-            self.add_instr(ALLOCS())
+            self.add_instr(ALLOCS(new_rvalue.type_name.lexeme), new_rvalue.type_name)
+            if id(new_rvalue) in self.region_sites:
+                self.add_instr(REGION())
             # Get the field information from struct def
             new_struct = self.struct_defs[new_rvalue.type_name.lexeme]
             # Set each field in the struct with provided struct_params
             for i in range(len(new_rvalue.struct_params)):
-                self.add_instr(DUP())
+                self.add_instr(DUP(), new_rvalue.type_name)
                 new_rvalue.struct_params[i].accept(self)
-                self.add_instr(SETF(new_struct.fields[i].var_name.lexeme))
+                self.add_instr(SETF(new_struct.fields[i].var_name.lexeme),
+                               new_rvalue.type_name)
         # Type is an array creation
         else:
             # Get the size of the array from expression
             new_rvalue.array_expr.accept(self)
             # Allocate instruction
-            self.add_instr(ALLOCA())
+            self.add_instr(ALLOCA(), new_rvalue.type_name)
+            if id(new_rvalue) in self.region_sites:
+                self.add_instr(REGION())
 
 
     def visit_list_rvalue(self, list_rvalue):
         # Take care of the list path to the list to find the max or min of
         # Load the first variable value
-        var_val = self.var_table.get(list_rvalue.list_path[0].var_name.lexeme)
-        self.add_instr(LOAD(var_val))
+        var_val, list_path = self.path_start(list_rvalue.list_path)
+        self.add_instr(LOAD(var_val), list_path[0].var_name)
         # Check array expression
-        if list_rvalue.list_path[0].array_expr != None:
-            list_rvalue.list_path[0].array_expr.accept(self)
+        if list_path[0].array_expr != None:
+            list_path[0].array_expr.accept(self)
             self.add_instr(GETI())
         # Check if path is greater than 1 and proceed with remaining path
-        if len(list_rvalue.list_path) > 0:
+        if len(list_path) > 0:
             # Follow the rest of the path
-            for i in range(1, len(list_rvalue.list_path)):
-                var_val = list_rvalue.list_path[i].var_name.lexeme
-                self.add_instr(GETF(var_val))
+            for i in range(1, len(list_path)):
+                var_val = list_path[i].var_name.lexeme
+                self.add_instr(GETF(var_val), list_path[i].var_name)
                 # Check array expression
-                if list_rvalue.list_path[i].array_expr != None:
-                    list_rvalue.list_path[i].array_expr.accept(self)
+                if list_path[i].array_expr != None:
+                    list_path[i].array_expr.accept(self)
                     self.add_instr(GETI()) 
 
         # Perform max or min function depending on which is found in AST node
         if list_rvalue.fun_name.token_type == TokenType.MAX:
-            self.add_instr(MAX())
+            self.add_instr(MAX(), list_rvalue.fun_name)
         else:
-            self.add_instr(MIN())
+            self.add_instr(MIN(), list_rvalue.fun_name)
                 
     
     def visit_var_rvalue(self, var_rvalue):
         # Load the first variable value
-        var_val = self.var_table.get(var_rvalue.path[0].var_name.lexeme)
-        self.add_instr(LOAD(var_val))
+        var_val, path = self.path_start(var_rvalue.path)
+        self.add_instr(LOAD(var_val), path[0].var_name)
         # Check array expression
-        if var_rvalue.path[0].array_expr != None:
-            var_rvalue.path[0].array_expr.accept(self)
+        if path[0].array_expr != None:
+            path[0].array_expr.accept(self)
             self.add_instr(GETI())
         # Check if path is greater than 1 and proceed with remaining path
-        if len(var_rvalue.path) > 0:
+        if len(path) > 0:
             # Follow the rest of the path
-            for i in range(1, len(var_rvalue.path)):
-                var_val = var_rvalue.path[i].var_name.lexeme
-                self.add_instr(GETF(var_val))
+            for i in range(1, len(path)):
+                var_val = path[i].var_name.lexeme
+                self.add_instr(GETF(var_val), path[i].var_name)
                 # Check array expression
-                if var_rvalue.path[i].array_expr != None:
-                    var_rvalue.path[i].array_expr.accept(self)
+                if path[i].array_expr != None:
+                    path[i].array_expr.accept(self)
                     self.add_instr(GETI())             
                 
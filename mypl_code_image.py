@@ -0,0 +1,391 @@
+"""Flat, memory-mappable code images of compiled MyPL programs
+(.myplimg files).
+
+Unlike a .myplc file, an image is never deserialized. It is laid out as
+fixed-width tables that the VM reads in place through a read-only mmap,
+so every worker process that maps the same image shares one physical
+copy of the instruction stream:
+
+    header      magic, format version, compiler version, table counts
+                and offsets
+    functions   (name string, arg count, first instr, instr count,
+                first line entry, line entry count) rows
+    structs     (name string, field count, first field) rows
+    fields      string index of each struct field name
+    opcodes     one byte per instruction
+    operands    constant pool index per instruction (-1 for none)
+    lines       (pc, line, column) line table entries
+    constants   (tag, payload) rows: int64, double, or string index
+    strings     offset table followed by the UTF-8 string data
+
+Instruction comments are not stored. A process only allocates a
+VMInstr for each distinct (opcode, operand) pair it executes.
+
+NAME: David Giacobbi
+DATE: Spring 2024
+CLASS: CPSC 326
+
+"""
+
+import mmap
+import os
+import struct
+
+from mypl_error import *
+from mypl_opcode import OpCode
+from mypl_frame import VMFrameTemplate, VMInstr
+from mypl_program import VMProgram
+from mypl_vm import VM
+from mypl_bytecode import COMPILER_VERSION
+
+
+MAGIC = b'MYPLIMG\0'
+FORMAT_VERSION = 3
+
+# the compiler version is stored NUL padded in a 16 byte field
+HEADER = struct.Struct('<8sI16s7I9Q')
+FUNCTION = struct.Struct('<6I')
+STRUCT = struct.Struct('<3I')
+CONSTANT = struct.Struct('<I4x8s')
+
+# constant tags
+TAG_INT = 0
+TAG_DOUBLE = 1
+TAG_STRING = 2
+TAG_TRUE = 3
+TAG_FALSE = 4
+TAG_BIG_INT = 5     # ints outside 64 bits, stored as decimal strings
+
+I64 = struct.Struct('<q')
+F64 = struct.Struct('<d')
+U64 = struct.Struct('<Q')
+
+
+class ImageBuilder:
+    """Collects the tables of a code image with deduplicated strings and
+    constants."""
+
+    def __init__(self):
+        self.strings = []
+        self.string_ids = {}
+        self.constants = []
+        self.constant_ids = {}
+
+    def string(self, value):
+        """Returns the string table index for the value."""
+        if value not in self.string_ids:
+            self.string_ids[value] = len(self.strings)
+            self.strings.append(value)
+        return self.string_ids[value]
+
+    def constant(self, value):
+        """Returns the constant pool index for the value (-1 for None)."""
+        if value is None:
+            return -1
+        # keep 1, 1.0, and True apart
+        key = (type(value), value)
+        if key in self.constant_ids:
+            return self.constant_ids[key]
+        if value is True:
+            row = CONSTANT.pack(TAG_TRUE, bytes(8))
+        elif value is False:
+            row = CONSTANT.pack(TAG_FALSE, bytes(8))
+        elif type(value) == int and -2**63 <= value < 2**63:
+            row = CONSTANT.pack(TAG_INT, I64.pack(value))
+        elif type(value) == int:
+            row = CONSTANT.pack(TAG_BIG_INT, U64.pack(self.string(str(value))))
+        elif type(value) == float:
+            row = CONSTANT.pack(TAG_DOUBLE, F64.pack(value))
+        elif type(value) == str:
+            row = CONSTANT.pack(TAG_STRING, U64.pack(self.string(value)))
+        else:
+            raise BytecodeError(f'cannot store operand {value!r} in image')
+        self.constant_ids[key] = len(self.constants)
+        self.constants.append(row)
+        return self.constant_ids[key]
+
+
+def pad(data):
+    """Pads a bytearray to a multiple of 8 bytes."""
+    data += bytes(-len(data) % 8)
+
+
+def build_image(vm):
+    """Returns the bytes of a code image for the program loaded in the VM.
+
+    Args:
+        vm -- The VM (or VMProgram) whose frame templates and struct
+              layouts to write.
+
+    """
+    b = ImageBuilder()
+    functions = bytearray()
+    opcodes = bytearray()
+    operands = []
+    lines = []
+    for name, template in vm.frame_templates.items():
+        if template.instructions is None:
+            raise BytecodeError(f'cannot store lazy stub for {name} in image')
+        first = len(opcodes)
+        for instr in template.instructions:
+            opcodes.append(instr.opcode.value)
+            operands.append(b.constant(instr.operand))
+        first_line = len(lines) // 3
+        for entry in template.line_table:
+            lines.extend(entry)
+        functions += FUNCTION.pack(b.string(name), template.arg_count,
+                                   first, len(template.instructions),
+                                   first_line, len(template.line_table))
+    structs = bytearray()
+    fields = []
+    for name, field_names in vm.struct_layouts.items():
+        structs += STRUCT.pack(b.string(name), len(field_names), len(fields))
+        fields.extend(b.string(field_name) for field_name in field_names)
+    encoded = [s.encode('utf-8') for s in b.strings]
+    string_offsets = [0]
+    for data in encoded:
+        string_offsets.append(string_offsets[-1] + len(data))
+    # lay out the sections after the header, each 8-byte aligned
+    sections = [
+        functions,
+        structs,
+        bytearray(struct.pack(f'<{len(fields)}I', *fields)),
+        opcodes,
+        bytearray(struct.pack(f'<{len(operands)}i', *operands)),
+        bytearray(struct.pack(f'<{len(lines)}I', *lines)),
+        bytearray(b''.join(b.constants)),
+        bytearray(struct.pack(f'<{len(string_offsets)}I', *string_offsets)),
+        bytearray(b''.join(encoded)),
+    ]
+    offsets = []
+    pos = HEADER.size
+    for section in sections:
+        pad(section)
+        offsets.append(pos)
+        pos += len(section)
+    header = HEADER.pack(MAGIC, FORMAT_VERSION, COMPILER_VERSION.encode(),
+                         len(vm.frame_templates),
+                         len(vm.struct_layouts), len(fields), len(opcodes),
+                         len(b.constants), len(b.strings), len(lines) // 3,
+                         *offsets)
+    return header + b''.join(sections)
+
+
+def write_image(vm, path):
+    """Writes the program loaded in the VM to a .myplimg file.
+
+    Args:
+        vm -- The VM whose program to write.
+        path -- The output file path.
+
+    """
+    with open(path, 'wb') as f:
+        f.write(build_image(vm))
+
+
+class CodeImage:
+    """A read-only view over the tables of a code image buffer."""
+
+    def __init__(self, buffer):
+        """Create a view over an image buffer (bytes or an mmap).
+
+        Args:
+            buffer -- The image bytes.
+
+        """
+        self.buffer = buffer
+        view = memoryview(buffer)
+        if len(view) < HEADER.size:
+            raise BytecodeError('not a MyPL code image')
+        header = HEADER.unpack_from(view, 0)
+        if header[0] != MAGIC:
+            raise BytecodeError('not a MyPL code image')
+        if header[1] != FORMAT_VERSION:
+            raise BytecodeError(f'unsupported image version {header[1]}')
+        compiler_version = header[2].rstrip(b'\0').decode('utf-8', 'replace')
+        if compiler_version != COMPILER_VERSION:
+            raise BytecodeError(f'compiled by incompatible compiler '
+                                f'{compiler_version}')
+        (self.function_count, self.struct_count, field_count,
+         instr_count, constant_count, string_count, line_count) = header[3:10]
+        (self.functions_off, self.structs_off, fields_off, opcodes_off,
+         operands_off, lines_off, self.constants_off, string_offsets_off,
+         self.string_data_off) = header[10:]
+        if string_offsets_off + 4 * (string_count + 1) > len(view):
+            raise BytecodeError('truncated code image')
+        self.fields = view[fields_off:fields_off + 4 * field_count].cast('I')
+        self.opcodes = view[opcodes_off:opcodes_off + instr_count]
+        self.operands = view[operands_off:operands_off + 4 * instr_count].cast('i')
+        self.lines = view[lines_off:lines_off + 12 * line_count].cast('I')
+        end = string_offsets_off + 4 * (string_count + 1)
+        self.string_offsets = view[string_offsets_off:end].cast('I')
+        self.view = view
+        # per-process caches of decoded strings, constants, instructions
+        self.string_cache = {}
+        self.constant_cache = {}
+        self.instr_cache = {}
+
+    def string(self, index):
+        """Returns the string at the given string table index."""
+        if index not in self.string_cache:
+            start = self.string_data_off + self.string_offsets[index]
+            end = self.string_data_off + self.string_offsets[index + 1]
+            self.string_cache[index] = bytes(self.view[start:end]).decode('utf-8')
+        return self.string_cache[index]
+
+    def constant(self, index):
+        """Returns the constant at the given constant pool index."""
+        if index < 0:
+            return None
+        if index not in self.constant_cache:
+            offset = self.constants_off + CONSTANT.size * index
+            tag, payload = CONSTANT.unpack_from(self.view, offset)
+            if tag == TAG_INT:
+                value = I64.unpack(payload)[0]
+            elif tag == TAG_DOUBLE:
+                value = F64.unpack(payload)[0]
+            elif tag == TAG_STRING:
+                value = self.string(U64.unpack(payload)[0])
+            elif tag == TAG_BIG_INT:
+                value = int(self.string(U64.unpack(payload)[0]))
+            elif tag == TAG_TRUE:
+                value = True
+            elif tag == TAG_FALSE:
+                value = False
+            else:
+                raise BytecodeError(f'invalid constant tag {tag}')
+            self.constant_cache[index] = value
+        return self.constant_cache[index]
+
+    def instr(self, pos):
+        """Returns the (shared) VMInstr at the given instruction position."""
+        key = (self.opcodes[pos], self.operands[pos])
+        instr = self.instr_cache.get(key)
+        if instr is None:
+            instr = VMInstr(OpCode(key[0]), self.constant(key[1]))
+            self.instr_cache[key] = instr
+        return instr
+
+    def templates(self):
+        """Returns the frame templates of the image, executing in place."""
+        templates = []
+        for i in range(self.function_count):
+            offset = self.functions_off + FUNCTION.size * i
+            (name, arg_count, first, count,
+             first_line, line_count) = FUNCTION.unpack_from(self.view, offset)
+            instructions = MappedInstructions(self, first, count)
+            line_table = MappedLineTable(self, first_line, line_count)
+            templates.append(VMFrameTemplate(self.string(name), arg_count,
+                                             instructions, line_table))
+        return templates
+
+    def struct_layouts(self):
+        """Returns the struct name -> field names mapping of the image."""
+        layouts = {}
+        for i in range(self.struct_count):
+            offset = self.structs_off + STRUCT.size * i
+            name, count, first = STRUCT.unpack_from(self.view, offset)
+            layouts[self.string(name)] = [self.string(self.fields[j])
+                                          for j in range(first, first + count)]
+        return layouts
+
+
+class MappedInstructions:
+    """The instruction sequence of one function in a code image."""
+
+    def __init__(self, image, first, count):
+        self.image = image
+        self.first = first
+        self.count = count
+
+    def __len__(self):
+        return self.count
+
+    def __getitem__(self, pc):
+        if pc < 0 or pc >= self.count:
+            raise IndexError('instruction index out of range')
+        return self.image.instr(self.first + pc)
+
+    def __iter__(self):
+        for pc in range(self.count):
+            yield self.image.instr(self.first + pc)
+
+    def __repr__(self):
+        return repr(list(self))
+
+
+class MappedLineTable:
+    """The (pc, line, column) line table of one function in a code
+    image."""
+
+    def __init__(self, image, first, count):
+        self.image = image
+        self.first = first
+        self.count = count
+
+    def __len__(self):
+        return self.count
+
+    def __getitem__(self, i):
+        if i < 0 or i >= self.count:
+            raise IndexError('line table index out of range')
+        row = 3 * (self.first + i)
+        return tuple(self.image.lines[row:row + 3])
+
+    def __iter__(self):
+        for i in range(self.count):
+            yield self[i]
+
+    def __repr__(self):
+        return repr(list(self))
+
+
+def load_program(buffer):
+    """Returns a frozen VMProgram executing in place from an image buffer.
+
+    Args:
+        buffer -- The image bytes (or an mmap of them).
+
+    """
+    image = CodeImage(buffer)
+    program = VMProgram()
+    program.struct_layouts.update(image.struct_layouts())
+    for template in image.templates():
+        program.add_frame_template(template)
+    return program.freeze()
+
+
+def load_image(buffer):
+    """Returns a new VM for the program in a code image buffer.
+
+    Args:
+        buffer -- The image bytes (or an mmap of them).
+
+    """
+    return VM(load_program(buffer))
+
+
+def map_program(path):
+    """Maps a .myplimg file read-only and returns its frozen VMProgram.
+    The mapping stays open for as long as the program uses it.
+
+    Args:
+        path -- The image file path.
+
+    """
+    with open(path, 'rb') as f:
+        # an empty file cannot be mapped
+        if os.fstat(f.fileno()).st_size < HEADER.size:
+            raise BytecodeError('not a MyPL code image')
+        buffer = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    return load_program(buffer)
+
+
+def map_image(path):
+    """Maps a .myplimg file read-only and returns a new VM for it.
+
+    Args:
+        path -- The image file path.
+
+    """
+    return VM(map_program(path))
@@ -0,0 +1,65 @@
+"""Helpers for compiling MyPL source text into a program ready to run.
+
+NAME: David Giacobbi
+DATE: Spring 2024
+CLASS: CPSC 326
+
+"""
+
+import io
+
+from mypl_iowrapper import FileWrapper
+from mypl_lexer import Lexer
+from mypl_ast_parser import ASTParser
+from mypl_semantic_checker import SemanticChecker
+from mypl_code_gen import CodeGenerator
+from mypl_program import VMProgram
+from mypl_vm import VM
+
+
+def compile_program(source, check_unreachable=True, lazy=False,
+                    clear_dead=False, scalar_replace=False, regions=False):
+    """Lexes, parses, checks, and generates code for a MyPL program,
+    returning the frozen VMProgram. Only functions reachable from main
+    are generated.
+
+    Args:
+        source -- The MyPL program text.
+        check_unreachable -- If false, skip checking unreachable functions.
+        lazy -- If true, generate each function's code on its first call.
+        clear_dead -- If true, set reference locals to null where they die.
+        scalar_replace -- If true, keep non-escaping struct locals' fields
+                          in local slots.
+        regions -- If true, free objects that cannot outlive their frame
+                   when it returns.
+
+    """
+    lexer = Lexer(FileWrapper(io.StringIO(source)))
+    ast = ASTParser(lexer).parse()
+    ast.accept(SemanticChecker(check_unreachable))
+    program = VMProgram()
+    ast.accept(CodeGenerator(program, prune=True, lazy=lazy,
+                             clear_dead=clear_dead,
+                             scalar_replace=scalar_replace,
+                             regions=regions))
+    return program.freeze()
+
+
+def compile_source(source, check_unreachable=True, lazy=False,
+                   clear_dead=False, scalar_replace=False, regions=False):
+    """Compiles a MyPL program (see compile_program), returning a VM
+    ready to run it.
+
+    Args:
+        source -- The MyPL program text.
+        check_unreachable -- If false, skip checking unreachable functions.
+        lazy -- If true, generate each function's code on its first call.
+        clear_dead -- If true, set reference locals to null where they die.
+        scalar_replace -- If true, keep non-escaping struct locals' fields
+                          in local slots.
+        regions -- If true, free objects that cannot outlive their frame
+                   when it returns.
+
+    """
+    return VM(compile_program(source, check_unreachable, lazy, clear_dead,
+                              scalar_replace, regions))
@@ -65,5 +65,30 @@ def VMError(message):
 
 
 
+def BytecodeError(message):
+    """Create a MyPLError for a compiled bytecode file exception.
+    
+    Args:
+        message -- The error message.
+
+    """
+    return MyPLError('Bytecode Error: ' + message)
+
 
 
+class VMLimitError(MyPLError):
+    """For a VM run stopped by its instruction, time, call depth, or heap
+    limit."""
+
+    def __init__(self, message, function_name, pc):
+        """Create a VMLimitError exception object.
+
+        Args:
+            message -- The error message (which limit was hit).
+            function_name -- The function running when the limit hit.
+            pc -- The instruction index where the limit hit.
+
+        """
+        super().__init__(f'VM Error: {message} (in {function_name} at {pc})')
+        self.function_name = function_name
+        self.pc = pc
@@ -0,0 +1,480 @@
+"""Escape analyses over function definitions.
+
+Scalar replacement: a struct local escapes its function if its reference
+can be seen anywhere other than through its own fields. A local does not
+escape, and its fields can live in plain local slots instead of a heap
+struct, if:
+
+  * it is initialized by a struct creation (Point p = new Point(x, y)),
+  * it is only ever used through a field (p.x, p.x = e, p.xs.append(e)),
+    so it is never assigned, passed to a call, returned, stored in a
+    field, array, or list, or compared (even to null), and
+  * it is the only variable of that name in its function (so scoping
+    cannot make two variables look like one).
+
+Frame-local allocations: an object allocated by a function can be freed
+when the function returns if it cannot be reached from the return
+value, the caller's objects, or another frame. The function's objects
+are split into alias classes (as in Steensgaard's points-to analysis):
+each variable and allocation site belongs to a class, and the objects
+of a class only refer (by field or element) to objects of its one
+pointee class. Classes are merged as references flow between them. A
+class escapes if one of its references is returned or passed to a (non
+built-in) function, or it holds a parameter, a call's result, or an
+object an escaping class refers to. Every allocation site in a class
+that does not escape is frame-local.
+
+NAME: David Giacobbi
+DATE: Spring 2024
+CLASS: CPSC 326
+
+"""
+
+from mypl_ast import *
+from mypl_token import TokenType
+
+
+class EscapeAnalyzer(Visitor):
+    """Visitor implementation to find the struct locals of a function
+    definition that do not escape it."""
+
+    def __init__(self):
+        # variable name -> number of declarations in the function
+        self.declared = {}
+        # names of struct locals initialized by a struct creation
+        self.candidates = set()
+        # names of variables used other than through a field
+        self.escaped = set()
+
+
+    # Helper Functions
+
+    def visit_path(self, path):
+        """Visits a variable reference path, noting a variable used by
+        itself (not through a field) as escaping.
+
+        Args:
+            path -- The list of VarRef objects to visit.
+
+        """
+        if len(path) == 1:
+            self.escaped.add(path[0].var_name.lexeme)
+        for var_ref in path:
+            if var_ref.array_expr != None:
+                var_ref.array_expr.accept(self)
+
+
+    def is_struct_creation(self, expr):
+        """Returns true if the expression is just a new struct value."""
+        return (expr != None and not expr.not_op and expr.op == None and
+                isinstance(expr.first, SimpleTerm) and
+                isinstance(expr.first.rvalue, NewRValue) and
+                expr.first.rvalue.struct_params != None)
+
+
+    def add_decl(self, var_def):
+        """Counts a declaration of the variable."""
+        name = var_def.var_name.lexeme
+        self.declared[name] = self.declared.get(name, 0) + 1
+
+
+    def non_escaping(self):
+        """Returns the set of struct locals found not to escape."""
+        return {name for name in self.candidates
+                if name not in self.escaped and self.declared[name] == 1}
+
+
+    # Visitor Functions
+
+    def visit_fun_def(self, fun_def):
+        for param in fun_def.params:
+            self.add_decl(param)
+        for stmt in fun_def.stmts:
+            stmt.accept(self)
+
+
+    def visit_return_stmt(self, return_stmt):
+        return_stmt.expr.accept(self)
+
+
+    def visit_var_decl(self, var_decl):
+        self.add_decl(var_decl.var_def)
+        data_type = var_decl.var_def.data_type
+        if (not data_type.is_array and not data_type.is_list and
+                data_type.type_name.token_type == TokenType.ID and
+                self.is_struct_creation(var_decl.expr)):
+            self.candidates.add(var_decl.var_def.var_name.lexeme)
+        if var_decl.expr != None:
+            var_decl.expr.accept(self)
+
+
+    def visit_assign_stmt(self, assign_stmt):
+        self.visit_path(assign_stmt.lvalue)
+        assign_stmt.expr.accept(self)
+
+
+    def visit_while_stmt(self, while_stmt):
+        while_stmt.condition.accept(self)
+        for stmt in while_stmt.stmts:
+            stmt.accept(self)
+
+
+    def visit_for_stmt(self, for_stmt):
+        for_stmt.var_decl.accept(self)
+        for_stmt.condition.accept(self)
+        for_stmt.assign_stmt.accept(self)
+        for stmt in for_stmt.stmts:
+            stmt.accept(self)
+
+
+    def visit_if_stmt(self, if_stmt):
+        for basic_if in [if_stmt.if_part] + if_stmt.else_ifs:
+            basic_if.condition.accept(self)
+            for stmt in basic_if.stmts:
+                stmt.accept(self)
+        if if_stmt.else_stmts != None:
+            for stmt in if_stmt.else_stmts:
+                stmt.accept(self)
+
+
+    def visit_list_fun_stmt(self, list_fun_stmt):
+        self.visit_path(list_fun_stmt.list_path)
+        if list_fun_stmt.append_item != None:
+            list_fun_stmt.append_item.accept(self)
+
+
+    def visit_call_expr(self, call_expr):
+        for arg in call_expr.args:
+            arg.accept(self)
+
+
+    def visit_expr(self, expr):
+        expr.first.accept(self)
+        if expr.op != None:
+            expr.rest.accept(self)
+
+
+    def visit_simple_term(self, simple_term):
+        simple_term.rvalue.accept(self)
+
+
+    def visit_complex_term(self, complex_term):
+        complex_term.expr.accept(self)
+
+
+    def visit_new_rvalue(self, new_rvalue):
+        if new_rvalue.struct_params != None:
+            for param in new_rvalue.struct_params:
+                param.accept(self)
+        else:
+            new_rvalue.array_expr.accept(self)
+
+
+    def visit_list_rvalue(self, list_rvalue):
+        self.visit_path(list_rvalue.list_path)
+
+
+    def visit_var_rvalue(self, var_rvalue):
+        self.visit_path(var_rvalue.path)
+
+
+
+def non_escaping_structs(fun_def):
+    """Returns the set of names of the struct locals of the function
+    definition that do not escape it (see the module docstring).
+
+    Args:
+        fun_def -- The FunDef AST node.
+
+    """
+    analyzer = EscapeAnalyzer()
+    fun_def.accept(analyzer)
+    return analyzer.non_escaping()
+
+
+
+class RegionAnalyzer(Visitor):
+    """Visitor implementation to find the allocations of a function
+    definition whose objects cannot outlive its frame."""
+
+    # built-in functions, which never keep or return their arguments
+    BUILT_INS = {'print', 'input', 'itos', 'itod', 'dtos', 'dtoi', 'stoi',
+                 'stod', 'length', 'get'}
+
+    # alias class of everything the caller or other frames can reach
+    ESCAPED = 'escaped'
+
+    def __init__(self, struct_defs):
+        # struct name -> StructDef for field types
+        self.struct_defs = struct_defs
+        # variable name -> DataType (None if declared with several types)
+        self.var_types = {}
+        # alias class union-find parent of each node
+        self.parent = {}
+        # class representative -> its pointee class (escaping objects
+        # only refer to escaping objects)
+        self.pointees = {self.ESCAPED: self.ESCAPED}
+        # id of each allocating AST node -> the node
+        self.sites = {}
+        # alias class of the last visited expression's reference value
+        # (None if it is not a reference)
+        self.curr_source = None
+
+
+    # Helper Functions
+
+    def find(self, node):
+        """Returns the representative of the node's alias class."""
+        root = node
+        while self.parent.get(root, root) != root:
+            root = self.parent[root]
+        # compress the path walked
+        while node != root:
+            next_node = self.parent[node]
+            self.parent[node] = root
+            node = next_node
+        return root
+
+
+    def pointee(self, node):
+        """Returns the class the objects of the node's class refer to."""
+        root = self.find(node)
+        if root not in self.pointees:
+            self.pointees[root] = ('pointee', root)
+        return self.find(self.pointees[root])
+
+
+    def union(self, node1, node2):
+        """Merges the alias classes of two nodes (if both are given), and
+        so also their pointee classes."""
+        if node1 is None or node2 is None:
+            return
+        root1 = self.find(node1)
+        root2 = self.find(node2)
+        if root1 == root2:
+            return
+        # keep ESCAPED as its class's representative
+        if root1 == self.ESCAPED:
+            root1, root2 = root2, root1
+        self.parent[root1] = root2
+        pointee1 = self.pointees.pop(root1, None)
+        pointee2 = self.pointees.get(root2)
+        if pointee2 is None:
+            if pointee1 is not None:
+                self.pointees[root2] = pointee1
+        elif pointee1 is not None:
+            self.union(pointee1, pointee2)
+
+
+    def add_site(self, node):
+        """Returns the alias class node of an allocating AST node."""
+        self.sites[id(node)] = node
+        return ('site', id(node))
+
+
+    def add_var_type(self, var_def):
+        """Records the declared type of a variable."""
+        name = var_def.var_name.lexeme
+        data_type = var_def.data_type
+        if name not in self.var_types:
+            self.var_types[name] = data_type
+        else:
+            old = self.var_types[name]
+            if old is None or (old.is_array, old.is_list, old.type_name.lexeme) != \
+                    (data_type.is_array, data_type.is_list, data_type.type_name.lexeme):
+                self.var_types[name] = None
+
+
+    def is_ref(self, data_type):
+        """Returns true if values of the type are heap references (or the
+        type is unknown)."""
+        return (data_type is None or data_type.is_array or data_type.is_list
+                or data_type.type_name.token_type == TokenType.ID)
+
+
+    def path_type(self, path):
+        """Returns the DataType of the value a path refers to (None if it
+        cannot be determined)."""
+        data_type = self.var_types.get(path[0].var_name.lexeme)
+        for i, var_ref in enumerate(path):
+            if data_type is None:
+                return None
+            if i > 0:
+                struct_def = self.struct_defs.get(data_type.type_name.lexeme)
+                if struct_def is None:
+                    return None
+                fields = {f.var_name.lexeme: f.data_type for f in struct_def.fields}
+                data_type = fields.get(var_ref.var_name.lexeme)
+                if data_type is None:
+                    return None
+            if var_ref.array_expr != None:
+                data_type = DataType(False, False, data_type.type_name)
+        return data_type
+
+
+    def path_class(self, path):
+        """Visits a path's array expressions and returns the alias class
+        of the value it refers to (each field or element step moves to
+        the pointee class)."""
+        node = ('var', path[0].var_name.lexeme)
+        for i, var_ref in enumerate(path):
+            if i > 0:
+                node = self.pointee(node)
+            if var_ref.array_expr != None:
+                var_ref.array_expr.accept(self)
+                node = self.pointee(node)
+        return node
+
+
+    def visit_source(self, node):
+        """Visits an expression (or rvalue) and returns the alias class of
+        its reference value (None if it is not a reference)."""
+        if node is None:
+            return None
+        self.curr_source = None
+        node.accept(self)
+        return self.curr_source
+
+
+    def frame_local(self):
+        """Returns the ids of the allocating AST nodes found to be frame
+        local."""
+        escaped = self.find(self.ESCAPED)
+        return {site_id for site_id in self.sites
+                if self.find(('site', site_id)) != escaped}
+
+
+    # Visitor Functions
+
+    def visit_fun_def(self, fun_def):
+        # the caller can reach whatever the parameters refer to
+        for param in fun_def.params:
+            self.add_var_type(param)
+            self.union(('var', param.var_name.lexeme), self.ESCAPED)
+        for stmt in fun_def.stmts:
+            stmt.accept(self)
+
+
+    def visit_return_stmt(self, return_stmt):
+        self.union(self.visit_source(return_stmt.expr), self.ESCAPED)
+
+
+    def visit_var_decl(self, var_decl):
+        self.add_var_type(var_decl.var_def)
+        var = ('var', var_decl.var_def.var_name.lexeme)
+        if var_decl.var_def.data_type.is_list:
+            # list declarations allocate (with ALLOCL)
+            self.union(var, self.add_site(var_decl))
+        elif self.is_ref(var_decl.var_def.data_type):
+            self.union(var, self.visit_source(var_decl.expr))
+        else:
+            self.visit_source(var_decl.expr)
+
+
+    def visit_assign_stmt(self, assign_stmt):
+        target = self.path_class(assign_stmt.lvalue)
+        source = self.visit_source(assign_stmt.expr)
+        if self.is_ref(self.path_type(assign_stmt.lvalue)):
+            self.union(target, source)
+
+
+    def visit_while_stmt(self, while_stmt):
+        self.visit_source(while_stmt.condition)
+        for stmt in while_stmt.stmts:
+            stmt.accept(self)
+
+
+    def visit_for_stmt(self, for_stmt):
+        for_stmt.var_decl.accept(self)
+        self.visit_source(for_stmt.condition)
+        for_stmt.assign_stmt.accept(self)
+        for stmt in for_stmt.stmts:
+            stmt.accept(self)
+
+
+    def visit_if_stmt(self, if_stmt):
+        for basic_if in [if_stmt.if_part] + if_stmt.else_ifs:
+            self.visit_source(basic_if.condition)
+            for stmt in basic_if.stmts:
+                stmt.accept(self)
+        if if_stmt.else_stmts != None:
+            for stmt in if_stmt.else_stmts:
+                stmt.accept(self)
+
+
+    def visit_list_fun_stmt(self, list_fun_stmt):
+        target = self.pointee(self.path_class(list_fun_stmt.list_path))
+        if list_fun_stmt.append_item != None:
+            self.union(target, self.visit_source(list_fun_stmt.append_item))
+
+
+    def visit_call_expr(self, call_expr):
+        built_in = call_expr.fun_name.lexeme in self.BUILT_INS
+        for arg in call_expr.args:
+            source = self.visit_source(arg)
+            if not built_in:
+                self.union(source, self.ESCAPED)
+        # a function's result may be reachable from anywhere
+        self.curr_source = None if built_in else self.ESCAPED
+
+
+    def visit_expr(self, expr):
+        source = self.visit_source(expr.first)
+        if expr.op != None:
+            # operators (including comparisons) never yield references
+            self.visit_source(expr.rest)
+            source = None
+        self.curr_source = None if expr.not_op else source
+
+
+    def visit_simple_term(self, simple_term):
+        self.curr_source = self.visit_source(simple_term.rvalue)
+
+
+    def visit_complex_term(self, complex_term):
+        self.curr_source = self.visit_source(complex_term.expr)
+
+
+    def visit_simple_rvalue(self, simple_rvalue):
+        self.curr_source = None
+
+
+    def visit_new_rvalue(self, new_rvalue):
+        site = self.add_site(new_rvalue)
+        if new_rvalue.struct_params != None:
+            for param in new_rvalue.struct_params:
+                self.union(self.pointee(site), self.visit_source(param))
+        else:
+            self.visit_source(new_rvalue.array_expr)
+        self.curr_source = site
+
+
+    def visit_list_rvalue(self, list_rvalue):
+        # max and min return one of the list's elements
+        node = self.pointee(self.path_class(list_rvalue.list_path))
+        data_type = self.path_type(list_rvalue.list_path)
+        if data_type is not None:
+            data_type = DataType(False, False, data_type.type_name)
+        self.curr_source = node if self.is_ref(data_type) else None
+
+
+    def visit_var_rvalue(self, var_rvalue):
+        node = self.path_class(var_rvalue.path)
+        is_ref = self.is_ref(self.path_type(var_rvalue.path))
+        self.curr_source = node if is_ref else None
+
+
+
+def frame_local_allocations(fun_def, struct_defs):
+    """Returns the ids of the allocating AST nodes (NewRValue nodes and
+    list VarDecl nodes) of the function definition whose objects cannot
+    outlive its frame (see the module docstring).
+
+    Args:
+        fun_def -- The FunDef AST node.
+        struct_defs -- The struct name -> StructDef mapping.
+
+    """
+    analyzer = RegionAnalyzer(struct_defs)
+    fun_def.accept(analyzer)
+    return analyzer.frame_local()
@@ -8,6 +8,7 @@ CLASS: CPSC 326
 """
 
 
+from bisect import bisect_right
 from dataclasses import dataclass, field
 from typing import Any
 from mypl_opcode import OpCode
@@ -15,19 +16,33 @@ from mypl_opcode import OpCode
 
 @dataclass
 class VMFrameTemplate:
-    """A VM function-call frame template (type)."""
+    """A VM function-call frame template (type). A template whose
+    instructions are None is a stub that has not been generated yet.
+    Each (pc, line, column) line table entry gives the source position
+    of the instructions from pc up to the next entry."""
     function_name: str
     arg_count: int
     instructions: list['VMInstr'] = field(default_factory=list) 
+    line_table: list[tuple[int, int, int]] = field(default_factory=list)
+
+    def source_pos(self, pc):
+        """Returns the (line, column) of the instruction at pc, or None if
+        its position is unknown."""
+        i = bisect_right(self.line_table, pc, key=lambda entry: entry[0])
+        if i == 0:
+            return None
+        return tuple(self.line_table[i - 1][1:])
 
     
 @dataclass
 class VMFrame:
-    """A VM function-call frame."""
+    """A VM function-call frame. Its region holds the ids of the objects
+    it allocated that cannot outlive it, which are freed on return."""
     template: VMFrameTemplate
     pc: int = 0
     variables: list[Any] = field(default_factory=list) 
     operand_stack: list[Any] = field(default_factory=list) 
+    region: list[int] = field(default_factory=list)
 
 
 @dataclass
@@ -124,8 +139,8 @@ def TODBL():
 def TOSTR():
     return VMInstr(OpCode.TOSTR)
 
-def ALLOCS():
-    return VMInstr(OpCode.ALLOCS)
+def ALLOCS(struct_name=None):
+    return VMInstr(OpCode.ALLOCS, struct_name)
 
 def SETF(field_name):
     return VMInstr(OpCode.SETF, field_name)
@@ -169,4 +184,8 @@ def POPL():
 
 def APP():
     return VMInstr(OpCode.APP)
+
+# Region OpCode
+def REGION():
+    return VMInstr(OpCode.REGION)
     
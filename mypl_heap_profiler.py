@@ -0,0 +1,186 @@
+"""Allocation-site heap profiler for the MyPL VM.
+
+Attach a HeapProfiler to a VM as a hook to tag every struct, array, and
+list allocation with the function, pc, and type that created it. At any
+point (e.g., at exit) it reports the objects still live on the heap and
+their approximate bytes, grouped by allocation site and type:
+
+    heap_profiler = HeapProfiler()
+    vm.add_hook(heap_profiler)
+    vm.run()
+    heap_profiler.report(vm)
+
+Sizes use the VM's own heap accounting (see VM.heap_stats), so a list's
+bytes include what it grew to after allocation.
+
+NAME: David Giacobbi
+DATE: Spring 2024
+CLASS: CPSC 326
+
+"""
+
+import json
+import sys
+
+from mypl_opcode import OpCode
+from mypl_vm import VMHooks, STRUCT_BYTES, LIST_BYTES, SLOT_BYTES
+
+
+class HeapProfiler(VMHooks):
+    """Records the allocation site and type of each heap object."""
+
+    def __init__(self):
+        self.sites = {}              # oid -> (function name, pc, type name)
+        self.allocated = {}          # site -> [objects, bytes] allocated
+        self.peak_sites = None       # live sites near the heap's peak
+        self.peak_sites_bytes = 0    # heap bytes when they were counted
+
+
+    def on_alloc(self, vm, frame, oid):
+        """Tags the object just allocated with its site (frame.pc is
+        already past the allocating instruction)."""
+        pc = frame.pc - 1
+        instr = frame.template.instructions[pc]
+        if instr.opcode == OpCode.ALLOCS:
+            type_name = instr.operand or 'struct'
+            nbytes = STRUCT_BYTES
+        elif instr.opcode == OpCode.ALLOCA:
+            type_name = 'array'
+            nbytes = LIST_BYTES + SLOT_BYTES * len(vm.array_heap[oid])
+        else:
+            type_name = 'list'
+            nbytes = LIST_BYTES
+        site = (frame.template.function_name, pc, type_name)
+        self.sites[oid] = site
+        totals = self.allocated.get(site)
+        if totals is None:
+            self.allocated[site] = [1, nbytes]
+        else:
+            totals[0] += 1
+            totals[1] += nbytes
+        # recount the live sites only when the heap passes its last count
+        # by a tenth, so a steadily growing heap is not recounted at every
+        # allocation (the count is then within about 10% of the peak)
+        if vm.heap_bytes > 1.1 * self.peak_sites_bytes:
+            self.peak_sites = self.live_sites(vm)
+            self.peak_sites_bytes = vm.heap_bytes
+
+
+    def object_bytes(self, vm, oid):
+        """Returns the approximate bytes of a live object (None if it is
+        no longer on the heap)."""
+        if oid in vm.struct_heap:
+            return STRUCT_BYTES
+        if oid in vm.array_heap:
+            return LIST_BYTES + SLOT_BYTES * len(vm.array_heap[oid])
+        return None
+
+
+    def live_sites(self, vm):
+        """Returns a dictionary of site to [live objects, live bytes].
+
+        Args:
+            vm -- The VM whose heap to examine.
+
+        """
+        live = {}
+        for oid, site in self.sites.items():
+            nbytes = self.object_bytes(vm, oid)
+            if nbytes is None:
+                continue
+            totals = live.get(site)
+            if totals is None:
+                live[site] = [1, nbytes]
+            else:
+                totals[0] += 1
+                totals[1] += nbytes
+        return live
+
+
+    def to_dict(self, vm):
+        """Returns the profile as a JSON-compatible dictionary, with one
+        row per allocation site sorted by live bytes.
+
+        Args:
+            vm -- The VM whose heap to examine.
+
+        """
+        live = self.live_sites(vm)
+        rows = []
+        for site, (count, nbytes) in self.allocated.items():
+            name, pc, type_name = site
+            pos = vm.program.frame_templates[name].source_pos(pc)
+            live_count, live_bytes = live.get(site, (0, 0))
+            rows.append({'function': name, 'pc': pc,
+                         'line': pos[0] if pos else None, 'type': type_name,
+                         'live_objects': live_count, 'live_bytes': live_bytes,
+                         'allocated_objects': count, 'allocated_bytes': nbytes})
+        rows.sort(key=lambda row: (-row['live_bytes'], -row['allocated_bytes']))
+        types = {}
+        for row in rows:
+            totals = types.setdefault(row['type'], {'live_objects': 0,
+                                                    'live_bytes': 0})
+            totals['live_objects'] += row['live_objects']
+            totals['live_bytes'] += row['live_bytes']
+        peak_sites = []
+        if self.peak_sites:
+            for (name, pc, type_name), (count, nbytes) in sorted(
+                    self.peak_sites.items(), key=lambda item: -item[1][1]):
+                peak_sites.append({'function': name, 'pc': pc,
+                                   'type': type_name, 'live_objects': count,
+                                   'live_bytes': nbytes})
+        return {'live_objects': sum(row['live_objects'] for row in rows),
+                'live_bytes': sum(row['live_bytes'] for row in rows),
+                'peak_objects': vm.peak_heap_objects,
+                'peak_bytes': vm.peak_heap_bytes,
+                'sites': rows, 'types': types, 'peak_sites': peak_sites}
+
+
+    def dump(self, vm, path):
+        """Writes the profile to a JSON file.
+
+        Args:
+            vm -- The VM whose heap to examine.
+            path -- The output file path.
+
+        """
+        with open(path, 'w') as f:
+            json.dump(self.to_dict(vm), f, indent=2)
+
+
+    def report(self, vm, out=sys.stdout, top=10):
+        """Prints the live heap by allocation site and by type.
+
+        Args:
+            vm -- The VM whose heap to examine.
+            out -- The stream to print to.
+            top -- The number of allocation sites to list.
+
+        """
+        profile = self.to_dict(vm)
+        print(f"{profile['live_objects']} live objects, "
+              f"{profile['live_bytes'] / 1024:.1f} KB "
+              f"(peak {profile['peak_objects']} objects, "
+              f"{profile['peak_bytes'] / 1024:.1f} KB)", file=out)
+        print(f"\n{'allocation site':24} {'line':>6} {'type':12} {'live':>10} "
+              f"{'live KB':>10} {'allocs':>10}", file=out)
+        for row in profile['sites'][:top]:
+            where = f"{row['function']} at {row['pc']}"
+            line = row['line'] if row['line'] is not None else '-'
+            print(f"{where:24} {line:>6} {row['type']:12} "
+                  f"{row['live_objects']:10} {row['live_bytes'] / 1024:10.1f} "
+                  f"{row['allocated_objects']:10}", file=out)
+        if len(profile['sites']) > top:
+            print(f"  ({len(profile['sites']) - top} more)", file=out)
+        print(f"\n{'type':12} {'live':>10} {'live KB':>10}", file=out)
+        for type_name, row in sorted(profile['types'].items(),
+                                     key=lambda item: -item[1]['live_bytes']):
+            print(f"{type_name:12} {row['live_objects']:10} "
+                  f"{row['live_bytes'] / 1024:10.1f}", file=out)
+        if profile['peak_sites']:
+            print(f"\n{'near peak':24} {'type':12} {'live':>10} {'live KB':>10}",
+                  file=out)
+            for row in profile['peak_sites'][:top]:
+                where = f"{row['function']} at {row['pc']}"
+                print(f"{where:24} {row['type']:12} {row['live_objects']:10} "
+                      f"{row['live_bytes'] / 1024:10.1f}", file=out)
@@ -0,0 +1,332 @@
+"""Heap snapshots of a MyPL VM and diffs between them.
+
+A snapshot records every struct, array, and list on the VM's heap (its
+object id, kind, type, approximate size, and the object ids it refers
+to) plus the roots: the object ids held in each call stack frame's
+variables and operand stack. Comparing two snapshots of a long-running
+VM shows which types grew and the retention paths (from a root, through
+the types of the objects on the shortest path) keeping the new objects
+alive:
+
+    write_snapshot(take_snapshot(vm), 'before.json.gz')
+    ...
+    write_snapshot(take_snapshot(vm), 'after.json.gz')
+
+Snapshots are only useful mid-run, while frames still hold the roots,
+so run_snapshotted takes them every given number of instructions or
+seconds (heap.json.gz becomes heap.1.json.gz, heap.2.json.gz, ...).
+Each snapshot records its VM's heap id, and only snapshots of the same
+heap can be diffed, since object ids restart in every new VM.
+
+Usage: python mypl_heap_snapshot.py show SNAPSHOT
+       python mypl_heap_snapshot.py diff OLD NEW [--top N]
+
+Heap values carry no types, so any int equal to the id of an object on
+the heap is taken to be a reference to it (a conservative scan, as in
+conservative garbage collectors). Struct types are exact when a
+HeapProfiler was attached, and otherwise inferred from the fields set.
+
+NAME: David Giacobbi
+DATE: Spring 2024
+CLASS: CPSC 326
+
+"""
+
+import argparse
+import gzip
+import json
+import os
+import sys
+import time
+
+from mypl_error import MyPLError
+from mypl_vm import VMStatus, STRUCT_BYTES, LIST_BYTES, SLOT_BYTES
+
+
+SNAPSHOT_VERSION = 2
+
+# instructions run between checks of a time-based snapshot interval
+CHECK_STEPS = 100_000
+
+# fields of an object record
+OID, KIND, TYPE, SIZE, REFS = range(5)
+
+
+def take_snapshot(vm, heap_profiler=None):
+    """Returns a snapshot of the VM's heap and roots as a JSON-compatible
+    dictionary. Take snapshots between runs or at a safe point such as a
+    hook call, not from another thread while the VM runs.
+
+    Args:
+        vm -- The VM to snapshot.
+        heap_profiler -- A HeapProfiler attached to the VM since it
+                         started, for exact types (optional).
+
+    """
+    sites = heap_profiler.sites if heap_profiler else {}
+    layouts = {}
+    for name, fields in vm.struct_layouts.items():
+        layouts.setdefault(tuple(sorted(fields)), []).append(name)
+    def refs(values):
+        return [v for v in values if type(v) == int and
+                (v in vm.struct_heap or v in vm.array_heap)]
+    objects = []
+    for oid, obj in vm.struct_heap.items():
+        site = sites.get(oid)
+        if site:
+            type_name = site[2]
+        else:
+            type_name = '|'.join(layouts.get(tuple(sorted(obj)), ['struct']))
+        objects.append([oid, 'struct', type_name, STRUCT_BYTES,
+                        refs(obj.values())])
+    for oid, values in vm.array_heap.items():
+        site = sites.get(oid)
+        kind = site[2] if site else 'array'
+        objects.append([oid, kind, kind, LIST_BYTES + SLOT_BYTES * len(values),
+                        refs(values)])
+    roots = []
+    for frame in vm.call_stack:
+        name = frame.template.function_name
+        for i, value in enumerate(frame.variables):
+            for oid in refs([value]):
+                roots.append([f'{name}:var{i}', oid])
+        for oid in refs(frame.operand_stack):
+            roots.append([f'{name}:stack', oid])
+    return {'version': SNAPSHOT_VERSION, 'heap_id': vm.heap_id,
+            'steps': vm.steps, 'next_obj_id': vm.next_obj_id,
+            'objects': objects, 'roots': roots}
+
+
+def write_snapshot(snapshot, path):
+    """Writes a snapshot as compact JSON (gzipped if the path ends in
+    .gz).
+
+    Args:
+        snapshot -- The snapshot from take_snapshot.
+        path -- The output file path.
+
+    """
+    opener = gzip.open if path.endswith('.gz') else open
+    with opener(path, 'wt') as f:
+        json.dump(snapshot, f, separators=(',', ':'))
+
+
+def snapshot_path(path, number):
+    """Returns the path of a numbered snapshot (heap.json.gz and 2 give
+    heap.2.json.gz).
+
+    Args:
+        path -- The snapshot file path given by the user.
+        number -- The snapshot's number, counting from 1.
+
+    """
+    head, name = os.path.split(path)
+    stem, dot, ext = name.partition('.')
+    return os.path.join(head, f'{stem}.{number}{dot}{ext}')
+
+
+def run_snapshotted(vm, path, every_steps=None, every_seconds=None,
+                    heap_profiler=None):
+    """Resumes a started VM to completion, writing a numbered heap
+    snapshot every given number of instructions or seconds, whichever
+    comes first, and returns the paths written. Snapshots are taken at
+    the VM's yield points, so intervals may run a little over.
+
+    Args:
+        vm -- The VM, after start().
+        path -- The snapshot file path to number (see snapshot_path).
+        every_steps -- The instructions between snapshots (optional).
+        every_seconds -- The seconds between snapshots (optional).
+        heap_profiler -- A HeapProfiler attached to the VM since it
+                         started, for exact types (optional).
+
+    """
+    chunk = every_steps if every_steps is not None else CHECK_STEPS
+    last_steps = vm.steps
+    last_time = time.monotonic()
+    paths = []
+    while True:
+        status = vm.resume(chunk)
+        if status == VMStatus.DONE:
+            return paths
+        if status == VMStatus.BLOCKED:
+            vm.error('no more input to read')
+        now = time.monotonic()
+        if ((every_steps is not None and vm.steps - last_steps >= every_steps)
+                or (every_seconds is not None and
+                    now - last_time >= every_seconds)):
+            paths.append(snapshot_path(path, len(paths) + 1))
+            write_snapshot(take_snapshot(vm, heap_profiler), paths[-1])
+            last_steps = vm.steps
+            last_time = now
+
+
+def read_snapshot(path):
+    """Returns the snapshot stored in the file.
+
+    Args:
+        path -- The snapshot file path.
+
+    """
+    opener = gzip.open if path.endswith('.gz') else open
+    with opener(path, 'rt') as f:
+        snapshot = json.load(f)
+    if snapshot.get('version') != SNAPSHOT_VERSION:
+        raise MyPLError(f'unsupported heap snapshot version in {path}')
+    return snapshot
+
+
+def type_totals(snapshot):
+    """Returns a dictionary of type to [objects, bytes]."""
+    totals = {}
+    for record in snapshot['objects']:
+        row = totals.setdefault(record[TYPE], [0, 0])
+        row[0] += 1
+        row[1] += record[SIZE]
+    return totals
+
+
+def retention_paths(snapshot):
+    """Returns a dictionary of object id to the shortest retention path
+    keeping it alive, as a tuple of the root and the types along the
+    path, with runs of one type collapsed to one entry (so every node
+    of a linked list held in main's first variable has the path
+    ('main:var0', 'Node')). Unreachable objects map to
+    ('(unreachable)', type).
+
+    Args:
+        snapshot -- The snapshot from take_snapshot.
+
+    """
+    records = {record[OID]: record for record in snapshot['objects']}
+    paths = {}
+    queue = []
+    for label, oid in snapshot['roots']:
+        if oid not in paths:
+            paths[oid] = (label, records[oid][TYPE])
+            queue.append(oid)
+    # breadth first, so each object gets a shortest path
+    i = 0
+    while i < len(queue):
+        parent = queue[i]
+        i += 1
+        path = paths[parent]
+        for oid in records[parent][REFS]:
+            if oid in paths:
+                continue
+            type_name = records[oid][TYPE]
+            if path[-1] == type_name:
+                paths[oid] = path
+            else:
+                paths[oid] = path + (type_name,)
+            queue.append(oid)
+    for oid, record in records.items():
+        if oid not in paths:
+            paths[oid] = ('(unreachable)', record[TYPE])
+    return paths
+
+
+def diff_snapshots(old, new, top=10):
+    """Returns how the heap changed from the old snapshot to the new one:
+    the per-type change in objects and bytes (types that grew first) and
+    the retention paths of the objects allocated since the old snapshot,
+    grouped by path (most bytes first).
+
+    Args:
+        old -- The earlier snapshot.
+        new -- The later snapshot of the same VM.
+        top -- The number of retention paths to return.
+
+    """
+    # ids from two VMs overlap, so new objects cannot be told apart
+    if old['heap_id'] != new['heap_id']:
+        raise MyPLError('heap snapshots are not of the same VM run')
+    if old['next_obj_id'] > new['next_obj_id']:
+        raise MyPLError('old heap snapshot was taken after the new one')
+    old_totals = type_totals(old)
+    new_totals = type_totals(new)
+    types = []
+    for type_name in old_totals.keys() | new_totals.keys():
+        old_count, old_bytes = old_totals.get(type_name, (0, 0))
+        new_count, new_bytes = new_totals.get(type_name, (0, 0))
+        types.append({'type': type_name, 'objects': new_count,
+                      'bytes': new_bytes,
+                      'objects_delta': new_count - old_count,
+                      'bytes_delta': new_bytes - old_bytes})
+    types.sort(key=lambda row: (-row['bytes_delta'], row['type']))
+    # object ids are never reused, so new objects have ids past the old
+    # snapshot's next id
+    first_new = old['next_obj_id']
+    paths = retention_paths(new)
+    groups = {}
+    for record in new['objects']:
+        if record[OID] < first_new:
+            continue
+        row = groups.setdefault(paths[record[OID]], [0, 0])
+        row[0] += 1
+        row[1] += record[SIZE]
+    retained = [{'path': ' -> '.join(path), 'objects': count, 'bytes': nbytes}
+                for path, (count, nbytes) in groups.items()]
+    retained.sort(key=lambda row: (-row['bytes'], row['path']))
+    return {'objects_delta': len(new['objects']) - len(old['objects']),
+            'bytes_delta': (sum(r[SIZE] for r in new['objects']) -
+                            sum(r[SIZE] for r in old['objects'])),
+            'new_objects': sum(row['objects'] for row in retained),
+            'types': types, 'paths': retained[:top]}
+
+
+def print_summary(snapshot, out=sys.stdout):
+    """Prints a snapshot's objects and bytes by type."""
+    totals = type_totals(snapshot)
+    print(f"{len(snapshot['objects'])} objects, {len(snapshot['roots'])} roots",
+          file=out)
+    print(f"\n{'type':20} {'objects':>10} {'KB':>10}", file=out)
+    for type_name, (count, nbytes) in sorted(totals.items(),
+                                             key=lambda item: -item[1][1]):
+        print(f'{type_name:20} {count:10} {nbytes / 1024:10.1f}', file=out)
+
+
+def print_diff(diff, out=sys.stdout):
+    """Prints a diff from diff_snapshots."""
+    print(f"{diff['objects_delta']:+} objects, "
+          f"{diff['bytes_delta'] / 1024:+.1f} KB "
+          f"({diff['new_objects']} allocated since the old snapshot)", file=out)
+    print(f"\n{'type':20} {'objects':>10} {'change':>10} {'KB':>10} "
+          f"{'change KB':>10}", file=out)
+    for row in diff['types']:
+        print(f"{row['type']:20} {row['objects']:10} {row['objects_delta']:+10} "
+              f"{row['bytes'] / 1024:10.1f} {row['bytes_delta'] / 1024:+10.1f}",
+              file=out)
+    if diff['paths']:
+        print(f"\n{'new objects':>11} {'KB':>10}  retention path", file=out)
+        for row in diff['paths']:
+            print(f"{row['objects']:11} {row['bytes'] / 1024:10.1f}  "
+                  f"{row['path']}", file=out)
+
+
+def main():
+    about = 'Summarize a mypl heap snapshot or diff two of them.'
+    argparser = argparse.ArgumentParser(prog='mypl_heap_snapshot',
+                                        description=about)
+    commands = argparser.add_subparsers(dest='command', required=True)
+    show = commands.add_parser('show', help='summarize a snapshot by type')
+    show.add_argument('snapshot', help='snapshot file')
+    diff = commands.add_parser('diff', help='compare two snapshots')
+    diff.add_argument('old', help='earlier snapshot file')
+    diff.add_argument('new', help='later snapshot file')
+    help_msg = 'number of retention paths to list'
+    diff.add_argument('--top', type=int, default=10, help=help_msg)
+    args = argparser.parse_args()
+    try:
+        if args.command == 'show':
+            print_summary(read_snapshot(args.snapshot))
+        else:
+            print_diff(diff_snapshots(read_snapshot(args.old),
+                                      read_snapshot(args.new), args.top))
+    except (OSError, ValueError, MyPLError) as ex:
+        print(f'ERROR: {ex}')
+        exit(1)
+
+
+if __name__ == '__main__':
+    main()
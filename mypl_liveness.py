@@ -0,0 +1,170 @@
+"""Liveness analysis over VM frame templates.
+
+Frames keep every local until their function returns, so a large array
+held in a local of a long-running function stays reachable long after
+its last use. clear_dead_slots finds, for a set of (reference-typed)
+variable slots, where each one dies, and sets it to null there:
+
+  * right after a LOAD that is the slot's last use on that path, and
+  * at the start of a block the slot is dead on entry to but live at
+    the end of some predecessor (e.g., after the loop that last used it).
+
+A clear is the pair PUSH(None), STORE(slot). The VM's STORE appends a
+new slot when its index equals the frame's variable count, so a slot is
+only cleared where it is already stored on every path.
+
+NAME: David Giacobbi
+DATE: Spring 2024
+CLASS: CPSC 326
+
+"""
+
+from mypl_opcode import OpCode
+from mypl_frame import VMInstr, PUSH, STORE
+
+
+def successors(instructions, pc):
+    """Returns the pcs control can pass to after the instruction at pc."""
+    instr = instructions[pc]
+    if instr.opcode == OpCode.JMP:
+        return [instr.operand]
+    if instr.opcode == OpCode.JMPF:
+        return [pc + 1, instr.operand]
+    if instr.opcode == OpCode.RET:
+        return []
+    return [pc + 1]
+
+
+def live_slots(instructions, slots):
+    """Returns the slots live into and out of each instruction, as lists
+    of bitsets (bit k set if slot k is live), considering only the given
+    slots.
+
+    Args:
+        instructions -- The frame template's instructions.
+        slots -- The variable slots to analyze.
+
+    """
+    n = len(instructions)
+    mask = 0
+    for slot in slots:
+        mask |= 1 << slot
+    succs = [[s for s in successors(instructions, pc) if s < n]
+             for pc in range(n)]
+    live_in = [0] * n
+    live_out = [0] * n
+    changed = True
+    while changed:
+        changed = False
+        for pc in reversed(range(n)):
+            out = 0
+            for s in succs[pc]:
+                out |= live_in[s]
+            instr = instructions[pc]
+            live = out
+            if instr.opcode == OpCode.STORE:
+                live &= ~(1 << instr.operand)
+            elif instr.opcode == OpCode.LOAD:
+                live |= (1 << instr.operand) & mask
+            if out != live_out[pc] or live != live_in[pc]:
+                live_out[pc] = out
+                live_in[pc] = live
+                changed = True
+    return live_in, live_out
+
+
+def stored_counts(instructions):
+    """Returns, for each instruction, the number of variable slots the
+    frame is sure to have on entry to it (the least over all paths), or
+    None for unreachable instructions."""
+    n = len(instructions)
+    counts = [None] * n
+    if n == 0:
+        return counts
+    counts[0] = 0
+    worklist = [0]
+    while worklist:
+        pc = worklist.pop()
+        count = counts[pc]
+        instr = instructions[pc]
+        if instr.opcode == OpCode.STORE:
+            count = max(count, instr.operand + 1)
+        for s in successors(instructions, pc):
+            if s < n and (counts[s] is None or count < counts[s]):
+                counts[s] = count
+                worklist.append(s)
+    return counts
+
+
+def clear_dead_slots(template, slots):
+    """Inserts instructions into the template clearing each of the given
+    slots where it dies, updating jump targets and the line table.
+    Returns the number of clears inserted.
+
+    Args:
+        template -- The (unfrozen) frame template to rewrite.
+        slots -- The variable slots to clear (e.g., those holding heap
+                 references).
+
+    """
+    instructions = template.instructions
+    n = len(instructions)
+    if not slots or n == 0:
+        return 0
+    live_in, live_out = live_slots(instructions, slots)
+    counts = stored_counts(instructions)
+    # block starts: jump targets and instructions after jumps
+    preds = [[] for _ in range(n)]
+    leaders = {0}
+    for pc in range(n):
+        succs = successors(instructions, pc)
+        for s in succs:
+            if s < n:
+                preds[s].append(pc)
+        if instructions[pc].opcode in (OpCode.JMP, OpCode.JMPF, OpCode.RET):
+            leaders.update(s for s in succs if s < n)
+            if pc + 1 < n:
+                leaders.add(pc + 1)
+    # clears to run before (entry) and after (exit) each instruction
+    before = {}
+    after = {}
+    def bits(value):
+        return [k for k in range(value.bit_length()) if value >> k & 1]
+    for pc in range(n):
+        if counts[pc] is None:
+            continue
+        instr = instructions[pc]
+        if instr.opcode == OpCode.LOAD:
+            dead = live_in[pc] & ~live_out[pc]
+            if dead:
+                after[pc] = bits(dead)
+        if pc in leaders and preds[pc]:
+            incoming = 0
+            for p in preds[pc]:
+                incoming |= live_out[p]
+            dead = incoming & ~live_in[pc]
+            dead = [k for k in bits(dead) if k < counts[pc]]
+            if dead:
+                before[pc] = dead
+    if not before and not after:
+        return 0
+    # rebuild the instructions, mapping each old pc to its new start
+    # (including any clears before it)
+    new_instructions = []
+    new_pc = []
+    for pc, instr in enumerate(instructions):
+        new_pc.append(len(new_instructions))
+        for slot in before.get(pc, []):
+            new_instructions += [PUSH(None), STORE(slot)]
+        new_instructions.append(instr)
+        for slot in after.get(pc, []):
+            new_instructions += [PUSH(None), STORE(slot)]
+    new_pc.append(len(new_instructions))
+    for i, instr in enumerate(new_instructions):
+        if instr.opcode in (OpCode.JMP, OpCode.JMPF):
+            new_instructions[i] = VMInstr(instr.opcode, new_pc[instr.operand],
+                                          instr.comment)
+    template.instructions = new_instructions
+    template.line_table = [(new_pc[pc], line, column)
+                           for pc, line, column in template.line_table]
+    return sum(map(len, before.values())) + sum(map(len, after.values()))
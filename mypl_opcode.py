@@ -49,7 +49,7 @@ OpCode = Enum('OpCode', [
     'TOSTR',   # pop x, push str(x)
 
     # heap
-    'ALLOCS',  # allocate struct object, push oid x
+    'ALLOCS',  # allocate struct object (of type A), push oid x
     'SETF',    # pop value x, pop oid y, set obj(y)[A] = x
     'GETF',    # pop oid x, push obj(x)[A] onto stack
     'ALLOCA',  # pop int x, allocate array object with x None values, push oid
@@ -67,4 +67,8 @@ OpCode = Enum('OpCode', [
     'CLEAR',   # pop oid x, push clear list, 
     'POPL',     # pop oid x, pop last element of list
     'APP',     # pop value x, pop oid y, append x to list y
+
+    # regions
+    'REGION',  # add oid x (left on the stack) to the frame's region,
+               # whose objects are freed when the frame returns
 ])
@@ -6,6 +6,7 @@ CLASS: CPSC 326
 
 """
 
+import sys
 from dataclasses import dataclass
 from mypl_token import Token, TokenType
 from mypl_ast import *
@@ -14,19 +15,22 @@ from mypl_ast import *
 class PrintVisitor(Visitor):
     """Visitor implementation to pretty print MyPL program."""
 
-    def __init__(self):
+    def __init__(self, out=None):
+        """Create a printer writing to the given text stream (standard
+        output if None)."""
         self.indent = 0
+        self.out = out if out else sys.stdout
 
     # Helper Functions
         
     def output(self, msg):
-        """Prints message without ending newline.
+        """Writes message without ending newline.
 
         Args:
-           msg -- The string to print.
+           msg -- The string to write.
 
         """
-        print(msg, end='')
+        self.out.write(msg)
 
         
     def output_indent(self):
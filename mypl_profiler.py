@@ -0,0 +1,204 @@
+"""Opcode-level execution profiler for the MyPL VM.
+
+Attach a Profiler to a VM as a hook to record, for every instruction
+run, its opcode, function, and offset, and the time until the next
+instruction starts:
+
+    profiler = Profiler()
+    vm.add_hook(profiler)
+    try:
+        vm.run()
+    finally:
+        profiler.stop()
+    profiler.report()
+
+The VM only pays for profiling when a profiler is attached.
+
+NAME: David Giacobbi
+DATE: Spring 2024
+CLASS: CPSC 326
+
+"""
+
+import json
+import sys
+import time
+
+from mypl_opcode import OpCode
+from mypl_vm import VMHooks
+
+
+class Profiler(VMHooks):
+    """Collects per-opcode, per-function, and per-instruction counts and
+    times for a VM run."""
+
+    def __init__(self):
+        self.opcode_counts = {}      # opcode name -> instructions run
+        self.opcode_times = {}       # opcode name -> seconds
+        self.function_instrs = {}    # function name -> instructions run
+        self.function_calls = {}     # function name -> calls
+        self.inclusive_times = {}    # function name -> seconds in calls
+        self.exclusive_times = {}    # function name -> seconds in its code
+        self.instr_counts = {}       # (function name, pc) -> runs
+        self.instr_times = {}        # (function name, pc) -> seconds
+        self.opcodes = {}            # (function name, pc) -> opcode name
+        self.lines = {}              # (function name, pc) -> source line
+        self.stack = []              # (function name, charged at entry)
+        self.active = {}             # function name -> calls on the stack
+        self.last = None             # (opcode name, function name, pc)
+        self.last_time = 0.0
+        self.charged = 0.0           # seconds charged so far (a clock
+                                     # that excludes profiling overhead)
+
+
+    def enter(self, name):
+        """Records a call of the function."""
+        self.function_calls[name] = self.function_calls.get(name, 0) + 1
+        self.active[name] = self.active.get(name, 0) + 1
+        self.stack.append((name, self.charged))
+
+
+    def exit(self):
+        """Records a return from the innermost call. Recursive calls only
+        add inclusive time once, at the outermost call."""
+        name, start = self.stack.pop()
+        self.active[name] -= 1
+        if self.active[name] == 0:
+            self.inclusive_times[name] = (self.inclusive_times.get(name, 0.0) +
+                                          self.charged - start)
+
+
+    def charge(self, now):
+        """Charges the time since the last instruction started to it."""
+        if self.last is None:
+            return
+        op, name, pc = self.last
+        elapsed = now - self.last_time
+        self.charged += elapsed
+        self.opcode_times[op] = self.opcode_times.get(op, 0.0) + elapsed
+        self.exclusive_times[name] = self.exclusive_times.get(name, 0.0) + elapsed
+        key = (name, pc)
+        self.instr_times[key] = self.instr_times.get(key, 0.0) + elapsed
+        if op == 'RET' and self.stack:
+            self.exit()
+        self.last = None
+
+
+    def on_instruction(self, vm, frame, instr):
+        """Records the instruction about to run (frame.pc is already past
+        it). Called by the VM for every instruction.
+
+        Args:
+            vm -- The VM being profiled.
+            frame -- The frame running the instruction.
+            instr -- The instruction.
+
+        """
+        now = time.perf_counter()
+        self.charge(now)
+        name = frame.template.function_name
+        if not self.stack:
+            self.enter(name)
+        pc = frame.pc - 1
+        op = instr.opcode.name
+        self.opcode_counts[op] = self.opcode_counts.get(op, 0) + 1
+        self.function_instrs[name] = self.function_instrs.get(name, 0) + 1
+        key = (name, pc)
+        self.instr_counts[key] = self.instr_counts.get(key, 0) + 1
+        if key not in self.opcodes:
+            self.opcodes[key] = op
+            pos = frame.template.source_pos(pc)
+            self.lines[key] = pos[0] if pos else None
+        if instr.opcode == OpCode.CALL:
+            self.enter(instr.operand)
+        self.last = (op, name, pc)
+        self.last_time = time.perf_counter()
+
+
+    def stop(self):
+        """Ends profiling, charging the last instruction and closing any
+        calls still on the stack (e.g., after an error)."""
+        now = time.perf_counter()
+        self.charge(now)
+        while self.stack:
+            self.exit()
+
+
+    def total_time(self):
+        """Returns the total seconds charged to instructions."""
+        return self.charged
+
+
+    def to_dict(self, top=20):
+        """Returns the profile as a JSON-compatible dictionary.
+
+        Args:
+            top -- The number of hot instructions to include.
+
+        """
+        opcodes = {op: {'count': n, 'time': self.opcode_times.get(op, 0.0)}
+                   for op, n in self.opcode_counts.items()}
+        functions = {}
+        for name in self.function_instrs.keys() | self.function_calls.keys():
+            functions[name] = {
+                'calls': self.function_calls.get(name, 0),
+                'instructions': self.function_instrs.get(name, 0),
+                'inclusive_time': self.inclusive_times.get(name, 0.0),
+                'exclusive_time': self.exclusive_times.get(name, 0.0),
+            }
+        hot = []
+        for (name, pc), t in sorted(self.instr_times.items(),
+                                    key=lambda item: -item[1])[:top]:
+            hot.append({'function': name, 'pc': pc,
+                        'line': self.lines[(name, pc)],
+                        'opcode': self.opcodes[(name, pc)],
+                        'count': self.instr_counts[(name, pc)], 'time': t})
+        return {'total_time': self.total_time(),
+                'instructions': sum(self.opcode_counts.values()),
+                'opcodes': opcodes, 'functions': functions, 'hot': hot}
+
+
+    def dump(self, path, top=20):
+        """Writes the profile to a JSON file.
+
+        Args:
+            path -- The output file path.
+            top -- The number of hot instructions to include.
+
+        """
+        with open(path, 'w') as f:
+            json.dump(self.to_dict(top), f, indent=2)
+
+
+    def report(self, out=sys.stdout, top=10):
+        """Prints the profile as tables sorted by time.
+
+        Args:
+            out -- The stream to print to.
+            top -- The number of hot instructions to list.
+
+        """
+        profile = self.to_dict(top)
+        total = profile['total_time'] or 1.0
+        print(f"{profile['instructions']} instructions, "
+              f"{profile['total_time'] * 1000:.2f} ms", file=out)
+        print(f"\n{'opcode':10} {'count':>12} {'time ms':>10} {'%':>6}",
+              file=out)
+        for op, row in sorted(profile['opcodes'].items(),
+                              key=lambda item: -item[1]['time']):
+            print(f"{op:10} {row['count']:12} {row['time'] * 1000:10.2f} "
+                  f"{100 * row['time'] / total:6.1f}", file=out)
+        print(f"\n{'function':20} {'calls':>10} {'instrs':>12} "
+              f"{'incl ms':>10} {'excl ms':>10}", file=out)
+        for name, row in sorted(profile['functions'].items(),
+                                key=lambda item: -item[1]['exclusive_time']):
+            print(f"{name:20} {row['calls']:10} {row['instructions']:12} "
+                  f"{row['inclusive_time'] * 1000:10.2f} "
+                  f"{row['exclusive_time'] * 1000:10.2f}", file=out)
+        print(f"\n{'instruction':24} {'line':>6} {'opcode':10} {'count':>12} "
+              f"{'time ms':>10}", file=out)
+        for row in profile['hot']:
+            where = f"{row['function']} at {row['pc']}"
+            line = row['line'] if row['line'] is not None else '-'
+            print(f"{where:24} {line:>6} {row['opcode']:10} {row['count']:12} "
+                  f"{row['time'] * 1000:10.2f}", file=out)
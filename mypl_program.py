@@ -0,0 +1,114 @@
+"""Compiled MyPL programs shared by VM execution contexts.
+
+A VMProgram holds only the compiled code (frame templates and struct
+layouts). All mutable execution state (heaps, object ids, the call
+stack) lives in the VM, so one program can be run many times, or by
+several threads at once, without regenerating code.
+
+NAME: David Giacobbi
+DATE: Spring 2024
+CLASS: CPSC 326
+
+"""
+
+import io
+import threading
+
+from mypl_error import *
+
+
+class VMProgram:
+
+    def __init__(self):
+        """Creates an empty program."""
+        self.frame_templates = {}    # function name -> VMFrameTemplate
+        self.struct_layouts = {}     # struct name -> list of field names
+        self.lazy_codegen = None     # generates stub templates on demand
+        self.frozen = False          # true once no longer being built
+        self.lock = threading.Lock() # guards lazy generation
+
+
+    def __repr__(self):
+        """Returns a string representation of frame templates."""
+        out = io.StringIO()
+        self.write_listing(out)
+        return out.getvalue()
+
+
+    def write_listing(self, out, function=None):
+        """Writes the frame templates' instructions to the stream one line
+        at a time, so large programs are listed without building the
+        whole listing in memory.
+
+        Args:
+            out -- The text stream to write to.
+            function -- The name of the only function to list (all of
+                        them if None).
+
+        """
+        names = self.frame_templates.keys()
+        if function is not None:
+            if function not in self.frame_templates:
+                raise VMError(f'no function named {function}')
+            names = [function]
+        write = out.write
+        for name in names:
+            template = self.frame_templates[name]
+            write(f'\nFrame {name}\n')
+            if template.instructions is None:
+                write('  (not yet generated)\n')
+                continue
+            source_pos = template.source_pos
+            for i, instr in enumerate(template.instructions):
+                pos = source_pos(i)
+                if pos:
+                    write(f'  {i}: {instr}  [line {pos[0]}]\n')
+                else:
+                    write(f'  {i}: {instr}\n')
+
+
+    def add_frame_template(self, template):
+        """Add the new frame info to the program. Once frozen, only lazy
+        stubs can be filled in.
+
+        Args:
+            template -- The frame info to add.
+
+        """
+        name = template.function_name
+        if self.frozen:
+            stub = self.frame_templates.get(name)
+            if stub is None or stub.instructions is not None:
+                raise VMError(f'cannot modify frozen program ({name})')
+            template.instructions = tuple(template.instructions)
+        self.frame_templates[name] = template
+
+
+    def get_frame_template(self, fun_name):
+        """Returns the frame template for the function, generating its
+        instructions first if it is still a lazy stub.
+
+        Args:
+            fun_name -- The name of the function.
+
+        """
+        template = self.frame_templates[fun_name]
+        if template.instructions is None:
+            # the code generator is not thread safe, so generate one at a
+            # time and recheck in case another thread already did
+            with self.lock:
+                template = self.frame_templates[fun_name]
+                if template.instructions is None:
+                    template = self.lazy_codegen.compile_function(fun_name)
+        return template
+
+
+    def freeze(self):
+        """Marks the program as finished, making each instruction list
+        immutable. Returns the program."""
+        for template in self.frame_templates.values():
+            # stubs and mapped code images are left as is
+            if type(template.instructions) == list:
+                template.instructions = tuple(template.instructions)
+        self.frozen = True
+        return self
@@ -0,0 +1,125 @@
+"""Sampling profiler for the MyPL VM with flamegraph output.
+
+Rather than seeing every instruction, a SamplingProfiler periodically
+snapshots the VM's call stack, so the program runs at full speed between
+samples. Samples are taken either on a CPU-time timer (a SIGPROF
+interval timer, Unix only, from the main thread) or every N
+instructions:
+
+    sampler = SamplingProfiler(vm, interval=0.001)
+    sampler.run()                 # or sampler.run_counted(10000)
+    sampler.write('out.folded')
+
+The output is Brendan Gregg's collapsed stack format ("main;f;g 12" per
+line), which flamegraph.pl and speedscope read directly.
+
+NAME: David Giacobbi
+DATE: Spring 2024
+CLASS: CPSC 326
+
+"""
+
+import signal
+
+from mypl_error import *
+from mypl_vm import VMStatus
+
+
+class SamplingProfiler:
+    """Counts the distinct VM call stacks seen at each sample."""
+
+    def __init__(self, vm, interval=0.001, pcs=False):
+        """Create a sampler for the VM.
+
+        Args:
+            vm -- The VM to sample.
+            interval -- The CPU seconds between timer samples.
+            pcs -- If true, frames include their pc (as "name@pc").
+
+        """
+        self.vm = vm
+        self.interval = interval
+        self.pcs = pcs
+        self.samples = {}            # call stack tuple -> sample count
+        self.old_handler = None
+
+
+    def sample(self):
+        """Records the VM's current call stack."""
+        stack = self.vm.call_stack
+        if not stack:
+            return
+        if self.pcs:
+            key = tuple(f'{frame.template.function_name}@{frame.pc}'
+                        for frame in stack)
+        else:
+            key = tuple(frame.template.function_name for frame in stack)
+        self.samples[key] = self.samples.get(key, 0) + 1
+
+
+    def handler(self, signum, frame):
+        self.sample()
+
+
+    def start(self):
+        """Starts timer sampling (the handler runs between Python
+        bytecodes, so the call stack is never seen half updated)."""
+        self.old_handler = signal.signal(signal.SIGPROF, self.handler)
+        signal.setitimer(signal.ITIMER_PROF, self.interval, self.interval)
+
+
+    def stop(self):
+        """Stops timer sampling."""
+        signal.setitimer(signal.ITIMER_PROF, 0)
+        signal.signal(signal.SIGPROF, self.old_handler or signal.SIG_DFL)
+
+
+    def run(self, **limits):
+        """Runs the VM with timer sampling.
+
+        Args:
+            limits -- Keyword limits passed on to VM.run.
+
+        """
+        self.start()
+        try:
+            self.vm.run(**limits)
+        finally:
+            self.stop()
+
+
+    def run_counted(self, every=10000):
+        """Runs the VM, sampling about every given number of instructions
+        (a deterministic tick, as the budget is checked on back edges and
+        calls).
+
+        Args:
+            every -- The instructions between samples.
+
+        """
+        self.vm.start()
+        while True:
+            status = self.vm.resume(every)
+            if status == VMStatus.DONE:
+                break
+            if status == VMStatus.BLOCKED:
+                self.vm.error('no more input to read')
+            self.sample()
+
+
+    def collapsed(self):
+        """Returns the samples as collapsed stack lines, sorted."""
+        return [f"{';'.join(stack)} {count}"
+                for stack, count in sorted(self.samples.items())]
+
+
+    def write(self, path):
+        """Writes the samples to a collapsed stack (.folded) file.
+
+        Args:
+            path -- The output file path.
+
+        """
+        with open(path, 'w') as f:
+            for line in self.collapsed():
+                f.write(line + '\n')
@@ -0,0 +1,137 @@
+"""Cooperative asyncio scheduler for running many MyPL VMs in one thread.
+
+Each VMTask resumes its VM for a quantum of instructions at a time and
+then yields to the event loop, so no one program can hold up the rest.
+A READ with no input available blocks only its own task until input is
+fed to it.
+
+    scheduler = VMScheduler()
+    task = scheduler.spawn(program)
+    task.feed('some input')
+    task.close_input()
+    await scheduler.join()
+    print(task.output.getvalue(), task.error)
+
+NAME: David Giacobbi
+DATE: Spring 2024
+CLASS: CPSC 326
+
+"""
+
+import asyncio
+import io
+from collections import deque
+
+from mypl_error import MyPLError
+from mypl_vm import VM, VMStatus
+
+
+DEFAULT_QUANTUM = 1000
+
+
+class InputQueue:
+    """The stdin of a scheduled VM: lines fed to it asynchronously."""
+
+    def __init__(self):
+        self.lines = deque()
+        self.closed = False
+        self.ready = asyncio.Event()
+
+    def put(self, line):
+        """Adds a line of input (without its newline)."""
+        self.lines.append(line + '\n')
+        self.ready.set()
+
+    def close(self):
+        """Marks the end of input, so further READs are errors."""
+        self.closed = True
+        self.ready.set()
+
+    def readline(self):
+        """Returns the next line, '' at the end of input, or None if no
+        input is available yet."""
+        if self.lines:
+            return self.lines.popleft()
+        if self.closed:
+            return ''
+        self.ready.clear()
+        return None
+
+    async def wait(self):
+        """Waits until input is fed or the queue is closed."""
+        await self.ready.wait()
+
+
+class VMTask:
+    """One VM execution scheduled on the event loop."""
+
+    def __init__(self, program, quantum=DEFAULT_QUANTUM):
+        """Create a task running the program (not yet started).
+
+        Args:
+            program -- The compiled VMProgram to run.
+            quantum -- The instructions to run before yielding.
+
+        """
+        self.input = InputQueue()
+        self.output = io.StringIO()
+        self.vm = VM(program, stdin=self.input, stdout=self.output)
+        self.quantum = quantum
+        self.error = None
+        # the asyncio future running the task, set once it is spawned
+        self.future = None
+
+    def feed(self, line):
+        """Feeds a line of input to the program's READ."""
+        self.input.put(line)
+
+    def close_input(self):
+        """Marks the end of the program's input."""
+        self.input.close()
+
+    async def run(self):
+        """Runs the VM to completion, yielding to other tasks after each
+        quantum and while blocked on input. Errors are stored in error."""
+        try:
+            self.vm.start()
+            while True:
+                status = self.vm.resume(self.quantum)
+                if status == VMStatus.DONE:
+                    break
+                elif status == VMStatus.BLOCKED:
+                    await self.input.wait()
+                else:
+                    await asyncio.sleep(0)
+        except MyPLError as ex:
+            self.error = str(ex)
+
+
+class VMScheduler:
+    """Multiplexes many VM tasks on the running event loop."""
+
+    def __init__(self, quantum=DEFAULT_QUANTUM):
+        """Create a scheduler.
+
+        Args:
+            quantum -- The instructions each task runs before yielding.
+
+        """
+        self.quantum = quantum
+        self.tasks = []
+
+    def spawn(self, program):
+        """Starts running the program in a new task, returning the VMTask.
+        Must be called with an event loop running.
+
+        Args:
+            program -- The compiled VMProgram to run.
+
+        """
+        task = VMTask(program, self.quantum)
+        task.future = asyncio.ensure_future(task.run())
+        self.tasks.append(task)
+        return task
+
+    async def join(self):
+        """Waits for every spawned task to finish."""
+        await asyncio.gather(*[task.future for task in self.tasks])
@@ -11,6 +11,7 @@ from mypl_error import *
 from mypl_token import Token, TokenType
 from mypl_ast import *
 from mypl_symbol_table import SymbolTable
+from mypl_call_graph import reachable_functions
 
 
 BASE_TYPES = ['int', 'double', 'bool', 'string']
@@ -20,11 +21,13 @@ BUILT_INS = ['print', 'input', 'itos', 'itod', 'dtos', 'dtoi', 'stoi', 'stod',
 class SemanticChecker(Visitor):
     """Visitor implementation to semantically check MyPL programs."""
 
-    def __init__(self):
+    def __init__(self, check_unreachable=True):
         self.structs = {}
         self.functions = {}
         self.symbol_table = SymbolTable()
         self.curr_type = None
+        # if false, only check bodies of functions reachable from main
+        self.check_unreachable = check_unreachable
 
 
     # Helper Functions
@@ -83,9 +86,13 @@ class SemanticChecker(Visitor):
         # check each struct
         for struct in self.structs.values():
             struct.accept(self)
-        # check each function
-        for fun in self.functions.values():
-            fun.accept(self)
+        # check each function (or only those main can reach)
+        reachable = None
+        if not self.check_unreachable:
+            reachable = reachable_functions(program)
+        for fun_name, fun in self.functions.items():
+            if reachable is None or fun_name in reachable:
+                fun.accept(self)
         
         
     def visit_struct_def(self, struct_def):
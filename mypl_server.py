@@ -0,0 +1,446 @@
+"""Long-lived MyPL compile-and-run server and its thin client.
+
+The server listens on a Unix domain socket. Each request is one line of
+JSON with the program "source" and optional "input" (the program's
+standard input), "time_limit" (seconds), and "max_steps" (instructions).
+The reply is one line of JSON with the program "output", an "error"
+message (null on success), the "steps" run, and the "heap_objects" and
+"heap_bytes" (approximate) allocated. Runaway recursion is stopped at
+DEFAULT_MAX_DEPTH frames and heap growth at DEFAULT_MAX_HEAP_BYTES.
+Compiled programs are kept in an in-memory LRU keyed by source hash, and
+every request runs in a fresh VM over the shared compiled program.
+
+Usage: python mypl_server.py serve [--socket PATH] [options]
+       python mypl_server.py run [--socket PATH] [filename]
+
+The run command behaves like "python mypl.py filename": standard input
+is passed to the program, its output is printed, and errors are printed
+with exit status 1. Unlike a local run it is not interactive: standard
+input is read to EOF before the request is sent, so the program cannot
+prompt for input as it goes.
+
+With --workers N the server instead pre-forks N worker processes after
+compiling the --preload programs once in the parent, so the workers
+share those compiled programs copy-on-write. Workers are recycled after
+--max-runs requests or once they pass a heap or memory bound.
+
+NAME: David Giacobbi
+DATE: Spring 2024
+CLASS: CPSC 326
+
+"""
+
+import argparse
+import gc
+import hashlib
+import io
+import json
+import os
+import resource
+import signal
+import socket
+import socketserver
+import sys
+import threading
+from collections import OrderedDict
+
+from mypl_error import MyPLError
+from mypl_compiler import compile_program
+from mypl_vm import VM
+
+
+DEFAULT_TIME_LIMIT = 10.0
+DEFAULT_MAX_STEPS = 100_000_000
+DEFAULT_MAX_DEPTH = 100_000
+DEFAULT_MAX_HEAP_BYTES = 1 << 30
+DEFAULT_MAX_RUNS = 1000
+DEFAULT_MAX_HEAP_OBJECTS = 10_000_000
+
+
+def default_socket_path():
+    """Returns the socket path from $MYPL_SOCKET, or a per-user path in
+    /tmp if it is not set."""
+    if os.environ.get('MYPL_SOCKET'):
+        return os.environ['MYPL_SOCKET']
+    return f'/tmp/mypl-{os.getuid()}.sock'
+
+
+class ProgramCache:
+    """A thread-safe LRU of compiled programs keyed by source hash."""
+
+    def __init__(self, max_entries=128):
+        self.max_entries = max_entries
+        self.programs = OrderedDict()    # source hash -> VMProgram
+        self.lock = threading.Lock()
+
+    def get(self, source):
+        """Returns the compiled program for the source, compiling it (and
+        evicting the least recently used program) on a miss.
+
+        Args:
+            source -- The MyPL program text.
+
+        """
+        key = hashlib.sha256(source.encode('utf-8')).hexdigest()
+        with self.lock:
+            program = self.programs.get(key)
+            if program is not None:
+                self.programs.move_to_end(key)
+                return program
+        # compile outside the lock so other requests are not held up
+        program = compile_program(source)
+        with self.lock:
+            self.programs[key] = program
+            self.programs.move_to_end(key)
+            while len(self.programs) > self.max_entries:
+                self.programs.popitem(last=False)
+        return program
+
+
+def run_request(request, cache, time_limit, max_steps):
+    """Compiles (or reuses) and runs the program of one request, returning
+    the reply dictionary. The request can lower but not raise the
+    server's limits.
+
+    Args:
+        request -- The request dictionary.
+        cache -- The ProgramCache to compile through.
+        time_limit -- The server's time limit in seconds.
+        max_steps -- The server's instruction limit.
+
+    """
+    out = io.StringIO()
+    reply = {'output': '', 'error': None, 'steps': 0, 'heap_objects': 0,
+             'heap_bytes': 0}
+    vm = None
+    try:
+        if request.get('time_limit') is not None:
+            time_limit = min(time_limit, float(request['time_limit']))
+        if request.get('max_steps') is not None:
+            max_steps = min(max_steps, int(request['max_steps']))
+        program = cache.get(request['source'])
+        vm = VM(program, stdin=io.StringIO(request.get('input', '')),
+                stdout=out)
+        vm.run(max_steps=max_steps, time_limit=time_limit,
+               max_depth=DEFAULT_MAX_DEPTH,
+               max_heap_bytes=DEFAULT_MAX_HEAP_BYTES)
+    except MyPLError as ex:
+        reply['error'] = str(ex)
+    except (KeyError, TypeError, ValueError) as ex:
+        reply['error'] = f'ERROR: bad request ({ex})'
+    except Exception as ex:
+        # a VM bug should not take down the server
+        reply['error'] = f'Internal Error: {type(ex).__name__}: {ex}'
+    reply['output'] = out.getvalue()
+    if vm:
+        reply['steps'] = vm.steps
+        reply['heap_objects'] = vm.heap_objects
+        reply['heap_bytes'] = vm.heap_bytes
+    return reply
+
+
+def handle_connection(rfile, wfile, cache, time_limit, max_steps):
+    """Serves one connection (a JSON request line, then a reply line),
+    returning the reply dictionary.
+
+    Args:
+        rfile -- The connection's binary input file.
+        wfile -- The connection's binary output file.
+        cache -- The ProgramCache to compile through.
+        time_limit -- The server's time limit in seconds.
+        max_steps -- The server's instruction limit.
+
+    """
+    line = rfile.readline()
+    try:
+        request = json.loads(line)
+        if type(request) != dict:
+            raise ValueError('request must be a JSON object')
+    except ValueError as ex:
+        reply = {'output': '', 'error': f'ERROR: bad request ({ex})',
+                 'steps': 0, 'heap_objects': 0, 'heap_bytes': 0}
+    else:
+        reply = run_request(request, cache, time_limit, max_steps)
+    wfile.write(json.dumps(reply).encode('utf-8') + b'\n')
+    wfile.flush()
+    return reply
+
+
+class RequestHandler(socketserver.StreamRequestHandler):
+    """Serves one connection of a threaded server."""
+
+    def handle(self):
+        server = self.server
+        handle_connection(self.rfile, self.wfile, server.cache,
+                          server.time_limit, server.max_steps)
+
+
+class MyPLServer(socketserver.ThreadingUnixStreamServer):
+    """A threaded Unix socket server running MyPL programs."""
+
+    daemon_threads = True
+
+    def __init__(self, socket_path, cache_size=128,
+                 time_limit=DEFAULT_TIME_LIMIT, max_steps=DEFAULT_MAX_STEPS):
+        """Create a server bound to the socket path (replacing any stale
+        socket file).
+
+        Args:
+            socket_path -- The Unix socket path to listen on.
+            cache_size -- The number of compiled programs to keep.
+            time_limit -- The most seconds a request may run.
+            max_steps -- The most instructions a request may run.
+
+        """
+        if os.path.exists(socket_path):
+            os.remove(socket_path)
+        self.cache = ProgramCache(cache_size)
+        self.time_limit = time_limit
+        self.max_steps = max_steps
+        super().__init__(socket_path, RequestHandler)
+
+    def server_close(self):
+        super().server_close()
+        if os.path.exists(self.server_address):
+            os.remove(self.server_address)
+
+
+class PreforkServer:
+    """A pool of forked worker processes serving MyPL programs.
+
+    The parent compiles the preloaded programs once, then forks workers
+    that inherit them copy-on-write and accept connections on the shared
+    listening socket. Since nothing reclaims VM heap objects, and Python
+    rarely returns freed memory to the OS, each worker exits after
+    max_runs requests, once the VMs it ran allocated max_heap_objects
+    objects, or once its peak resident size passes max_rss_mb. The parent
+    then forks a replacement.
+
+    """
+
+    def __init__(self, socket_path, workers, preload=(), cache_size=128,
+                 time_limit=DEFAULT_TIME_LIMIT, max_steps=DEFAULT_MAX_STEPS,
+                 max_runs=DEFAULT_MAX_RUNS,
+                 max_heap_objects=DEFAULT_MAX_HEAP_OBJECTS, max_rss_mb=None):
+        """Compile the preloaded programs and bind the listening socket.
+
+        Args:
+            socket_path -- The Unix socket path to listen on.
+            workers -- The number of worker processes.
+            preload -- The program source texts to compile up front.
+            cache_size -- The number of compiled programs to keep.
+            time_limit -- The most seconds a request may run.
+            max_steps -- The most instructions a request may run.
+            max_runs -- The requests a worker serves before exiting.
+            max_heap_objects -- The VM objects a worker may allocate
+                                before exiting.
+            max_rss_mb -- The peak resident size (in MB) a worker may
+                          reach before exiting (no bound if None).
+
+        """
+        self.socket_path = socket_path
+        self.workers = workers
+        self.cache = ProgramCache(max(cache_size, len(preload)))
+        self.time_limit = time_limit
+        self.max_steps = max_steps
+        self.max_runs = max_runs
+        self.max_heap_objects = max_heap_objects
+        self.max_rss_mb = max_rss_mb
+        self.children = set()
+        for source in preload:
+            self.cache.get(source)
+        # keep the collector from touching (and so copying) the inherited
+        # compiled programs in every worker
+        gc.freeze()
+        if os.path.exists(socket_path):
+            os.remove(socket_path)
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.bind(socket_path)
+        self.sock.listen(128)
+
+
+    def spawn(self):
+        """Forks a new worker process."""
+        pid = os.fork()
+        if pid == 0:
+            status = 0
+            try:
+                signal.signal(signal.SIGTERM, signal.SIG_DFL)
+                self.worker_loop()
+            except BaseException:
+                status = 1
+            finally:
+                os._exit(status)
+        self.children.add(pid)
+
+
+    def worker_loop(self):
+        """Serves connections until the worker should be recycled."""
+        runs = 0
+        heap_objects = 0
+        while True:
+            conn, _ = self.sock.accept()
+            with conn, conn.makefile('rb') as rfile, \
+                 conn.makefile('wb') as wfile:
+                reply = handle_connection(rfile, wfile, self.cache,
+                                          self.time_limit, self.max_steps)
+            runs += 1
+            heap_objects += reply['heap_objects']
+            if runs >= self.max_runs or heap_objects >= self.max_heap_objects:
+                return
+            if self.max_rss_mb is not None:
+                # ru_maxrss is in kilobytes on Linux
+                rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+                if rss / 1024 >= self.max_rss_mb:
+                    return
+
+
+    def serve_forever(self):
+        """Forks the workers and replaces each one that exits."""
+        for _ in range(self.workers):
+            self.spawn()
+        while True:
+            pid, _ = os.wait()
+            self.children.discard(pid)
+            self.spawn()
+
+
+    def server_close(self):
+        """Stops the workers and removes the socket file."""
+        for pid in self.children:
+            try:
+                os.kill(pid, signal.SIGTERM)
+                os.waitpid(pid, 0)
+            except OSError:
+                pass
+        self.children.clear()
+        self.sock.close()
+        if os.path.exists(self.socket_path):
+            os.remove(self.socket_path)
+
+
+def send_request(socket_path, source, input_text='', time_limit=None,
+                 max_steps=None):
+    """Sends a program to a running server and returns its reply
+    dictionary.
+
+    Args:
+        socket_path -- The server's Unix socket path.
+        source -- The MyPL program text.
+        input_text -- The program's standard input.
+        time_limit -- An optional lower time limit in seconds.
+        max_steps -- An optional lower instruction limit.
+
+    """
+    request = {'source': source, 'input': input_text,
+               'time_limit': time_limit, 'max_steps': max_steps}
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+        sock.connect(socket_path)
+        sock.sendall(json.dumps(request).encode('utf-8') + b'\n')
+        with sock.makefile('rb') as f:
+            return json.loads(f.readline())
+
+
+def run_client(socket_path, filename):
+    """Runs a program through the server like mypl.py runs it locally,
+    except that stdin is read to EOF before the request is sent (the
+    server takes the program's whole input up front), so the program
+    cannot be used interactively.
+
+    Args:
+        socket_path -- The server's Unix socket path.
+        filename -- The program file (None to read it from stdin).
+
+    """
+    input_text = ''
+    if filename:
+        try:
+            with open(filename, 'r', encoding='utf-8') as f:
+                source = f.read()
+        except OSError:
+            print(f"ERROR: Could not open file '{filename}'")
+            exit(1)
+        input_text = sys.stdin.read()
+    else:
+        source = sys.stdin.read()
+    try:
+        reply = send_request(socket_path, source, input_text)
+    except OSError:
+        print(f"ERROR: Could not connect to server at '{socket_path}'")
+        exit(1)
+    print(reply['output'], end='')
+    if reply['error'] != None:
+        print(reply['error'])
+        exit(1)
+
+
+def main():
+    about = 'Run a mypl compile-and-run server, or send it a program.'
+    argparser = argparse.ArgumentParser(prog='mypl_server', description=about)
+    commands = argparser.add_subparsers(dest='command', required=True)
+    serve = commands.add_parser('serve', help='start the server')
+    help_msg = ('run a program on the server (stdin is read to EOF before '
+                'sending, so runs are not interactive)')
+    run = commands.add_parser('run', help=help_msg)
+    for parser in [serve, run]:
+        help_msg = 'unix socket path (default: $MYPL_SOCKET or /tmp)'
+        parser.add_argument('--socket', default=default_socket_path(),
+                            help=help_msg)
+    help_msg = 'number of compiled programs to keep in memory'
+    serve.add_argument('--cache-size', type=int, default=128, help=help_msg)
+    help_msg = 'most seconds a program may run'
+    serve.add_argument('--time-limit', type=float, default=DEFAULT_TIME_LIMIT,
+                       help=help_msg)
+    help_msg = 'most instructions a program may run'
+    serve.add_argument('--max-steps', type=int, default=DEFAULT_MAX_STEPS,
+                       help=help_msg)
+    help_msg = 'pre-fork this many worker processes'
+    serve.add_argument('--workers', type=int, default=0, help=help_msg)
+    help_msg = 'mypl programs to compile before forking workers'
+    serve.add_argument('--preload', nargs='+', default=[], help=help_msg)
+    help_msg = 'requests a worker serves before it is replaced'
+    serve.add_argument('--max-runs', type=int, default=DEFAULT_MAX_RUNS,
+                       help=help_msg)
+    help_msg = 'heap objects a worker allocates before it is replaced'
+    serve.add_argument('--max-heap-objects', type=int,
+                       default=DEFAULT_MAX_HEAP_OBJECTS, help=help_msg)
+    help_msg = 'peak resident MB at which a worker is replaced'
+    serve.add_argument('--max-rss-mb', type=float, help=help_msg)
+    help_msg = 'mypl program file (optional)'
+    run.add_argument('filename', nargs='?', help=help_msg)
+    args = argparser.parse_args()
+    if args.command == 'run':
+        run_client(args.socket, args.filename)
+        return
+    if args.workers > 0:
+        preload = []
+        for filename in args.preload:
+            try:
+                with open(filename, 'r', encoding='utf-8') as f:
+                    preload.append(f.read())
+            except OSError:
+                print(f"ERROR: Could not open file '{filename}'")
+                exit(1)
+        try:
+            server = PreforkServer(args.socket, args.workers, preload,
+                                   args.cache_size, args.time_limit,
+                                   args.max_steps, args.max_runs,
+                                   args.max_heap_objects, args.max_rss_mb)
+        except MyPLError as ex:
+            print(ex)
+            exit(1)
+    else:
+        server = MyPLServer(args.socket, args.cache_size, args.time_limit,
+                            args.max_steps)
+    # shut down cleanly (removing the socket file) when terminated
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == '__main__':
+    main()
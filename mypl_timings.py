@@ -0,0 +1,240 @@
+"""Per-stage timing of the MyPL compile pipeline and VM run.
+
+A StageTimer records the wall time and peak traced memory (tracemalloc)
+of each stage: lex, parse, check, and codegen, with checking and code
+generation also broken down per function. The run is timed after
+tracing stops, using the VM's own heap accounting for its peak. The
+stages can be printed as a table or written as a Chrome trace-event
+file for viewing in chrome://tracing or Perfetto:
+
+    timer = StageTimer()
+    program = timed_compile(source, timer)
+    timer.close()
+    with timer.stage('run', 'run') as record:
+        vm = VM(program)
+        vm.run()
+        record['peak_bytes'] = vm.peak_heap_bytes
+    timer.report()
+    timer.write_trace('trace.json')
+
+NAME: David Giacobbi
+DATE: Spring 2024
+CLASS: CPSC 326
+
+"""
+
+import io
+import json
+import os
+import sys
+import time
+import tracemalloc
+from contextlib import contextmanager
+
+from mypl_iowrapper import FileWrapper
+from mypl_token import TokenType
+from mypl_lexer import Lexer
+from mypl_ast_parser import ASTParser
+from mypl_semantic_checker import SemanticChecker
+from mypl_code_gen import CodeGenerator
+from mypl_program import VMProgram
+
+
+class StageTimer:
+    """Records nested, timed stages of work."""
+
+    def __init__(self, memory=True):
+        """Create a timer, starting tracemalloc if measuring memory.
+
+        Args:
+            memory -- If true, also record each stage's peak memory (this
+                      slows the stages down).
+
+        """
+        self.memory = memory
+        self.stages = []             # stage records, in start order
+        self.open = []               # [record, base bytes, peak bytes]
+        self.origin = time.perf_counter()
+        self.started_tracing = False
+        if memory and not tracemalloc.is_tracing():
+            tracemalloc.start()
+            self.started_tracing = True
+
+
+    def close(self):
+        """Stops tracemalloc if this timer started it. Later stages only
+        record time (tracemalloc slows the VM down many times over, so a
+        run is best timed after closing)."""
+        if self.started_tracing:
+            tracemalloc.stop()
+            self.started_tracing = False
+
+
+    @contextmanager
+    def stage(self, name, category):
+        """Times the enclosed block as a stage. Stages started inside it
+        are nested under it.
+
+        Args:
+            name -- The stage name.
+            category -- The stage category (e.g., compile or run).
+
+        """
+        base = 0
+        traced = self.memory and tracemalloc.is_tracing()
+        if traced:
+            base, peak = tracemalloc.get_traced_memory()
+            # the peak so far belongs to the enclosing stage
+            if self.open:
+                self.open[-1][2] = max(self.open[-1][2], peak)
+            tracemalloc.reset_peak()
+        record = {'name': name, 'category': category,
+                  'depth': len(self.open),
+                  'start': time.perf_counter() - self.origin,
+                  'duration': 0.0, 'peak_bytes': None}
+        self.stages.append(record)
+        self.open.append([record, base, base])
+        try:
+            yield record
+        finally:
+            record['duration'] = (time.perf_counter() - self.origin -
+                                  record['start'])
+            _, base, peak = self.open.pop()
+            if traced:
+                peak = max(peak, tracemalloc.get_traced_memory()[1])
+                tracemalloc.reset_peak()
+                if self.open:
+                    self.open[-1][2] = max(self.open[-1][2], peak)
+                record['peak_bytes'] = peak - base
+
+
+    def report(self, out=sys.stdout, top=10):
+        """Prints the stages as a table, listing only the slowest nested
+        stages under each top-level stage.
+
+        Args:
+            out -- The stream to print to.
+            top -- The number of nested stages to list per stage.
+
+        """
+        print(f"{'stage':32} {'time ms':>10} {'peak KB':>10}", file=out)
+        i = 0
+        while i < len(self.stages):
+            record = self.stages[i]
+            self.print_row(record, out)
+            children = []
+            i += 1
+            while i < len(self.stages) and self.stages[i]['depth'] > 0:
+                children.append(self.stages[i])
+                i += 1
+            children.sort(key=lambda child: -child['duration'])
+            for child in children[:top]:
+                self.print_row(child, out)
+            if len(children) > top:
+                print(f"  ({len(children) - top} more)", file=out)
+
+
+    def print_row(self, record, out):
+        name = '  ' * record['depth'] + record['name']
+        peak = record['peak_bytes']
+        peak = f'{peak / 1024:10.1f}' if peak is not None else f"{'-':>10}"
+        print(f"{name:32} {record['duration'] * 1000:10.2f} {peak}", file=out)
+
+
+    def chrome_trace(self):
+        """Returns the stages as a Chrome trace-event dictionary."""
+        events = []
+        for record in self.stages:
+            events.append({'name': record['name'], 'cat': record['category'],
+                           'ph': 'X', 'pid': os.getpid(), 'tid': 0,
+                           'ts': record['start'] * 1e6,
+                           'dur': record['duration'] * 1e6,
+                           'args': {'peak_bytes': record['peak_bytes']}})
+        return {'traceEvents': events, 'displayTimeUnit': 'ms'}
+
+
+    def write_trace(self, path):
+        """Writes the stages to a Chrome trace-event JSON file.
+
+        Args:
+            path -- The output file path.
+
+        """
+        with open(path, 'w') as f:
+            json.dump(self.chrome_trace(), f)
+
+
+class TokenList:
+    """Replays already lexed tokens to the parser."""
+
+    def __init__(self, tokens):
+        self.tokens = tokens
+        self.pos = 0
+
+    def next_token(self):
+        token = self.tokens[self.pos]
+        if self.pos < len(self.tokens) - 1:
+            self.pos += 1
+        return token
+
+
+class TimedSemanticChecker(SemanticChecker):
+    """A semantic checker that times the check of each function."""
+
+    def __init__(self, timer, check_unreachable=True):
+        super().__init__(check_unreachable)
+        self.timer = timer
+
+    def visit_fun_def(self, fun_def):
+        with self.timer.stage(f'check {fun_def.fun_name.lexeme}', 'compile'):
+            super().visit_fun_def(fun_def)
+
+
+class TimedCodeGenerator(CodeGenerator):
+    """A code generator that times the generation of each function."""
+
+    def __init__(self, vm, timer, prune=False, lazy=False, clear_dead=False,
+                 scalar_replace=False, regions=False):
+        super().__init__(vm, prune, lazy, clear_dead, scalar_replace, regions)
+        self.timer = timer
+
+    def visit_fun_def(self, fun_def):
+        with self.timer.stage(f'codegen {fun_def.fun_name.lexeme}', 'compile'):
+            super().visit_fun_def(fun_def)
+
+
+def timed_compile(source, timer, check_unreachable=True, lazy=False,
+                  clear_dead=False, scalar_replace=False, regions=False):
+    """Compiles a MyPL program like compile_program, timing each stage.
+    The whole program is lexed before parsing so the two are timed
+    separately.
+
+    Args:
+        source -- The MyPL program text.
+        timer -- The StageTimer to record stages in.
+        check_unreachable -- If false, skip checking unreachable functions.
+        lazy -- If true, generate each function's code on its first call
+                (those are then timed as part of the run).
+        clear_dead -- If true, set reference locals to null where they die.
+        scalar_replace -- If true, keep non-escaping struct locals' fields
+                          in local slots.
+        regions -- If true, free objects that cannot outlive their frame
+                   when it returns.
+
+    """
+    with timer.stage('lex', 'compile'):
+        lexer = Lexer(FileWrapper(io.StringIO(source)))
+        tokens = [lexer.next_token()]
+        while tokens[-1].token_type != TokenType.EOS:
+            tokens.append(lexer.next_token())
+    with timer.stage('parse', 'compile'):
+        ast = ASTParser(TokenList(tokens)).parse()
+    with timer.stage('check', 'compile'):
+        ast.accept(TimedSemanticChecker(timer, check_unreachable))
+    with timer.stage('codegen', 'compile'):
+        program = VMProgram()
+        ast.accept(TimedCodeGenerator(program, timer, prune=True, lazy=lazy,
+                                      clear_dead=clear_dead,
+                                      scalar_replace=scalar_replace,
+                                      regions=regions))
+    return program.freeze()
@@ -6,42 +6,146 @@ CLASS: CPSC 326
 
 """
 
+import math
+import os
+import time
+from enum import Enum
+
 from mypl_error import *
 from mypl_opcode import *
 from mypl_frame import *
+from mypl_program import VMProgram
+
+
+# result of resuming a VM: finished, paused after its instruction
+# budget, or waiting on READ for input that is not available yet
+VMStatus = Enum('VMStatus', ['DONE', 'YIELDED', 'BLOCKED'])
+
+# approximate heap object sizes in bytes (CPython dicts and lists)
+STRUCT_BYTES = 232
+LIST_BYTES = 56
+SLOT_BYTES = 8
+
+
+class VMHooks:
+    """Base class for tools that observe a VM run (tracers, profilers,
+    coverage tools, debuggers). Subclasses override only the events they
+    need; the VM only calls overridden methods, and runs with no
+    instruction hooks pay nothing per instruction beyond one test."""
+
+    def on_instruction(self, vm, frame, instr):
+        """Called before each instruction runs (frame.pc is past it)."""
+        pass
+
+    def on_call(self, vm, frame):
+        """Called with the new frame after a CALL pushes it."""
+        pass
+
+    def on_return(self, vm, frame, value):
+        """Called with the popped frame and its return value on RET."""
+        pass
+
+    def on_alloc(self, vm, frame, oid):
+        """Called after an ALLOCS, ALLOCA, or ALLOCL creates object oid."""
+        pass
+
+    def on_error(self, vm, error):
+        """Called with a MyPLError raised during the run."""
+        pass
+
+
+def hook_methods(hooks, name):
+    """Returns the bound name methods of the hooks that override it."""
+    default = getattr(VMHooks, name)
+    return [getattr(hook, name) for hook in hooks
+            if getattr(type(hook), name, default) is not default]
+
+
+class DebugTracer(VMHooks):
+    """Prints each instruction as it runs (the VM's debug mode)."""
+
+    def on_instruction(self, vm, frame, instr):
+        print('\n')
+        print('\t FRAME.........:', frame.template.function_name)
+        print('\t PC............:', frame.pc)
+        print('\t INSTRUCTION...:', instr)
+        val = None if not frame.operand_stack else frame.operand_stack[-1]
+        print('\t NEXT OPERAND..:', val)
+        cs = vm.call_stack
+        fun = cs[-1].template.function_name if cs else None
+        print('\t NEXT FUNCTION..:', fun)
 
 
 class VM:
 
-    def __init__(self):
-        """Creates a VM."""
+    def __init__(self, program=None, stdin=None, stdout=None):
+        """Creates a VM (an execution context) for a compiled program.
+
+        Args:
+            program -- The VMProgram to run (a new empty one if None).
+            stdin -- The stream READ reads lines from (console if None).
+                     A readline() returning None means no input yet, and
+                     blocks a resumable run.
+            stdout -- The stream WRITE prints to (sys.stdout if None).
+
+        """
+        self.program = program if program else VMProgram()
         self.struct_heap = {}        # id -> dict
         self.array_heap = {}         # id -> list
         self.next_obj_id = 2024      # next available object id (int)
-        self.frame_templates = {}    # function name -> VMFrameTemplate
         self.call_stack = []         # function call stack
+        self.steps = 0               # instructions run by the last run
+        self.lines_read = 0          # input lines READ by the last run
+        self.finished = False        # true once the last run completed
+        self.heap_objects = 0        # objects allocated on the heaps
+        self.heap_bytes = 0          # approximate bytes of those objects
+        self.peak_heap_objects = 0
+        self.peak_heap_bytes = 0
+        self.heap_limit = math.inf   # most heap bytes before an error
+        self.heap_id = os.urandom(8).hex()   # tells apart heaps' snapshots
+        self.hooks = []              # VMHooks observing runs
+        self.stdin = stdin
+        self.stdout = stdout
+        # shared with (and owned by) the program
+        self.frame_templates = self.program.frame_templates
+        self.struct_layouts = self.program.struct_layouts
 
     
     def __repr__(self):
         """Returns a string representation of frame templates."""
-        s = ''
-        for name, template in self.frame_templates.items():
-            s += f'\nFrame {name}\n'
-            i = 0
-            for instr in template.instructions:
-                s += f'  {i}: {instr}\n'
-                i += 1
-        return s
+        return repr(self.program)
+
+
+    @property
+    def lazy_codegen(self):
+        """The program's code generator for lazy stub templates."""
+        return self.program.lazy_codegen
+
+
+    @lazy_codegen.setter
+    def lazy_codegen(self, codegen):
+        self.program.lazy_codegen = codegen
 
     
     def add_frame_template(self, template):
-        """Add the new frame info to the VM. 
+        """Add the new frame info to the VM's program. 
 
         Args: 
             frame -- The frame info to add.
 
         """
-        self.frame_templates[template.function_name] = template
+        self.program.add_frame_template(template)
+
+
+    def get_frame_template(self, fun_name):
+        """Returns the frame template for the function, generating its
+        instructions first if it is still a lazy stub.
+
+        Args:
+            fun_name -- The name of the function.
+
+        """
+        return self.program.get_frame_template(fun_name)
 
     
     def error(self, msg, frame=None):
@@ -52,21 +156,193 @@ class VM:
         instr = frame.template.instructions[pc]
         name = frame.template.function_name
         msg += f' (in {name} at {pc}: {instr})'
+        pos = frame.template.source_pos(pc)
+        if pos:
+            msg += f' at line {pos[0]}, column {pos[1]}'
         raise VMError(msg)
 
+
+    def add_hook(self, hook):
+        """Attach a VMHooks object. Hooks added during a run take effect
+        when it is next resumed."""
+        self.hooks.append(hook)
+
+
+    def remove_hook(self, hook):
+        """Detach a VMHooks object."""
+        self.hooks.remove(hook)
+
+
+    def heap_stats(self):
+        """Returns the current and peak heap object counts and approximate
+        heap bytes."""
+        return {'objects': self.heap_objects, 'bytes': self.heap_bytes,
+                'peak_objects': self.peak_heap_objects,
+                'peak_bytes': self.peak_heap_bytes,
+                'structs': len(self.struct_heap),
+                'arrays': len(self.array_heap)}
+
+
+    def allocated(self, objects, nbytes, frame):
+        """Account for heap growth, raising a VMLimitError if it goes over
+        the heap limit. Called before the allocation is made.
+
+        Args:
+            objects -- The number of new objects.
+            nbytes -- The approximate bytes they add.
+            frame -- The frame of the allocating instruction.
+
+        """
+        if self.heap_bytes + nbytes > self.heap_limit:
+            raise VMLimitError('heap limit exceeded',
+                               frame.template.function_name, frame.pc - 1)
+        self.heap_objects += objects
+        self.heap_bytes += nbytes
+        if self.heap_bytes > self.peak_heap_bytes:
+            self.peak_heap_bytes = self.heap_bytes
+        if self.heap_objects > self.peak_heap_objects:
+            self.peak_heap_objects = self.heap_objects
+
+
+    def free_region(self, frame):
+        """Frees the objects in a returning frame's region (those shown by
+        static analysis to be unreachable once it returns), updating the
+        heap accounting.
+
+        Args:
+            frame -- The frame being popped.
+
+        """
+        for oid in frame.region:
+            if oid in self.struct_heap:
+                del self.struct_heap[oid]
+                self.heap_bytes -= STRUCT_BYTES
+            else:
+                values = self.array_heap.pop(oid)
+                self.heap_bytes -= LIST_BYTES + SLOT_BYTES * len(values)
+        self.heap_objects -= len(frame.region)
+        frame.region = []
+
     
     #----------------------------------------------------------------------
     # RUN FUNCTION
     #----------------------------------------------------------------------
     
-    def run(self, debug=False):
-        """Run the virtual machine."""
+    def check_limits(self, frame, step_limit, deadline, yield_at):
+        """Raise a VMLimitError if the run is over its step or time limit,
+        and return true if it has used up its budget and should yield.
+        Called after a jump or call, so frame.pc is the next instruction.
+
+        """
+        name = frame.template.function_name
+        if self.steps > step_limit:
+            raise VMLimitError('instruction limit exceeded', name, frame.pc)
+        if time.perf_counter() > deadline:
+            raise VMLimitError('time limit exceeded', name, frame.pc)
+        return self.steps >= yield_at
+
 
-        # grab the "main" function frame and instantiate it
+    def start(self):
+        """Begin a resumable run by instantiating the "main" frame."""
         if not 'main' in self.frame_templates:
             self.error('No "main" functrion')
-        frame = VMFrame(self.frame_templates['main'])
-        self.call_stack.append(frame)
+        self.call_stack = [VMFrame(self.get_frame_template('main'))]
+        self.steps = 0
+        self.lines_read = 0
+        self.finished = False
+
+
+    def resume(self, max_steps=None, debug=False):
+        """Continue a run started with start() until it finishes, blocks on
+        READ, or has run about max_steps more instructions (the budget is
+        checked on back edges and calls, so it may run a little over).
+        Returns the resulting VMStatus.
+
+        Args:
+            max_steps -- The instruction budget (no budget if None).
+            debug -- If true, print each instruction as it runs.
+
+        """
+        yield_at = math.inf
+        if max_steps is not None:
+            yield_at = self.steps + max_steps
+        return self.execute(debug, math.inf, math.inf, yield_at)
+
+
+    def run(self, debug=False, max_steps=None, time_limit=None,
+            max_depth=None, max_heap_bytes=None):
+        """Run the virtual machine. Going over a limit raises a
+        VMLimitError (limits are checked on back edges and calls, and the
+        heap limit on allocations).
+
+        Args:
+            debug -- If true, print each instruction as it runs.
+            max_steps -- The most instructions to run (no limit if None).
+            time_limit -- The most seconds to run for (no limit if None).
+            max_depth -- The most frames on the call stack (no limit if
+                         None).
+            max_heap_bytes -- The most approximate heap bytes (no limit
+                              if None).
+
+        """
+        # reset every run so one run's heap limit does not carry over
+        self.heap_limit = (max_heap_bytes if max_heap_bytes is not None
+                           else math.inf)
+        self.start()
+        step_limit = max_steps if max_steps is not None else math.inf
+        deadline = math.inf
+        if time_limit is not None:
+            deadline = time.perf_counter() + time_limit
+        depth_limit = max_depth if max_depth is not None else math.inf
+        while self.execute(debug, step_limit, deadline, math.inf,
+                           depth_limit) != VMStatus.DONE:
+            # only a stdin with no input available yet blocks
+            self.error('no more input to read')
+
+
+    def execute(self, debug, step_limit, deadline, yield_at,
+                max_depth=math.inf):
+        """Run instructions from the current frame, returning the VMStatus
+        when the run finishes, blocks on READ, or reaches yield_at steps.
+
+        Args:
+            debug -- If true, print each instruction as it runs.
+            step_limit -- The total instructions allowed before an error.
+            deadline -- The perf_counter() time allowed before an error.
+            yield_at -- The total instructions after which to yield.
+            max_depth -- The call stack depth allowed before an error.
+
+        """
+        hooks = self.hooks + [DebugTracer()] if debug else self.hooks
+        try:
+            return self.run_loop(hooks, step_limit, deadline, yield_at,
+                                 max_depth)
+        except MyPLError as ex:
+            for on_error in hook_methods(hooks, 'on_error'):
+                on_error(self, ex)
+            raise
+
+
+    def run_loop(self, hooks, step_limit, deadline, yield_at, max_depth):
+        """The VM's interpreter loop (see execute)."""
+        if self.finished or not self.call_stack:
+            return VMStatus.DONE
+        frame = self.call_stack[-1]
+
+        # Only hook events that some hook overrides are dispatched
+        on_instruction = hook_methods(hooks, 'on_instruction')
+        on_call = hook_methods(hooks, 'on_call')
+        on_return = hook_methods(hooks, 'on_return')
+        on_alloc = hook_methods(hooks, 'on_alloc')
+        traced = bool(on_instruction)
+
+        # Instructions are counted a straight-line segment at a time when
+        # control transfers (seg_start is the pc the current segment began
+        # at), and limits are only checked on back edges and calls, which
+        # every loop and recursion must pass through
+        seg_start = frame.pc
+        limited = (step_limit != math.inf or deadline != math.inf or
+                   yield_at != math.inf or max_depth != math.inf)
 
         # run loop (continue until run out of call frames or instructions)
         while self.call_stack and frame.pc < len(frame.template.instructions):
@@ -74,17 +350,10 @@ class VM:
             instr = frame.template.instructions[frame.pc]
             # increment the program count (pc)
             frame.pc += 1
-            # for debugging:
-            if debug:
-                print('\n')
-                print('\t FRAME.........:', frame.template.function_name)
-                print('\t PC............:', frame.pc)
-                print('\t INSTRUCTION...:', instr)
-                val = None if not frame.operand_stack else frame.operand_stack[-1]
-                print('\t NEXT OPERAND..:', val)
-                cs = self.call_stack
-                fun = cs[-1].template.function_name if cs else None
-                print('\t NEXT FUNCTION..:', fun)
+            # for debugging, profiling, and other instruction hooks:
+            if traced:
+                for hook in on_instruction:
+                    hook(self, frame, instr)
 
             #------------------------------------------------------------
             # Literals and Variables
@@ -254,7 +523,12 @@ class VM:
                 # Check that operand is valid type
                 if type(instr.operand) != int:
                     self.error('operand must be of integer type', frame)
-                frame.pc = instr.operand
+                self.steps += frame.pc - seg_start
+                back_edge = instr.operand < frame.pc
+                frame.pc = seg_start = instr.operand
+                if back_edge and limited and \
+                   self.check_limits(frame, step_limit, deadline, yield_at):
+                    return VMStatus.YIELDED
 
             # JMPF Operation
             elif instr.opcode == OpCode.JMPF:
@@ -264,7 +538,12 @@ class VM:
                     # Check that operand is valid type
                     if type(instr.operand) != int:
                         self.error('operand must be of integer type', frame)
-                    frame.pc = instr.operand            
+                    self.steps += frame.pc - seg_start
+                    back_edge = instr.operand < frame.pc
+                    frame.pc = seg_start = instr.operand
+                    if back_edge and limited and \
+                       self.check_limits(frame, step_limit, deadline, yield_at):
+                        return VMStatus.YIELDED
                     
             #------------------------------------------------------------
             # Functions
@@ -276,6 +555,8 @@ class VM:
                 fun_name = instr.operand
                 # Instantiate a new frame
                 new_frame_template = self.frame_templates[fun_name]
+                if new_frame_template.instructions is None:
+                    new_frame_template = self.get_frame_template(fun_name)
                 new_frame = VMFrame(new_frame_template)
                 # Push it onto the frame call stack
                 self.call_stack.append(new_frame)
@@ -283,8 +564,18 @@ class VM:
                 for i in range(new_frame.template.arg_count):
                     arg = frame.operand_stack.pop()
                     new_frame.operand_stack.append(arg)
+                for hook in on_call:
+                    hook(self, new_frame)
                 # Set current frame in VM to new_frame
+                self.steps += frame.pc - seg_start
                 frame = new_frame
+                seg_start = 0
+                if limited:
+                    if len(self.call_stack) > max_depth:
+                        raise VMLimitError('call depth limit exceeded',
+                                           fun_name, 0)
+                    if self.check_limits(frame, step_limit, deadline, yield_at):
+                        return VMStatus.YIELDED
                     
             # RET Operation
             elif instr.opcode == OpCode.RET:
@@ -292,10 +583,17 @@ class VM:
                 return_val = frame.operand_stack.pop()
                 # Pop frame
                 self.call_stack.pop()
+                for hook in on_return:
+                    hook(self, frame, return_val)
+                # Free the frame's region
+                if frame.region:
+                    self.free_region(frame)
+                self.steps += frame.pc - seg_start
                 # Check if frame exists now
                 if len(self.call_stack) != 0:
                     frame = self.call_stack[-1]
                     frame.operand_stack.append(return_val)
+                seg_start = frame.pc
             
             #------------------------------------------------------------
             # Built-In Functions
@@ -306,18 +604,30 @@ class VM:
                 x = frame.operand_stack.pop()
                 # Check if x is a null variable
                 if x == None:
-                    print('null', end='')
+                    print('null', end='', file=self.stdout)
                 elif x == True and type(x) == bool:
-                    print('true', end='')
+                    print('true', end='', file=self.stdout)
                 elif x == False and type(x) == bool:
-                    print('false', end='')
+                    print('false', end='', file=self.stdout)
                 else:
-                    print(x, end='')
+                    print(x, end='', file=self.stdout)
             
             # READ Operation
             elif instr.opcode == OpCode.READ:
-                # Read from stdin and push
-                x = input()
+                # Read from stdin (or the given stream) and push
+                if self.stdin is None:
+                    x = input()
+                else:
+                    x = self.stdin.readline()
+                    if x is None:
+                        # no input yet, so retry the READ when resumed
+                        frame.pc -= 1
+                        self.steps += frame.pc - seg_start
+                        return VMStatus.BLOCKED
+                    if x == '':
+                        self.error('no more input to read', frame)
+                    x = x.rstrip('\n')
+                self.lines_read += 1
                 frame.operand_stack.append(x)
 
             # LEN Operation
@@ -391,8 +701,11 @@ class VM:
                 oid = self.next_obj_id
                 self.next_obj_id += 1
                 # Allocate space and push oid on stack
+                self.allocated(1, STRUCT_BYTES, frame)
                 self.struct_heap[oid] = {}
                 frame.operand_stack.append(oid)
+                for hook in on_alloc:
+                    hook(self, frame, oid)
             
             # SETF Operation
             elif instr.opcode == OpCode.SETF:
@@ -426,8 +739,11 @@ class VM:
                 if type(array_length) != int or array_length < 0:
                     self.error('array length must be of integer type', frame)
                 # Add to operand stack
+                self.allocated(1, LIST_BYTES + SLOT_BYTES * array_length, frame)
                 self.array_heap[oid] = [None for _ in range(array_length)]
                 frame.operand_stack.append(oid)
+                for hook in on_alloc:
+                    hook(self, frame, oid)
 
             # SETI Operation
             elif instr.opcode == OpCode.SETI:
@@ -470,8 +786,11 @@ class VM:
                 oid = self.next_obj_id
                 self.next_obj_id += 1
                 # Add to operand stack
+                self.allocated(1, LIST_BYTES, frame)
                 self.array_heap[oid] = []
                 frame.operand_stack.append(oid)
+                for hook in on_alloc:
+                    hook(self, frame, oid)
 
             # Finding the max element in a list
             elif instr.opcode == OpCode.MAX:
@@ -503,6 +822,7 @@ class VM:
                 if x == None:
                     self.error('operand stack cannot get null values', frame)
                 # Set heap
+                self.heap_bytes -= SLOT_BYTES * len(self.array_heap[x])
                 self.array_heap[x] = []
 
             # Remove the last element of a list
@@ -514,6 +834,8 @@ class VM:
                     self.error('operand stack cannot get null values', frame)
                 # Set heap
                 list_length = len(self.array_heap[x])
+                if list_length > 0:
+                    self.heap_bytes -= SLOT_BYTES
                 self.array_heap[x] = self.array_heap[x][0:(list_length-1)]
 
             # Append provided value to the list
@@ -525,9 +847,18 @@ class VM:
                 if y == None:
                     self.error('operand stack cannot get null values', frame)
                 # Set heap
+                self.allocated(0, SLOT_BYTES, frame)
                 self.array_heap[y] = self.array_heap[y] + [x]
 
-                        
+            #------------------------------------------------------------
+            # Regions
+            #------------------------------------------------------------
+
+            # Add the object just allocated to the frame's region
+            elif instr.opcode == OpCode.REGION:
+                frame.region.append(frame.operand_stack[-1])
+
+
             #------------------------------------------------------------
             # Special 
             #------------------------------------------------------------
@@ -543,3 +874,8 @@ class VM:
 
             else:
                 self.error(f'unsupported operation {instr}')
+
+        # count the final straight-line segment
+        self.steps += frame.pc - seg_start
+        self.finished = True
+        return VMStatus.DONE
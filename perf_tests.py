@@ -0,0 +1,1407 @@
+"""Unit testing for the performance and runtime tooling added on top of
+the MyPL compiler and VM. These make sure the optimizations and
+instrumentation leave program behavior unchanged.
+
+NAME: David Giacobbi
+DATE: Spring 2024
+CLASS: CPSC 326
+
+"""
+
+import pytest
+import asyncio
+import io
+import json
+import math
+import os
+import signal
+import subprocess
+import sys
+import threading
+import time
+
+from mypl_error import *
+from mypl_iowrapper import *
+from mypl_token import *
+from mypl_lexer import *
+from mypl_ast_parser import *
+from mypl_semantic_checker import *
+from mypl_opcode import *
+from mypl_frame import *
+from mypl_vm import *
+from mypl_code_gen import *
+from mypl_call_graph import *
+from mypl_compiler import *
+from mypl_bytecode import *
+from mypl_cache import *
+from mypl_code_image import *
+from mypl_program import *
+from mypl_batch import *
+from mypl_server import *
+from mypl_scheduler import *
+from mypl_profiler import *
+from mypl_sampler import *
+from mypl_timings import *
+from mypl_printer import *
+from mypl_heap_profiler import *
+from mypl_heap_snapshot import *
+from mypl_checkpoint import *
+from mypl_liveness import *
+from mypl_escape import *
+
+
+# helper function to parse a program string into an AST
+def parse(program):
+    return ASTParser(Lexer(FileWrapper(io.StringIO(program)))).parse()
+
+
+# helper function to build and return a vm from the program string
+def build(program, **kwargs):
+    vm = VM()
+    cg = CodeGenerator(vm, **kwargs)
+    parse(program).accept(cg)
+    return vm
+
+
+#----------------------------------------------------------------------
+# DEAD FUNCTION ELIMINATION
+#----------------------------------------------------------------------
+
+def test_reachable_functions_transitive():
+    program = (
+        'int h(int x) {return x;} \n'
+        'int g(int x) {return h(x);} \n'
+        'int unused(int x) {return g(x);} \n'
+        'void main() {print(g(1));} \n'
+    )
+    assert reachable_functions(parse(program)) == {'main', 'g', 'h'}
+
+def test_reachable_functions_recursive():
+    program = (
+        'bool even(int n) {if (n == 0) {return true;} return odd(n - 1);} \n'
+        'bool odd(int n) {if (n == 0) {return false;} return even(n - 1);} \n'
+        'void main() {bool b = even(4);} \n'
+    )
+    assert reachable_functions(parse(program)) == {'main', 'even', 'odd'}
+
+def test_prune_skips_unreachable_codegen(capsys):
+    program = (
+        'struct S {int x;} \n'
+        'int f(int x) {return x * 2;} \n'
+        'int g() {S s = new S(f(1)); return s.x;} \n'
+        'void main() {print(f(21));} \n'
+    )
+    vm = build(program, prune=True)
+    assert set(vm.frame_templates) == {'main', 'f'}
+    vm.run()
+    assert capsys.readouterr().out == '42'
+    assert set(build(program).frame_templates) == {'main', 'f', 'g'}
+
+def test_reachable_only_semantic_check():
+    program = (
+        'void bad() {int x = "oops";} \n'
+        'void main() {} \n'
+    )
+    parse(program).accept(SemanticChecker(check_unreachable=False))
+    with pytest.raises(MyPLError) as e:
+        parse(program).accept(SemanticChecker())
+    assert str(e.value).startswith('Static Error')
+
+
+#----------------------------------------------------------------------
+# LAZY CODE GENERATION
+#----------------------------------------------------------------------
+
+def test_lazy_adds_stub_templates():
+    program = (
+        'int f(int x) {return x + 1;} \n'
+        'void main() {print(f(1));} \n'
+    )
+    vm = build(program, lazy=True)
+    assert vm.frame_templates['f'].instructions is None
+    assert vm.frame_templates['f'].arg_count == 1
+    assert vm.frame_templates['main'].instructions is None
+
+def test_lazy_generates_on_first_call(capsys):
+    program = (
+        'int f(int x) {if (x > 0) {return f(x - 1) + x;} return 0;} \n'
+        'int g(int x) {return x;} \n'
+        'void main() {print(f(4));} \n'
+    )
+    vm = build(program, lazy=True)
+    vm.run()
+    assert capsys.readouterr().out == '10'
+    assert vm.frame_templates['f'].instructions is not None
+    assert vm.frame_templates['g'].instructions is None
+    eager = build(program)
+    assert vm.frame_templates['f'] == eager.frame_templates['f']
+
+
+#----------------------------------------------------------------------
+# COMPILED BYTECODE FILES AND COMPILE CACHE
+#----------------------------------------------------------------------
+
+def test_bytecode_round_trip(capsys):
+    program = (
+        'struct P {int x; double y;} \n'
+        'int f(int x) {return x * 9999999999999999999999;} \n'
+        'void main() { \n'
+        '  P p = new P(1, 2.5); \n'
+        '  print(dtos(p.y) + " " + itos(f(p.x)) + "\\n"); \n'
+        '  bool b = true and not false; \n'
+        '  print(null); \n'
+        '} \n'
+    )
+    vm = compile_source(program)
+    copy = loads(dumps(vm))
+    assert copy.frame_templates == vm.frame_templates
+    assert copy.struct_layouts == {'P': ['x', 'y']}
+    copy.run()
+    assert capsys.readouterr().out == '2.5 9999999999999999999999\nnull'
+
+def test_bytecode_bad_header():
+    data = dumps(compile_source('void main() {}'))
+    with pytest.raises(MyPLError) as e:
+        loads(b'XXXXX' + data[5:])
+    assert str(e.value).startswith('Bytecode Error')
+    with pytest.raises(MyPLError):
+        loads(data[:-1])
+
+def test_cache_hit_and_options(tmp_path):
+    cache = CompileCache(str(tmp_path))
+    program = 'void main() {print("hi");}'
+    assert cache.get(program) == None
+    cache.put(program, compile_source(program))
+    vm = cache.get(program)
+    assert vm.frame_templates == compile_source(program).frame_templates
+    assert cache.get(program, 'check_unreachable=False') == None
+    assert cache.get(program + ' ') == None
+
+def test_cache_options_shared_by_batch(tmp_path, monkeypatch):
+    monkeypatch.setenv('MYPL_CACHE_DIR', str(tmp_path / 'cache'))
+    path = tmp_path / 'p.mypl'
+    path.write_text('void main() {print("hi");}')
+    assert run_program(str(path))['output'] == 'hi'
+    # the batch runner caches under the same key as a default mypl.py run
+    cache = CompileCache()
+    assert cache.get(path.read_text(), cache_options()) != None
+    assert cache_options(True, clear_dead=True) != cache_options()
+
+def test_cache_evicts_least_recently_used(tmp_path):
+    programs = [f'void main() {{print("{i}");}}' for i in range(3)]
+    size = len(dumps(compile_source(programs[0])))
+    cache = CompileCache(str(tmp_path), max_bytes=2 * size)
+    cache.put(programs[0], compile_source(programs[0]))
+    cache.put(programs[1], compile_source(programs[1]))
+    # make program 0 the most recently used, then overflow the cap
+    os.utime(cache.path(cache.key(programs[1])), (0, 0))
+    cache.get(programs[0])
+    cache.put(programs[2], compile_source(programs[2]))
+    assert cache.get(programs[0]) != None
+    assert cache.get(programs[1]) == None
+    assert cache.get(programs[2]) != None
+
+
+#----------------------------------------------------------------------
+# MEMORY-MAPPED CODE IMAGES
+#----------------------------------------------------------------------
+
+def test_code_image_matches_program(tmp_path, capsys):
+    program = (
+        'struct P {int x; double y;} \n'
+        'int f(int x) {return x * 9999999999999999999999;} \n'
+        'void main() { \n'
+        '  P p = new P(1, 1.0); \n'
+        '  print(dtos(p.y) + " " + itos(f(p.x)) + "\\n"); \n'
+        '  print(true); \n'
+        '} \n'
+    )
+    vm = compile_source(program)
+    path = str(tmp_path / 'prog.myplimg')
+    write_image(vm, path)
+    mapped = map_image(path)
+    assert mapped.struct_layouts == {'P': ['x', 'y']}
+    for name, template in vm.frame_templates.items():
+        copy = mapped.frame_templates[name]
+        assert copy.arg_count == template.arg_count
+        assert tuple(copy.instructions) == template.instructions
+    mapped.run()
+    assert capsys.readouterr().out == '1.0 9999999999999999999999\ntrue'
+
+def test_code_image_shares_instructions():
+    program = 'void main() {int x = 1; x = x + 1; x = x + 1;}'
+    main = load_image(build_image(compile_source(program))).frame_templates['main']
+    loads = [instr for instr in main.instructions if instr.opcode == OpCode.LOAD]
+    assert len(loads) == 2 and loads[0] is loads[1]
+    assert type(main.instructions[1].operand) == int
+
+def test_code_image_bad_magic():
+    data = build_image(compile_source('void main() {}'))
+    with pytest.raises(MyPLError):
+        load_image(b'NOTANIMG' + data[8:])
+
+def test_code_image_empty_file(tmp_path):
+    path = tmp_path / 'empty.myplimg'
+    path.write_bytes(b'')
+    with pytest.raises(MyPLError, match='not a MyPL code image'):
+        map_image(str(path))
+
+def test_code_image_rejects_other_compiler_version():
+    data = build_image(compile_source('void main() {}'))
+    # the compiler version field follows the magic and format version
+    other = b'0.0'.ljust(16, b'\0')
+    with pytest.raises(MyPLError, match='incompatible compiler 0.0'):
+        load_image(data[:12] + other + data[28:])
+
+
+#----------------------------------------------------------------------
+# SHARED PROGRAMS AND EXECUTION CONTEXTS
+#----------------------------------------------------------------------
+
+ECHO_PROGRAM = (
+    'struct Node {int val; Node next;} \n'
+    'void main() { \n'
+    '  int n = stoi(input()); \n'
+    '  Node head = null; \n'
+    '  for (int i = 0; i < n; i = i + 1) {head = new Node(i, head);} \n'
+    '  int total = 0; \n'
+    '  while (head != null) {total = total + head.val; head = head.next;} \n'
+    '  print(itos(total)); \n'
+    '} \n'
+)
+
+def test_program_runs_many_times_with_different_stdin():
+    program = compile_program(ECHO_PROGRAM)
+    outputs = []
+    for n in ['3', '10']:
+        out = io.StringIO()
+        VM(program, stdin=io.StringIO(n + '\n'), stdout=out).run()
+        outputs.append(out.getvalue())
+    assert outputs == ['3', '45']
+
+def test_program_concurrent_threads():
+    program = compile_program(ECHO_PROGRAM, lazy=True)
+    results = {}
+    def run(n):
+        out = io.StringIO()
+        VM(program, stdin=io.StringIO(f'{n}\n'), stdout=out).run()
+        results[n] = out.getvalue()
+    threads = [threading.Thread(target=run, args=(n,)) for n in range(1, 40)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert results == {n: str(n * (n - 1) // 2) for n in range(1, 40)}
+
+def test_frozen_program_is_immutable():
+    program = compile_program('void main() {print(1);}')
+    assert type(program.frame_templates['main'].instructions) == tuple
+    with pytest.raises(MyPLError):
+        program.add_frame_template(VMFrameTemplate('main', 0, [NOP()]))
+
+def test_stdin_stream_runs_out():
+    program = compile_program('void main() {print(input());}')
+    with pytest.raises(MyPLError) as e:
+        VM(program, stdin=io.StringIO('')).run()
+    assert 'no more input' in str(e.value)
+
+
+#----------------------------------------------------------------------
+# BATCH RUNNER
+#----------------------------------------------------------------------
+
+def test_batch_runs_programs_with_stdin(tmp_path):
+    (tmp_path / 'a.mypl').write_text('void main() {print(itos(stoi(input()) * 2));}')
+    (tmp_path / 'a.in').write_text('21\n')
+    (tmp_path / 'b.mypl').write_text('void main() {print("b"); int x = 1 / 0;}')
+    (tmp_path / 'c.mypl').write_text('void main() {')
+    (tmp_path / 'notes.txt').write_text('not a program')
+    programs = find_programs([str(tmp_path)])
+    assert [os.path.basename(p) for p in programs] == ['a.mypl', 'b.mypl', 'c.mypl']
+    results = run_batch(programs, workers=2, use_cache=False)
+    assert [r['output'] for r in results] == ['42', 'b', '']
+    assert results[0]['error'] == None
+    assert results[1]['error'].startswith('VM Error: cannot divide by zero')
+    assert results[2]['error'].startswith('Parser Error')
+    assert all(r['wall_time'] > 0 for r in results)
+
+def test_batch_outputs_for_same_named_programs(tmp_path):
+    for sub in ['a', 'b']:
+        (tmp_path / sub).mkdir()
+        (tmp_path / sub / 'test.mypl').write_text(f'void main() {{print("{sub}");}}')
+    programs = find_programs([str(tmp_path / 'a'), str(tmp_path / 'b'),
+                              str(tmp_path / 'a' / 'test.mypl')])
+    assert len(programs) == 2
+    results = run_batch(programs, workers=2, use_cache=False)
+    write_outputs(results, str(tmp_path / 'out'))
+    assert (tmp_path / 'out' / 'a' / 'test.out').read_text() == 'a'
+    assert (tmp_path / 'out' / 'b' / 'test.out').read_text() == 'b'
+
+def test_batch_program_limits(tmp_path):
+    (tmp_path / 'loop.mypl').write_text('void main() {while (true) {}}')
+    (tmp_path / 'ok.mypl').write_text('void main() {print("ok");}')
+    programs = find_programs([str(tmp_path)])
+    results = run_batch(programs, workers=2, use_cache=False, max_steps=1000)
+    assert 'instruction limit' in results[0]['error']
+    assert results[1]['error'] == None and results[1]['output'] == 'ok'
+    result = run_program(programs[0], use_cache=False, time_limit=0.05,
+                         max_steps=None)
+    assert 'time limit' in result['error']
+
+
+#----------------------------------------------------------------------
+# COMPILE-AND-RUN SERVER
+#----------------------------------------------------------------------
+
+def test_vm_step_count_and_limits():
+    program = compile_program(
+        'int f(int n) {if (n < 2) {return n;} return f(n - 1) + f(n - 2);} \n'
+        'void main() {int t = f(10); while (t > 0) {t = t - 1;}} \n'
+    )
+    vm = VM(program)
+    vm.run()
+    total = vm.steps
+    assert total > 0
+    vm = VM(program)
+    vm.run(max_steps=total)
+    assert vm.steps == total
+    with pytest.raises(MyPLError) as e:
+        VM(program).run(max_steps=total - 10)
+    assert 'instruction limit exceeded' in str(e.value)
+    with pytest.raises(MyPLError) as e:
+        VM(compile_program('void main() {while (true) {}}')).run(time_limit=0.05)
+    assert 'time limit exceeded' in str(e.value)
+
+def test_vm_limit_errors_report_location():
+    program = compile_program(
+        'int f(int n) {return f(n + 1);} \n'
+        'void main() {f(0);} \n'
+    )
+    with pytest.raises(VMLimitError) as e:
+        VM(program).run(max_depth=50)
+    assert e.value.function_name == 'f' and e.value.pc == 0
+    assert str(e.value) == 'VM Error: call depth limit exceeded (in f at 0)'
+    with pytest.raises(VMLimitError) as e:
+        VM(compile_program('void main() {while (true) {}}')).run(max_steps=1000)
+    assert e.value.function_name == 'main'
+    assert str(e.value).startswith('VM Error: instruction limit exceeded')
+    # a run within its limits is unaffected
+    program = compile_program(
+        'int f(int n) {if (n == 0) {return 0;} return f(n - 1);} \n'
+        'void main() {print(itos(f(20)));} \n'
+    )
+    out = io.StringIO()
+    VM(program, stdout=out).run(max_depth=22)
+    assert out.getvalue() == '0'
+
+def test_vm_heap_accounting_and_limit():
+    program = compile_program(
+        'struct S {int x;} \n'
+        'void main() { \n'
+        '  array int xs = new int[100]; \n'
+        '  list int ys; \n'
+        '  for (int i = 0; i < 10; i = i + 1) {ys.append(i); S s = new S(i);} \n'
+        '  ys.pop(); ys.clear(); \n'
+        '} \n'
+    )
+    vm = VM(program)
+    vm.run()
+    stats = vm.heap_stats()
+    assert stats['objects'] == 12 and stats['structs'] == 10
+    assert stats['bytes'] == (LIST_BYTES + 100 * SLOT_BYTES) + LIST_BYTES + 10 * STRUCT_BYTES
+    assert stats['peak_bytes'] == stats['bytes'] + 10 * SLOT_BYTES
+    # the limit is checked before a huge array is made
+    with pytest.raises(VMLimitError) as e:
+        VM(compile_program('void main() {array int xs = new int[1000000000];}')).run(
+            max_heap_bytes=1 << 20)
+    assert str(e.value).startswith('VM Error: heap limit exceeded (in main at')
+    vm = VM(program)
+    with pytest.raises(VMLimitError):
+        vm.run(max_heap_bytes=2000)
+    # a later run without a limit does not keep the old one
+    vm.run()
+    assert vm.heap_limit == math.inf
+
+def test_program_cache_lru():
+    cache = ProgramCache(max_entries=2)
+    a = cache.get('void main() {print("a");}')
+    cache.get('void main() {print("b");}')
+    assert cache.get('void main() {print("a");}') is a
+    cache.get('void main() {print("c");}')
+    assert len(cache.programs) == 2
+    assert cache.get('void main() {print("a");}') is a
+
+def test_server_runs_requests(tmp_path):
+    path = str(tmp_path / 'mypl.sock')
+    server = MyPLServer(path, max_steps=10000)
+    thread = threading.Thread(target=server.serve_forever)
+    thread.start()
+    try:
+        echo = 'void main() {print(input() + "!");}'
+        assert send_request(path, echo, 'hi\n')['output'] == 'hi!'
+        assert send_request(path, echo, 'yo\n')['output'] == 'yo!'
+        reply = send_request(path, 'void main() {print("x"); int y = 1 / 0;}')
+        assert reply['output'] == 'x'
+        assert reply['error'].startswith('VM Error: cannot divide by zero')
+        reply = send_request(path, 'void main() {while (true) {}}')
+        assert 'instruction limit exceeded' in reply['error']
+        reply = send_request(path, 'void main() {', '')
+        assert reply['error'].startswith('Parser Error')
+    finally:
+        server.shutdown()
+        server.server_close()
+        thread.join()
+    assert not os.path.exists(path)
+
+def test_prefork_server_recycles_workers(tmp_path):
+    path = str(tmp_path / 'mypl.sock')
+    lib = tmp_path / 'lib.mypl'
+    lib.write_text('void main() {print("lib");}')
+    server = subprocess.Popen([sys.executable, 'mypl_server.py', 'serve',
+                               '--socket', path, '--workers', '1',
+                               '--max-runs', '1', '--preload', str(lib)],
+                              cwd=os.path.dirname(os.path.abspath(__file__)))
+    try:
+        for _ in range(100):
+            if os.path.exists(path):
+                break
+            time.sleep(0.05)
+        # each request is served by a fresh worker
+        for i in range(3):
+            reply = send_request(path, lib.read_text())
+            assert reply['output'] == 'lib'
+        reply = send_request(path, 'struct S {int x;} void main() {S s = new S(1);}')
+        assert reply['heap_objects'] == 1
+    finally:
+        server.terminate()
+        server.wait()
+    assert not os.path.exists(path)
+
+
+#----------------------------------------------------------------------
+# RESUMABLE RUNS AND GREEN-THREAD SCHEDULER
+#----------------------------------------------------------------------
+
+class PendingInput:
+    """A stdin that has no input until lines are added to it."""
+    def __init__(self):
+        self.lines = []
+    def readline(self):
+        return self.lines.pop(0) if self.lines else None
+
+def test_vm_resume_yields_after_budget():
+    program = compile_program(
+        'void main() {int t = 0; for (int i = 0; i < 100; i = i + 1) {t = t + i;} '
+        'print(itos(t));}'
+    )
+    out = io.StringIO()
+    vm = VM(program, stdout=out)
+    vm.start()
+    yields = 0
+    while vm.resume(50) == VMStatus.YIELDED:
+        yields += 1
+    assert out.getvalue() == '4950'
+    assert yields > 5 and vm.finished
+    full = VM(program, stdout=io.StringIO())
+    full.run()
+    assert vm.steps == full.steps
+    assert vm.resume(50) == VMStatus.DONE
+
+def test_vm_resume_blocks_on_read():
+    stdin = PendingInput()
+    out = io.StringIO()
+    vm = VM(compile_program(ECHO_PROGRAM), stdin=stdin, stdout=out)
+    vm.start()
+    assert vm.resume() == VMStatus.BLOCKED
+    assert vm.resume() == VMStatus.BLOCKED
+    stdin.lines.append('5\n')
+    assert vm.resume() == VMStatus.DONE
+    assert out.getvalue() == '10'
+
+def test_scheduler_interleaves_many_vms():
+    program = compile_program(ECHO_PROGRAM)
+    async def main():
+        scheduler = VMScheduler(quantum=20)
+        tasks = [scheduler.spawn(program) for _ in range(200)]
+        # feed input in reverse, after every task has blocked on it
+        await asyncio.sleep(0)
+        for n, task in reversed(list(enumerate(tasks))):
+            task.feed(str(n))
+            task.close_input()
+        stuck = scheduler.spawn(program)
+        stuck.close_input()
+        await scheduler.join()
+        return tasks, stuck
+    tasks, stuck = asyncio.run(main())
+    assert [t.output.getvalue() for t in tasks] == \
+        [str(n * (n - 1) // 2) for n in range(200)]
+    assert all(t.error == None for t in tasks)
+    assert 'no more input' in stuck.error
+
+
+#----------------------------------------------------------------------
+# OPCODE PROFILER
+#----------------------------------------------------------------------
+
+def test_profiler_counts_match_run(capsys):
+    program = compile_program(
+        'int fib(int n) {if (n < 2) {return n;} return fib(n - 1) + fib(n - 2);} \n'
+        'void main() {print(itos(fib(10)));} \n'
+    )
+    vm = VM(program)
+    profiler = Profiler()
+    vm.add_hook(profiler)
+    vm.run()
+    profiler.stop()
+    assert capsys.readouterr().out == '55'
+    profile = profiler.to_dict()
+    assert profile['instructions'] == vm.steps
+    assert sum(row['count'] for row in profile['opcodes'].values()) == vm.steps
+    assert profile['opcodes']['CALL']['count'] == 177
+    fib = profile['functions']['fib']
+    assert fib['calls'] == 177 and profile['functions']['main']['calls'] == 1
+    assert fib['exclusive_time'] <= fib['inclusive_time'] + 1e-9
+    assert profile['functions']['main']['inclusive_time'] == pytest.approx(
+        profile['total_time'])
+    hot = profile['hot'][0]
+    assert program.frame_templates[hot['function']].instructions[hot['pc']].opcode.name == \
+        hot['opcode']
+    out = io.StringIO()
+    profiler.report(out)
+    assert 'fib' in out.getvalue() and 'CALL' in out.getvalue()
+
+def test_profiler_stops_after_error():
+    vm = VM(compile_program('int f() {return 1 / 0;} void main() {f();}'))
+    profiler = Profiler()
+    vm.add_hook(profiler)
+    with pytest.raises(MyPLError):
+        vm.run()
+    profiler.stop()
+    assert profiler.stack == []
+    assert profiler.to_dict()['functions']['f']['calls'] == 1
+
+
+#----------------------------------------------------------------------
+# SAMPLING PROFILER
+#----------------------------------------------------------------------
+
+SAMPLED_PROGRAM = (
+    'int fib(int n) {if (n < 2) {return n;} return fib(n - 1) + fib(n - 2);} \n'
+    'void main() {print(itos(fib(16)));} \n'
+)
+
+def test_sampler_counted_collapsed_stacks(tmp_path, capsys):
+    vm = VM(compile_program(SAMPLED_PROGRAM))
+    sampler = SamplingProfiler(vm)
+    sampler.run_counted(500)
+    assert capsys.readouterr().out == '987'
+    assert sum(sampler.samples.values()) >= vm.steps // 500 - 1
+    lines = sampler.collapsed()
+    assert all(line.startswith('main;fib') for line in lines)
+    stack, count = lines[0].rsplit(' ', 1)
+    assert int(count) > 0
+    path = tmp_path / 'out.folded'
+    sampler.write(str(path))
+    assert path.read_text().splitlines() == lines
+
+def test_sampler_timer_with_pcs(capsys):
+    program = compile_program(
+        'void main() {int t = 0; for (int i = 0; i < 30000; i = i + 1) {t = t + 1;}}'
+    )
+    vm = VM(program)
+    sampler = SamplingProfiler(vm, interval=0.001, pcs=True)
+    sampler.run()
+    assert sampler.samples
+    assert all(len(stack) == 1 and stack[0].startswith('main@')
+               for stack in sampler.samples)
+    assert signal.getsignal(signal.SIGPROF) in (signal.SIG_DFL, None)
+
+
+#----------------------------------------------------------------------
+# SOURCE LINE TABLES
+#----------------------------------------------------------------------
+
+LINES_PROGRAM = (
+    'int half(int n) { \n'
+    '  int d = 2; \n'
+    '  return n / d; \n'
+    '} \n'
+    'void main() { \n'
+    '  int x = half(10); \n'
+    '  print(itos(x / (x - 5))); \n'
+    '} \n'
+)
+
+def test_line_table_maps_instructions_to_source():
+    program = compile_program(LINES_PROGRAM)
+    half = program.frame_templates['half']
+    lines = [half.source_pos(pc)[0] for pc in range(len(half.instructions))]
+    assert lines == sorted(lines) and lines[0] == 1 and lines[-1] == 3
+    div = [i for i, instr in enumerate(half.instructions)
+           if instr.opcode == OpCode.DIV][0]
+    assert half.source_pos(div) == (3, 12)
+    assert '[line 3]' in repr(program)
+
+def test_vm_error_reports_source_line():
+    with pytest.raises(MyPLError) as e:
+        VM(compile_program(LINES_PROGRAM)).run()
+    assert str(e.value).startswith('VM Error: cannot divide by zero (in main at')
+    assert str(e.value).endswith('at line 7, column 16')
+
+def test_line_table_survives_bytecode_and_image():
+    program = compile_program(LINES_PROGRAM)
+    for copy in [loads(dumps(program)).program, load_program(build_image(program))]:
+        for name, template in program.frame_templates.items():
+            assert list(copy.frame_templates[name].line_table) == template.line_table
+        with pytest.raises(MyPLError) as e:
+            VM(copy).run()
+        assert str(e.value).endswith('at line 7, column 16')
+
+
+#----------------------------------------------------------------------
+# VM HOOKS
+#----------------------------------------------------------------------
+
+class EventRecorder(VMHooks):
+    def __init__(self):
+        self.events = []
+    def on_call(self, vm, frame):
+        self.events.append(('call', frame.template.function_name))
+    def on_return(self, vm, frame, value):
+        self.events.append(('return', frame.template.function_name, value))
+    def on_alloc(self, vm, frame, oid):
+        self.events.append(('alloc', frame.template.function_name, oid))
+    def on_error(self, vm, error):
+        self.events.append(('error', str(error)[:12]))
+
+def test_hooks_see_calls_allocs_and_errors():
+    program = compile_program(
+        'struct S {int x;} \n'
+        'int f(int n) {S s = new S(n); return s.x + 1;} \n'
+        'void main() {int y = f(1); y = 1 / (y - 2);} \n'
+    )
+    vm = VM(program)
+    recorder = EventRecorder()
+    vm.add_hook(recorder)
+    assert hook_methods(vm.hooks, 'on_instruction') == []
+    with pytest.raises(MyPLError):
+        vm.run()
+    assert recorder.events == [('call', 'f'), ('alloc', 'f', 2024),
+                               ('return', 'f', 2), ('error', 'VM Error: ca')]
+    vm.remove_hook(recorder)
+    assert vm.hooks == []
+
+def test_debug_mode_is_a_tracing_hook(capsys):
+    VM(compile_program('void main() {print("x");}')).run(debug=True)
+    out = capsys.readouterr().out
+    assert 'INSTRUCTION...: OpCode.WRITE()' in out and 'x' in out
+
+
+#----------------------------------------------------------------------
+# COMPILE STAGE TIMINGS
+#----------------------------------------------------------------------
+
+def test_timed_compile_records_stages(tmp_path):
+    source = LINES_PROGRAM + '// a comment \n'
+    timer = StageTimer()
+    program = timed_compile(source, timer)
+    timer.close()
+    with timer.stage('run', 'run'):
+        with pytest.raises(MyPLError):
+            VM(program).run()
+    names = [(r['depth'], r['name']) for r in timer.stages]
+    assert names == [(0, 'lex'), (0, 'parse'), (0, 'check'), (1, 'check half'),
+                     (1, 'check main'), (0, 'codegen'), (1, 'codegen half'),
+                     (1, 'codegen main'), (0, 'run')]
+    assert all(r['duration'] >= 0 for r in timer.stages)
+    assert timer.stages[0]['peak_bytes'] > 0 and timer.stages[-1]['peak_bytes'] == None
+    assert repr(program) == repr(compile_program(source))
+    out = io.StringIO()
+    timer.report(out, top=1)
+    assert '  check half' in out.getvalue() or '  check main' in out.getvalue()
+    assert '(1 more)' in out.getvalue()
+    path = tmp_path / 'trace.json'
+    timer.write_trace(str(path))
+    events = json.loads(path.read_text())['traceEvents']
+    assert [e['name'] for e in events] == [r['name'] for r in timer.stages]
+    assert all(e['ph'] == 'X' for e in events)
+
+
+#----------------------------------------------------------------------
+# BENCHMARK SUITE
+#----------------------------------------------------------------------
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), 'benchmarks'))
+import run_benchmarks
+
+def test_benchmark_programs_run():
+    expected = {'fib': '6765\n', 'linked_list': '0 12497500\n',
+                'nested_loops': '496924\n', 'strings': '2000 200\n'}
+    programs = run_benchmarks.load_programs()
+    assert set(expected) <= set(programs) and 'tree' in programs
+    for name, output in expected.items():
+        times, out = run_benchmarks.run_once(programs[name])
+        assert out == output
+        assert list(times) == run_benchmarks.STAGES
+
+def test_benchmark_compare_flags_regressions():
+    def results(run, check, check_stdev=0.0):
+        return {'benchmarks': {'fib': {'run': {'median': run, 'stdev': 0.001},
+                                       'check': {'median': check,
+                                                 'stdev': check_stdev}}}}
+    baseline = results(0.100, 0.0001)
+    assert run_benchmarks.compare(results(0.105, 0.0001), baseline) == ([], [])
+    assert run_benchmarks.compare(results(0.120, 0.0001), baseline) == \
+        ([('fib', 'run', 0.100, 0.120)], [])
+    assert run_benchmarks.compare(results(0.120, 0.0001), baseline, 0.25) == \
+        ([], [])
+    # sub-millisecond stages are compared too, unless within their noise
+    assert run_benchmarks.compare(results(0.100, 0.0005), baseline) == \
+        ([('fib', 'check', 0.0001, 0.0005)], [])
+    assert run_benchmarks.compare(results(0.100, 0.0005, 0.0003),
+                                  baseline) == ([], [])
+    # a slowdown within the run stage's noise is not flagged
+    assert run_benchmarks.compare(results(0.1025, 0.0001), baseline, 0.01) \
+        == ([], [])
+    assert run_benchmarks.compare({'benchmarks': {'sort': {'run': {}}}},
+                                  baseline) == \
+        ([], [('sort', 'run', 'not in baseline')])
+
+
+#----------------------------------------------------------------------
+# COMPILER SCALABILITY STRESS TEST
+#----------------------------------------------------------------------
+
+import stress
+
+def test_stress_programs_compile_and_run():
+    for params in [{}, {'structs': 0}, {'depth': 5, 'expr_length': 9},
+                   {'functions': 0}]:
+        source = stress.generate_program(**dict(stress.DEFAULTS, **params))
+        out = io.StringIO()
+        VM(compile_program(source), stdout=out).run()
+    assert out.getvalue() == ''
+    assert 'while' in stress.generate_program(depth=2)
+    assert 'new S3(' in stress.generate_program(structs=4)
+
+def test_stress_fit_flags_superlinear_stages():
+    sizes = [100, 200, 400, 800, 1600]
+    assert stress.fit_exponent(sizes, [3 * n ** 2 for n in sizes]) == pytest.approx(2)
+    times = {'linear': [n * 1e-6 for n in sizes],
+             'nlogn': [n * math.log(n) * 1e-6 for n in sizes],
+             'quadratic': [n * n * 1e-9 for n in sizes]}
+    flags = {stage: slow for stage, (_, slow) in stress.analyze(sizes, times).items()}
+    assert flags == {'linear': False, 'nlogn': False, 'quadratic': True}
+
+def test_stress_sweep_measures_each_stage():
+    tokens, times = stress.sweep('statements', [4, 8], repeat=1, out=None)
+    assert len(tokens) == 2 and tokens[0] < tokens[1]
+    assert set(times) == set(stress.STAGES)
+    assert all(len(ts) == 2 for ts in times.values())
+
+
+#----------------------------------------------------------------------
+# STREAMING IR AND PRINTER OUTPUT
+#----------------------------------------------------------------------
+
+def test_write_listing_matches_repr_and_filters():
+    program = compile_program(LINES_PROGRAM)
+    out = io.StringIO()
+    program.write_listing(out)
+    assert out.getvalue() == repr(program)
+    out = io.StringIO()
+    program.write_listing(out, 'half')
+    assert out.getvalue().startswith('\nFrame half\n')
+    assert 'Frame main' not in out.getvalue()
+    assert out.getvalue() in repr(program)
+    with pytest.raises(MyPLError):
+        program.write_listing(io.StringIO(), 'nope')
+
+def test_print_visitor_writes_to_stream(capsys):
+    ast = ASTParser(Lexer(FileWrapper(io.StringIO(LINES_PROGRAM)))).parse()
+    out = io.StringIO()
+    ast.accept(PrintVisitor(out))
+    assert capsys.readouterr().out == ''
+    assert 'int half(int n) {\n' in out.getvalue()
+
+def test_ir_mode_lists_one_function(tmp_path):
+    path = tmp_path / 'p.mypl'
+    path.write_text(LINES_PROGRAM)
+    result = subprocess.run([sys.executable, 'mypl.py', '--ir', '--function',
+                             'half', str(path)], capture_output=True, text=True,
+                            cwd=os.path.dirname(os.path.abspath(__file__)))
+    assert result.returncode == 0
+    assert 'Frame half' in result.stdout and 'Frame main' not in result.stdout
+    result = subprocess.run([sys.executable, 'mypl.py', '--ir', '--function',
+                             'nope', str(path)], capture_output=True, text=True,
+                            cwd=os.path.dirname(os.path.abspath(__file__)))
+    assert result.returncode == 1 and 'no function named nope' in result.stdout
+
+
+#----------------------------------------------------------------------
+# ALLOCATION-SITE HEAP PROFILER
+#----------------------------------------------------------------------
+
+HEAP_PROGRAM = '''
+struct Node {
+  int val;
+  Node next;
+}
+
+Node build(int n) {
+  Node head = null;
+  for (int i = 0; i < n; i = i + 1) {
+    head = new Node(i, head);
+  }
+  return head;
+}
+
+void main() {
+  Node xs = build(100);
+  array int a = new int[50];
+  list int ys;
+  for (int i = 0; i < 10; i = i + 1) {
+    ys.append(i);
+  }
+}
+'''
+
+def test_allocs_records_struct_type():
+    program = compile_program(HEAP_PROGRAM)
+    allocs = [instr for instr in program.frame_templates['build'].instructions
+              if instr.opcode == OpCode.ALLOCS]
+    assert [instr.operand for instr in allocs] == ['Node']
+    assert 'ALLOCS(Node)' in repr(loads(dumps(program)))
+
+def test_heap_profiler_groups_live_objects_by_site():
+    vm = VM(compile_program(HEAP_PROGRAM))
+    heap_profiler = HeapProfiler()
+    vm.add_hook(heap_profiler)
+    vm.run()
+    profile = heap_profiler.to_dict(vm)
+    sites = {(row['function'], row['type']): row for row in profile['sites']}
+    assert set(sites) == {('build', 'Node'), ('main', 'array'), ('main', 'list')}
+    assert sites[('build', 'Node')]['live_objects'] == 100
+    assert sites[('build', 'Node')]['line'] == 10
+    assert sites[('main', 'array')]['live_bytes'] == 56 + 8 * 50
+    # the list's bytes include its appends
+    assert sites[('main', 'list')]['live_bytes'] == 56 + 8 * 10
+    assert profile['sites'][0]['type'] == 'Node'
+    assert profile['live_objects'] == 102 == profile['peak_objects']
+    assert profile['live_bytes'] == vm.heap_bytes
+    assert profile['types']['Node']['live_objects'] == 100
+    assert profile['peak_sites'][0]['type'] == 'Node'
+    out = io.StringIO()
+    heap_profiler.report(vm, out)
+    assert '102 live objects' in out.getvalue()
+    assert 'build at' in out.getvalue()
+
+
+#----------------------------------------------------------------------
+# HEAP SNAPSHOTS
+#----------------------------------------------------------------------
+
+SNAPSHOT_PROGRAM = '''
+struct Node {
+  int val;
+  Node next;
+}
+
+struct Pair {
+  int val;
+  Node next;
+  array int data;
+}
+
+void main() {
+  Node head = null;
+  array int big = new int[2030];
+  for (int i = 0; i < 40; i = i + 1) {
+    head = new Node(i, head);
+  }
+  Pair p = new Pair(2024, head, big);
+}
+'''
+
+def test_snapshot_records_objects_refs_and_roots(tmp_path):
+    vm = VM(compile_program(SNAPSHOT_PROGRAM))
+    vm.start()
+    assert vm.resume(150) == VMStatus.YIELDED
+    snapshot = take_snapshot(vm)
+    records = {record[0]: record for record in snapshot['objects']}
+    array_oid = [oid for oid, r in records.items() if r[1] == 'array'][0]
+    assert records[array_oid][3] == 56 + 8 * 2030
+    # the array's zeros are not ids, but the roots are
+    assert records[array_oid][4] == []
+    labels = {label for label, _ in snapshot['roots']}
+    assert 'main:var1' in labels and 'main:var0' in labels
+    nodes = [r for r in records.values() if r[1] == 'struct']
+    assert nodes and all(r[2] == 'Node' for r in nodes)
+    assert sum(len(r[4]) for r in nodes) == len(nodes) - 1
+    for path in [tmp_path / 's.json', tmp_path / 's.json.gz']:
+        write_snapshot(snapshot, str(path))
+        assert read_snapshot(str(path)) == snapshot
+
+def test_snapshot_diff_shows_growth_and_retention_paths():
+    vm = VM(compile_program(SNAPSHOT_PROGRAM))
+    heap_profiler = HeapProfiler()
+    vm.add_hook(heap_profiler)
+    vm.start()
+    vm.resume(150)
+    old = take_snapshot(vm, heap_profiler)
+    vm.resume(300)
+    new = take_snapshot(vm, heap_profiler)
+    assert vm.call_stack
+    diff = diff_snapshots(old, new)
+    assert diff['types'][0]['type'] == 'Node'
+    assert diff['types'][0]['objects_delta'] == diff['new_objects'] > 0
+    assert diff['paths'] == [{'path': 'main:var0 -> Node',
+                              'objects': diff['new_objects'],
+                              'bytes': 232 * diff['new_objects']}]
+    vm.resume()
+    final = take_snapshot(vm, heap_profiler)
+    # once main returns, nothing is rooted (the Pair's val of 2024 is the
+    # first object id, so it is conservatively taken as a reference)
+    assert final['roots'] == []
+    pair = [r for r in final['objects'] if r[2] == 'Pair'][0]
+    assert 2024 in pair[4]
+    paths = retention_paths(final)
+    assert set(paths.values()) <= {('(unreachable)', 'Node'),
+                                   ('(unreachable)', 'Pair'),
+                                   ('(unreachable)', 'array')}
+    out = io.StringIO()
+    print_diff(diff_snapshots(old, final), out)
+    assert 'Pair' in out.getvalue() and 'retention path' in out.getvalue()
+    with pytest.raises(MyPLError, match='after the new one'):
+        diff_snapshots(new, old)
+    # the same program in another VM reuses the same object ids
+    other = VM(compile_program(SNAPSHOT_PROGRAM))
+    other.start()
+    other.resume(300)
+    with pytest.raises(MyPLError, match='not of the same VM run'):
+        diff_snapshots(old, take_snapshot(other))
+
+def test_run_snapshotted_takes_rooted_snapshots(tmp_path):
+    vm = VM(compile_program(SNAPSHOT_PROGRAM))
+    vm.start()
+    paths = run_snapshotted(vm, str(tmp_path / 'heap.json.gz'),
+                            every_steps=100)
+    assert not vm.call_stack and len(paths) > 1
+    assert paths[0] == str(tmp_path / 'heap.1.json.gz')
+    first = read_snapshot(paths[0])
+    last = read_snapshot(paths[-1])
+    assert first['roots'] and last['roots']
+    diff = diff_snapshots(first, last)
+    assert diff['new_objects'] > 0
+    assert all('(unreachable)' not in row['path'] for row in diff['paths'])
+
+
+#----------------------------------------------------------------------
+# CHECKPOINT AND RESUME
+#----------------------------------------------------------------------
+
+CHECKPOINT_PROGRAM = '''
+struct Tree {
+  int key;
+  Tree left;
+  Tree right;
+}
+
+Tree insert(Tree t, int key) {
+  if (t == null) {
+    return new Tree(key, null, null);
+  }
+  if (key < t.key) {
+    t.left = insert(t.left, key);
+  }
+  else {
+    t.right = insert(t.right, key);
+  }
+  return t;
+}
+
+void main() {
+  Tree root = null;
+  list double xs;
+  string s = "";
+  for (int i = 0; i < 60; i = i + 1) {
+    root = insert(root, (i * 37) - ((i * 37) / 61) * 61);
+    xs.append(itod(i) / 2.0);
+    s = s + itos(i - (i / 10) * 10);
+    if (i == 30) {
+      print(s + "\\n");
+    }
+  }
+  print(itos(root.key) + " " + dtos(xs.max()) + " " + s + "\\n");
+}
+'''
+
+def run_output(vm):
+    out = io.StringIO()
+    vm.stdout = out
+    vm.resume()
+    return out.getvalue()
+
+def test_checkpoint_resume_matches_uninterrupted_run(tmp_path):
+    program = compile_program(CHECKPOINT_PROGRAM)
+    vm = VM(program)
+    vm.start()
+    expected = run_output(vm)
+    for suffix in ['ckpt', 'ckpt.gz']:
+        path = str(tmp_path / suffix)
+        out = io.StringIO()
+        vm = VM(program, stdout=out)
+        vm.start()
+        # pause mid-call, after some output
+        while not (out.getvalue() and len(vm.call_stack) > 1):
+            assert vm.resume(37) == VMStatus.YIELDED
+        save_checkpoint(vm, path)
+        assert not os.path.exists(path + '.tmp')
+        restored = load_checkpoint(path)
+        assert restored.next_obj_id == vm.next_obj_id
+        assert restored.steps == vm.steps
+        assert restored.heap_bytes == vm.heap_bytes
+        assert out.getvalue() + run_output(restored) == expected
+
+def test_checkpoint_refers_to_compiled_file(tmp_path):
+    program_path = str(tmp_path / 'p.myplc')
+    write_bytecode(compile_program(CHECKPOINT_PROGRAM), program_path)
+    vm = read_bytecode(program_path)
+    vm.stdout = io.StringIO()
+    vm.start()
+    vm.resume(1000)
+    state = checkpoint_state(vm, program_path)
+    assert 'bytecode' not in state['program']
+    assert state['program']['path'] == program_path
+    rest = run_output(vm)
+    restored = restore_state(json.loads(json.dumps(state)))
+    assert run_output(restored) == rest
+    with open(program_path, 'ab') as f:
+        f.write(b'x')
+    with pytest.raises(MyPLError):
+        restore_state(state)
+
+def test_run_checkpointed_writes_periodic_checkpoints(tmp_path):
+    path = str(tmp_path / 'run.ckpt')
+    vm = VM(compile_program(CHECKPOINT_PROGRAM), stdout=io.StringIO())
+    vm.start()
+    run_checkpointed(vm, path, every_steps=500)
+    assert not vm.call_stack
+    # the last checkpoint is from before the end of the run
+    state = read_checkpoint(path)
+    assert state['frames'] and state['steps'] < vm.steps
+    assert state['steps'] >= 500
+
+def test_checkpoint_resume_skips_input_already_read(tmp_path):
+    program = compile_program(
+        'void main() {\n'
+        '  int total = 0;\n'
+        '  for (int i = 0; i < 3; i = i + 1) {\n'
+        '    total = total + stoi(input());\n'
+        '    print(itos(total) + " ");\n'
+        '  }\n'
+        '}\n')
+    out = io.StringIO()
+    vm = VM(program, stdin=io.StringIO('1\n2\n3\n'), stdout=out)
+    vm.start()
+    while vm.lines_read < 2:
+        assert vm.resume(1) == VMStatus.YIELDED
+    path = str(tmp_path / 'run.ckpt')
+    save_checkpoint(vm, path)
+    assert out.getvalue() == '1 3 '
+    restored = load_checkpoint(path, stdin=io.StringIO('1\n2\n3\n'))
+    assert restored.lines_read == 2 and restored.heap_id == vm.heap_id
+    assert run_output(restored) == '6 '
+    with pytest.raises(MyPLError, match='input has only 1'):
+        load_checkpoint(path, stdin=io.StringIO('1\n'))
+
+def test_checkpoint_rejects_incompatible_flags(tmp_path):
+    path = tmp_path / 'p.mypl'
+    path.write_text(CHECKPOINT_PROGRAM)
+    ckpt = str(tmp_path / 'run.ckpt')
+    for flags in [['--checkpoint', ckpt, '--flamegraph', 'out.folded'],
+                  ['--checkpoint', ckpt, '--lazy'],
+                  ['--checkpoint', ckpt, '--ir'],
+                  ['--checkpoint-steps', '10'],
+                  ['--resume', ckpt, '--checkpoint', ckpt]]:
+        result = subprocess.run([sys.executable, 'mypl.py', *flags, str(path)],
+                                capture_output=True, text=True,
+                                cwd=os.path.dirname(os.path.abspath(__file__)))
+        assert result.returncode == 2 and 'error:' in result.stderr
+        assert not os.path.exists(ckpt)
+
+
+#----------------------------------------------------------------------
+# LIVENESS AND DEAD LOCAL CLEARING
+#----------------------------------------------------------------------
+
+LIVENESS_PROGRAM = '''
+void main() {
+  array int big = new int[1000];
+  int total = 0;
+  for (int i = 0; i < 1000; i = i + 1) {
+    big[i] = i;
+  }
+  for (int i = 0; i < 1000; i = i + 1) {
+    total = total + big[i];
+  }
+  int k = 2000;
+  while (k < 2500) {
+    k = k + 1;
+  }
+  print(itos(total));
+}
+'''
+
+def test_dead_reference_local_is_cleared_after_last_use():
+    def big_in_final_loop(clear_dead):
+        vm = VM(compile_program(LIVENESS_PROGRAM, clear_dead=clear_dead),
+                stdout=io.StringIO())
+        vm.start()
+        while vm.resume(50) == VMStatus.YIELDED:
+            frame = vm.call_stack[-1]
+            if frame.variables[2:] == [2250]:
+                return frame.variables[0]
+    assert big_in_final_loop(False) == 2024
+    assert big_in_final_loop(True) == None
+
+def test_clear_dead_preserves_behavior():
+    for source in [CHECKPOINT_PROGRAM, HEAP_PROGRAM, LINES_PROGRAM + '\n']:
+        outputs = []
+        for clear_dead in [False, True]:
+            out = io.StringIO()
+            try:
+                VM(compile_program(source, clear_dead=clear_dead), stdout=out).run()
+            except MyPLError as ex:
+                out.write(str(ex))
+            outputs.append(out.getvalue())
+        assert outputs[0] == outputs[1]
+
+def test_clear_dead_slots_retargets_jumps():
+    # x = new; while (x != null) { x = null }; return 0
+    template = VMFrameTemplate('f', 0, [ALLOCL(), STORE(0), LOAD(0), PUSH(None),
+                                        CMPNE(), JMPF(9), PUSH(None), STORE(0),
+                                        JMP(2), PUSH(0), RET()],
+                               [(0, 1, 1), (9, 2, 1)])
+    # x dies at its only load, as the loop body overwrites it
+    assert clear_dead_slots(template, {0}) == 1
+    ops = [instr.opcode for instr in template.instructions]
+    assert ops[2:5] == [OpCode.LOAD, OpCode.PUSH, OpCode.STORE]
+    assert template.instructions[7].opcode == OpCode.JMPF
+    assert template.instructions[7].operand == 11
+    assert template.instructions[10].operand == 2
+    assert template.line_table == [(0, 1, 1), (11, 2, 1)]
+    assert clear_dead_slots(template, set()) == 0
+
+
+#----------------------------------------------------------------------
+# ESCAPE ANALYSIS AND SCALAR REPLACEMENT
+#----------------------------------------------------------------------
+
+ESCAPE_PROGRAM = '''
+struct Point {
+  int x;
+  int y;
+  Point next;
+}
+
+int dist(int x, int y) {
+  Point p = new Point(x, y, null);
+  p.x = p.x + 1;
+  Point q = new Point(1, 2, null);
+  Point r = new Point(3, 4, q);
+  r.next.x = 7;
+  return ((p.x * p.x) + (p.y * p.y)) + (q.x + r.next.x);
+}
+
+Point keep(int x) {
+  Point p = new Point(x, x, null);
+  Point s = new Point(0, 0, null);
+  if (s != null) {
+    p.y = 0;
+  }
+  return p;
+}
+
+void main() {
+  int total = 0;
+  for (int i = 0; i < 10; i = i + 1) {
+    total = total + dist(i, i + 1);
+  }
+  Point k = keep(5);
+  print(itos(total) + " " + itos(k.x));
+}
+'''
+
+def build_ast(source):
+    ast = ASTParser(Lexer(FileWrapper(io.StringIO(source)))).parse()
+    ast.accept(SemanticChecker())
+    return ast
+
+def test_escape_analysis_finds_non_escaping_structs():
+    fun_defs = {f.fun_name.lexeme: f for f in build_ast(ESCAPE_PROGRAM).fun_defs}
+    # q is stored in r's field, keep's p is returned, s is compared
+    assert non_escaping_structs(fun_defs['dist']) == {'p', 'r'}
+    assert non_escaping_structs(fun_defs['keep']) == set()
+    assert non_escaping_structs(fun_defs['main']) == set()
+
+def test_escape_analysis_skips_redeclared_names():
+    source = '''
+    struct P {int x;}
+    void main() {
+      if (true) {
+        P p = new P(1);
+        print(itos(p.x));
+      }
+      P p = new P(2);
+      f(p);
+    }
+    void f(P p) {}
+    '''
+    fun_defs = {f.fun_name.lexeme: f for f in build_ast(source).fun_defs}
+    assert non_escaping_structs(fun_defs['main']) == set()
+
+def test_scalar_replacement_removes_allocations():
+    outputs = []
+    for scalar_replace in [False, True]:
+        out = io.StringIO()
+        program = compile_program(ESCAPE_PROGRAM, scalar_replace=scalar_replace)
+        vm = VM(program, stdout=out)
+        vm.run()
+        outputs.append((out.getvalue(), vm.heap_objects))
+        ops = [instr.opcode for instr in program.frame_templates['dist'].instructions]
+        if scalar_replace:
+            # only q is still allocated (and r.next.x set through it)
+            assert ops.count(OpCode.ALLOCS) == 1
+            assert ops.count(OpCode.SETF) == 4
+            assert ops.count(OpCode.GETF) == 2
+    assert outputs[0][0] == outputs[1][0] == '910 5'
+    # 10 calls to dist allocated p, q, and r, and keep allocated 2
+    assert outputs[0][1] == 32
+    assert outputs[1][1] == 12
+
+def test_scalar_replacement_preserves_behavior():
+    for source in [CHECKPOINT_PROGRAM, HEAP_PROGRAM, SNAPSHOT_PROGRAM,
+                   LIVENESS_PROGRAM]:
+        outputs = []
+        for scalar_replace in [False, True]:
+            out = io.StringIO()
+            program = compile_program(source, clear_dead=scalar_replace,
+                                      scalar_replace=scalar_replace)
+            VM(program, stdout=out).run()
+            outputs.append(out.getvalue())
+        assert outputs[0] == outputs[1]
+
+
+#----------------------------------------------------------------------
+# FRAME REGIONS
+#----------------------------------------------------------------------
+
+REGION_PROGRAM = '''
+struct Node {
+  int val;
+  Node next;
+}
+
+int sum(int n) {
+  Node head = null;
+  for (int i = 0; i < n; i = i + 1) {
+    head = new Node(i, head);
+  }
+  list int xs;
+  int total = 0;
+  while (head != null) {
+    xs.append(head.val);
+    total = total + head.val;
+    head = head.next;
+  }
+  return total + length(xs);
+}
+
+Node build(int n) {
+  Node head = new Node(0, null);
+  Node tail = head;
+  for (int i = 1; i < n; i = i + 1) {
+    tail.next = new Node(i, null);
+    tail = tail.next;
+  }
+  return head;
+}
+
+void keep(list Node out, int n) {
+  Node t = new Node(n, null);
+  out.append(t);
+  Node u = new Node(n, build(2));
+  u.next.next.next = new Node(n, null);
+}
+
+void main() {
+  int total = 0;
+  for (int i = 0; i < 10; i = i + 1) {
+    total = total + sum(i);
+  }
+  list Node kept;
+  keep(kept, 5);
+  Node b = build(3);
+  print(itos(total) + " " + itos(kept[0].val) + " " + itos(b.next.next.val));
+}
+'''
+
+def region_sites(source, fun_name):
+    ast = build_ast(source)
+    struct_defs = {s.struct_name.lexeme: s for s in ast.struct_defs}
+    fun_def = [f for f in ast.fun_defs if f.fun_name.lexeme == fun_name][0]
+    sites = frame_local_allocations(fun_def, struct_defs)
+    return sorted(type(node).__name__ for node in find_nodes(fun_def)
+                  if id(node) in sites)
+
+def find_nodes(node):
+    # every AST node below (and including) node
+    yield node
+    if isinstance(node, list):
+        for item in node:
+            yield from find_nodes(item)
+    elif hasattr(node, '__dataclass_fields__'):
+        for name in node.__dataclass_fields__:
+            yield from find_nodes(getattr(node, name))
+
+def test_region_analysis_finds_frame_local_allocations():
+    # sum's nodes and list die with it
+    assert region_sites(REGION_PROGRAM, 'sum') == ['NewRValue', 'VarDecl']
+    # build's nodes are returned, t is appended to a parameter, and u's
+    # new node is stored in the result of a call
+    assert region_sites(REGION_PROGRAM, 'build') == []
+    assert region_sites(REGION_PROGRAM, 'keep') == ['NewRValue']
+    # main's list is only passed to a function
+    assert region_sites(REGION_PROGRAM, 'main') == []
+
+def test_regions_free_objects_on_return():
+    results = []
+    for regions in [False, True]:
+        out = io.StringIO()
+        program = compile_program(REGION_PROGRAM, regions=regions)
+        vm = VM(program, stdout=out)
+        vm.run()
+        results.append((out.getvalue(), vm.heap_objects, vm.heap_bytes,
+                        len(vm.struct_heap) + len(vm.array_heap)))
+        ops = [instr.opcode for instr in program.frame_templates['sum'].instructions]
+        assert ops.count(OpCode.REGION) == (2 if regions else 0)
+    assert results[0][0] == results[1][0] == '165 5 2'
+    # sum's 45 nodes and 10 lists plus keep's u are freed
+    assert results[0][1] - results[1][1] == 56
+    assert results[1][1] == results[1][3]
+    assert results[0][2] - results[1][2] == (46 * STRUCT_BYTES +
+                                             10 * LIST_BYTES + 45 * SLOT_BYTES)
+
+def test_regions_survive_checkpoints():
+    vm = VM(compile_program(REGION_PROGRAM, regions=True), stdout=io.StringIO())
+    vm.start()
+    while not vm.call_stack[-1].region:
+        assert vm.resume(7) == VMStatus.YIELDED
+    state = json.loads(json.dumps(checkpoint_state(vm)))
+    assert state['frames'][-1]['region'] == vm.call_stack[-1].region
+    restored = restore_state(state, stdout=io.StringIO())
+    restored.resume()
+    vm.resume()
+    assert restored.stdout.getvalue() == '165 5 2'
+    assert restored.heap_objects == vm.heap_objects